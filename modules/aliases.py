@@ -0,0 +1,88 @@
+# module for the learned product name aliases (typo -> product name from the catalog)
+import json
+import os
+from datetime import date, timedelta
+from prettytable import PrettyTable
+from .const import ALIASES, atomic_write, get_today, logo, clear_console
+from .config import statement_printer
+from .catalog import load_catalog
+
+
+aliases = {} # in-memory copy of aliases.json, loaded once per run
+
+
+def load_aliases()-> dict:
+    """Returns the aliases as dictionary with the entered name as key. Each value holds the product name to use
+    and the date the alias was last used
+    """
+    if not aliases and os.path.exists(ALIASES):
+        with open(ALIASES, 'r') as file:
+            aliases.update(json.load(file))
+    return aliases
+
+
+def save_aliases():
+    """Writes the aliases to aliases.json
+    """
+    atomic_write(ALIASES, json.dumps(load_aliases(), indent=4))
+
+
+def lookup_alias(word:str):
+    """Returns the product name stored for the given word, or None when there is no alias. The last used date is
+    saved at most once per day, so a lookup normally doesn't write anything
+    """
+    alias = load_aliases().get(word)
+    if alias is None:
+        return None
+    if alias['last_used'] != get_today():
+        alias['last_used'] = get_today()
+        save_aliases()
+    return alias['name']
+
+
+def add_alias(word:str, name:str, silent:bool=True):
+    """Stores the given product name for the entered word. Names that are not in the catalog are refused, so an alias always
+    leads to an existing product
+    """
+    if name.lower() not in load_catalog():
+        statement_printer(f'There is no product named {name.lower()} in the catalog.', sound='error')
+        return
+    load_aliases()[word.lower()] = {'name': name.lower(), 'last_used': get_today()}
+    save_aliases()
+    if not silent:
+        statement_printer(f'From now on {word.lower()} will be registered as {name.lower()}.', sound='success')
+
+
+def remove_alias(word:str):
+    """Removes the alias for the given word
+    """
+    if load_aliases().pop(word.lower(), None) is None:
+        statement_printer(f'There is no alias for {word.lower()}.', sound='error')
+        return
+    save_aliases()
+    statement_printer(f'The alias for {word.lower()} has been removed.', sound='success')
+
+
+def prune_aliases(days:int):
+    """Removes the aliases that haven't been used for the given amount of days
+    """
+    cutoff = (date.today() - timedelta(days)).strftime('%Y-%m-%d')
+    unused = [word for word, alias in load_aliases().items() if alias['last_used'] < cutoff]
+    for word in unused:
+        del aliases[word]
+    save_aliases()
+    statement_printer(f'Removed {len(unused)} alias(es) that were not used since {cutoff}.', sound='success')
+
+
+def display_aliases():
+    """Prints all aliases as a table
+    """
+    x = PrettyTable()
+    x.field_names = ['Entered name', 'Product name', 'Last used']
+    x.align = 'l'
+    for word, alias in sorted(load_aliases().items()):
+        x.add_row([word, alias['name'], alias['last_used']])
+    clear_console()
+    logo(pause=False)
+    print('Product name aliases:\n')
+    print(x, '\n')
@@ -0,0 +1,193 @@
+# module for moving settled lots and their sales out of the ledgers into the archive, and for reading them back in reports
+import csv
+import io
+import json
+import os
+import pandas as pd
+from datetime import timedelta
+from tabulate import tabulate
+from .functions import read_system_date, string_to_date, date_to_string
+from .const import BOUGHT_CSV, SOLD_CSV, ARCHIVE_DIR, ARCHIVE_BOUGHT, ARCHIVE_SOLD, ARCHIVE_STATE, BOUGHT_HEADER
+from .const import read_archive_state, write_rows, atomic_write, ledger_lock, logo, clear_console
+from .config import statement_printer
+from .binary import load_ledger
+from .loader import load_csv, parse_prices
+
+
+ARCHIVES = {BOUGHT_CSV: ARCHIVE_BOUGHT, SOLD_CSV: ARCHIVE_SOLD}
+
+
+def archive_cutoff():
+    """Returns the date before which settled rows were archived, or None when nothing was archived yet
+    """
+    cutoff = read_archive_state().get('cutoff')
+    return string_to_date(cutoff) if cutoff else None
+
+
+def reaches_archive(first=None)-> bool:
+    """Returns True when a report starting at the given date (None for all history) needs the archived rows. Every archived row
+    has its dates before the cutoff, so only reports that start before the cutoff do
+    """
+    cutoff = archive_cutoff()
+    return cutoff is not None and (first is None or first < cutoff)
+
+
+def ledger_files(csv_file, first=None)-> list:
+    """Returns the files to read for a report starting at the given date: the ledger, preceded by its archive when needed
+    """
+    archive = ARCHIVES[csv_file]
+    if reaches_archive(first) and os.path.exists(archive):
+        return [archive, csv_file]
+    return [csv_file]
+
+
+def load_history(csv_file, first=None):
+    """Returns the ledger as dataframe like load_ledger(), including the archived rows when the report starts before the archive cutoff.
+    A row that is both in the archive and in the ledger (after an interrupted compact) is only counted once
+    """
+    df = load_ledger(csv_file)
+    files = ledger_files(csv_file, first)
+    if len(files) == 1:
+        return df
+    df = pd.concat([load_csv(files[0]), df], ignore_index=True)
+    return df.drop_duplicates(subset='id', keep='last', ignore_index=True)
+
+
+def read_chunks(csv_file, first=None, chunksize:int=100000):
+    """Yields the ledger in chunks of rows as dataframes, starting with the archive when the report starts before the archive cutoff.
+    The dates are kept as YYYY-MM-DD strings, the prices are converted to integer cents
+    """
+    for path in ledger_files(csv_file, first):
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            yield parse_prices(chunk)
+
+
+def get_archived_expired_lots(day, first=None)-> list:
+    """Returns the archived lots that expired unsold before the given day, with the same keys as the rows from the expiry index.
+    With the first argument only lots that expired on or after that date are returned
+    """
+    if not reaches_archive(first) or not os.path.exists(ARCHIVE_BOUGHT):
+        return []
+    bought = load_csv(ARCHIVE_BOUGHT)
+    sold = load_csv(ARCHIVE_SOLD) if os.path.exists(ARCHIVE_SOLD) else pd.DataFrame(columns=['bought_id'])
+    bought = bought[~bought['id'].isin(sold['bought_id']) & (bought['expiration_date'] < pd.Timestamp(day))]
+    if first:
+        bought = bought[bought['expiration_date'] >= pd.Timestamp(first)]
+    bought = bought.assign(buy_date=bought['buy_date'].dt.date, expiration_date=bought['expiration_date'].dt.date)
+    return bought[list(BOUGHT_HEADER)].to_dict('records')
+
+
+def read_ledger_rows(csv_file)-> tuple:
+    """Returns the header and the rows of a ledger as lists of strings, so archived rows are written back exactly as they were
+    """
+    with open(csv_file, 'r', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        return header, [row for row in reader if row]
+
+
+def read_archived_ids(archive)-> set:
+    """Returns the ids in the given archive file
+    """
+    if not os.path.exists(archive):
+        return set()
+    with open(archive, 'r', newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return {row[0] for row in reader if row}
+
+
+def split_settled(bought:tuple, sold:tuple, cutoff:str)-> tuple:
+    """Splits the rows of both ledgers in settled rows and rows to keep. A lot is settled when its last sale was before the cutoff,
+    or when it was never sold and expired before the cutoff. The sales of a settled lot are settled as well.
+    Returns the settled and the kept rows of bought.csv and sold.csv
+    """
+    bought_header, bought_rows = bought
+    sold_header, sold_rows = sold
+    id_column, expiration_column = bought_header.index('id'), bought_header.index('expiration_date')
+    bought_id_column, sell_date_column = sold_header.index('bought_id'), sold_header.index('sell_date')
+
+    last_sale = {} # bought id -> date of the last sale, dates compared as YYYY-MM-DD strings
+    for row in sold_rows:
+        if row[sell_date_column] > last_sale.get(row[bought_id_column], ''):
+            last_sale[row[bought_id_column]] = row[sell_date_column]
+
+    settled_ids = set()
+    for row in bought_rows:
+        if last_sale.get(row[id_column], row[expiration_column]) < cutoff:
+            settled_ids.add(row[id_column])
+
+    settled_bought = [row for row in bought_rows if row[id_column] in settled_ids]
+    kept_bought = [row for row in bought_rows if row[id_column] not in settled_ids]
+    settled_sold = [row for row in sold_rows if row[bought_id_column] in settled_ids]
+    kept_sold = [row for row in sold_rows if row[bought_id_column] not in settled_ids]
+    return settled_bought, kept_bought, settled_sold, kept_sold
+
+
+def rewrite_ledger(csv_file, header:list, rows:list):
+    """Replaces the ledger atomically by the header and the given rows
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=',')
+    writer.writerow(header)
+    writer.writerows(rows)
+    atomic_write(csv_file, buffer.getvalue())
+
+
+def archive_rows(csv_file, header:list, rows:list):
+    """Appends the rows to the archive of the given ledger, leaving out rows that were archived before
+    """
+    archive = ARCHIVES[csv_file]
+    if not os.path.exists(archive):
+        rewrite_ledger(archive, header, [])
+    archived = read_archived_ids(archive)
+    write_rows(archive, [row for row in rows if row[0] not in archived])
+
+
+def compact_ledgers(keep:int=30, dry_run:bool=False)-> tuple:
+    """Moves the lots that were settled more than the given amount of days before the current system date, and their sales, from the ledgers
+    to the archive in data/archive. The ledgers keep the stock and the recent history, so scanning the available stock stays fast.
+    Reports that start before the cutoff read the archive as well.
+
+    The archive is written before the ledgers are replaced, so an interruption never loses rows. Ids continue after the last id,
+    also when every row was archived. With dry_run nothing is moved. Returns the cutoff date and per ledger the amount of archived and kept rows
+    """
+    now = read_system_date()
+    cutoff = now - timedelta(keep)
+    with ledger_lock(): # no buys or sales can be added while the ledgers are split
+        bought, sold = read_ledger_rows(BOUGHT_CSV), read_ledger_rows(SOLD_CSV)
+        settled_bought, kept_bought, settled_sold, kept_sold = split_settled(bought, sold, date_to_string(cutoff))
+        if not dry_run and (settled_bought or settled_sold):
+            if not os.path.exists(ARCHIVE_DIR):
+                os.makedirs(ARCHIVE_DIR)
+            state = read_archive_state()
+            last_id = state.get('last_id', {})
+            for csv_file, (header, rows) in ((BOUGHT_CSV, bought), (SOLD_CSV, sold)):
+                if rows:
+                    name = os.path.basename(csv_file)
+                    last_id[name] = max(last_id.get(name, 0), int(rows[-1][0]))
+            archive_rows(BOUGHT_CSV, bought[0], settled_bought)
+            archive_rows(SOLD_CSV, sold[0], settled_sold)
+            atomic_write(ARCHIVE_STATE, json.dumps({
+                'cutoff': max(state.get('cutoff', ''), date_to_string(cutoff)),
+                'last_id': last_id
+                }, indent=4))
+            rewrite_ledger(SOLD_CSV, sold[0], kept_sold) # sales first, so the ledgers never hold a sale without its lot
+            rewrite_ledger(BOUGHT_CSV, bought[0], kept_bought)
+    return cutoff, [
+        ['bought.csv', len(settled_bought), len(kept_bought)],
+        ['sold.csv', len(settled_sold), len(kept_sold)]
+        ]
+
+
+def compact(keep:int=30, dry_run:bool=False):
+    """Moves the settled lots and their sales to the archive, see compact_ledgers(), and prints the amount of archived and kept rows.
+    With dry_run only the amount of rows that would be moved is printed
+    """
+    cutoff, rows = compact_ledgers(keep, dry_run)
+    clear_console()
+    logo()
+    print(f'{"Dry run: rows" if dry_run else "Rows"} settled before {cutoff}:')
+    print(tabulate(rows, headers=['Ledger', 'Archived', 'Kept'], tablefmt='psql'), '\n')
+    if not dry_run:
+        statement_printer(f'===> Moved {rows[0][1] + rows[1][1]} row(s) to {ARCHIVE_DIR}.', sound='success')
@@ -0,0 +1,90 @@
+# module for copying the buy date and buy price of the bought items into the sold rows, so profit can be calculated from sold.csv alone
+import csv
+import os
+from tabulate import tabulate
+from .const import BOUGHT_CSV, SOLD_CSV, ARCHIVE_BOUGHT, ARCHIVE_SOLD, ledger_lock, logo, clear_console
+from .config import statement_printer
+from .archive import read_ledger_rows, rewrite_ledger
+
+
+BUY_COLUMNS = ('buy_date', 'buy_price') # the columns of sold.csv that are copied from bought.csv, see store_sold_lines()
+
+
+def read_buy_values()-> dict:
+    """Returns the buy date and price of every bought item, from the ledger and the archive, as dictionary with the bought id as key.
+    The values are kept as the strings from the file, so they are copied exactly
+    """
+    values = {}
+    for csv_file in (ARCHIVE_BOUGHT, BOUGHT_CSV):
+        if os.path.exists(csv_file):
+            with open(csv_file, 'r', newline='') as file:
+                reader = csv.reader(file)
+                header = next(reader)
+                id_column, date_column, price_column = header.index('id'), header.index('buy_date'), header.index('price')
+                for row in reader:
+                    if row:
+                        values[row[id_column]] = (row[date_column], row[price_column])
+    return values
+
+
+def backfill_ledger(csv_file, buy_values:dict)-> tuple:
+    """Adds the buy columns to the header of a sold ledger when missing and fills the empty buy values. The file is only rewritten
+    when something changed. Returns the amount of filled rows and the amount of rows of which the bought id doesn't exist
+    """
+    header, rows = read_ledger_rows(csv_file)
+    changed = not all(name in header for name in BUY_COLUMNS)
+    header = header + [name for name in BUY_COLUMNS if name not in header]
+    bought_id_column = header.index('bought_id')
+    date_column, price_column = header.index('buy_date'), header.index('buy_price')
+    filled, unknown = 0, 0
+    for row in rows:
+        row.extend([''] * (len(header) - len(row)))
+        if row[date_column] and row[price_column]:
+            continue
+        if row[bought_id_column] not in buy_values:
+            unknown += 1 # left empty, the check command reports these rows
+            continue
+        row[date_column], row[price_column] = buy_values[row[bought_id_column]]
+        filled += 1
+    if changed or filled:
+        rewrite_ledger(csv_file, header, rows)
+    return filled, unknown
+
+
+def needs_backfill()-> bool:
+    """Returns True when sold.csv doesn't have the buy columns yet (the format before they were added)
+    """
+    with open(SOLD_CSV, 'r', newline='') as file:
+        header = next(csv.reader(file), [])
+    return not all(name in header for name in BUY_COLUMNS)
+
+
+def fill_sold_ledgers()-> list:
+    """Backfills sold.csv and its archive, see backfill_ledger(). Returns a row per ledger with the amount of filled and unknown rows
+    """
+    with ledger_lock(): # no sales can be added while sold.csv is rewritten
+        buy_values = read_buy_values()
+        return [
+            [os.path.basename(csv_file) if csv_file == SOLD_CSV else f'archive/{os.path.basename(csv_file)}', *backfill_ledger(csv_file, buy_values)]
+            for csv_file in (ARCHIVE_SOLD, SOLD_CSV) if os.path.exists(csv_file)
+            ]
+
+
+def check_sold_columns():
+    """Converts sold.csv and its archive to the format with buy columns, once. Sales are only appended in the new format
+    """
+    if needs_backfill():
+        fill_sold_ledgers()
+        print(f'Added {" and ".join(BUY_COLUMNS)} to {SOLD_CSV}.')
+
+
+def backfill():
+    """Copies the buy date and price of the bought items into the sold rows that don't have them yet, in sold.csv and its archive,
+    and prints the amount of filled rows per ledger. Sales of bought ids that don't exist are left empty and counted
+    """
+    rows = fill_sold_ledgers()
+    clear_console()
+    logo()
+    print('Buy dates and prices copied into the sold ledgers:')
+    print(tabulate(rows, headers=['Ledger', 'Filled', 'Unknown bought id'], tablefmt='psql'), '\n')
+    statement_printer(f'===> Filled {sum(row[1] for row in rows)} row(s).', sound='success')
@@ -0,0 +1,180 @@
+# module for the fixed-width binary copies of the ledgers, read via mmap as NumPy structured arrays
+import os
+import struct
+import numpy as np
+import pandas as pd
+from datetime import date
+from .const import BOUGHT_CSV, SOLD_CSV, BOUGHT_BIN, SOLD_BIN, PRICE_COLUMNS, to_cents, atomic_write, ledger_lock
+from .indexes import ledger_size, read_rows_from, csv_tail
+from .loader import load_csv
+
+
+# one record per ledger row: ids as integers, dates as day ordinals (date.toordinal()) and prices as integer cents. Empty values, the buy
+# columns of a sale of which the bought id doesn't exist, are stored as 0 cents and 1970-01-01
+BOUGHT_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('product_id', '<i4'),
+    ('buy_date', '<i4'),
+    ('price', '<i8'),
+    ('expiration_date', '<i4')
+    ])
+
+SOLD_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('bought_id', '<i8'),
+    ('product_id', '<i4'),
+    ('sell_date', '<i4'),
+    ('sell_price', '<i8'),
+    ('buy_date', '<i4'),
+    ('buy_price', '<i8')
+    ])
+
+LEDGERS = {BOUGHT_CSV: (BOUGHT_BIN, BOUGHT_DTYPE), SOLD_CSV: (SOLD_BIN, SOLD_DTYPE)}
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# file header: magic, version, amount of records, size of the csv file that is covered and the last 64 bytes before that size
+HEADER = struct.Struct('<4sHQQ64s')
+HEADER_SIZE = 128 # the records start at a fixed offset, the rest of the header is padding
+MAGIC = b'SPLB'
+VERSION = 2 # version 2 added the buy columns to the sold records
+
+
+def read_header(bin_file):
+    """Returns the amount of records, the covered csv size and the csv tail from the header of a binary ledger,
+    or None when the file is missing or not a binary ledger of the current version
+    """
+    if not os.path.exists(bin_file):
+        return None
+    with open(bin_file, 'rb') as file:
+        data = file.read(HEADER.size)
+    if len(data) < HEADER.size:
+        return None
+    magic, version, rows, csv_size, tail = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    return rows, csv_size, tail.rstrip(b'\0')
+
+
+def pack_header(rows:int, csv_size:int, tail:bytes)-> bytes:
+    """Returns the header of a binary ledger, padded to HEADER_SIZE
+    """
+    return HEADER.pack(MAGIC, VERSION, rows, csv_size, tail).ljust(HEADER_SIZE, b'\0')
+
+
+def rows_to_records(rows:list, header:list, dtype)-> np.ndarray:
+    """Converts rows from a csv ledger (lists of strings) to records. Columns are looked up by name in the csv header
+    """
+    days = {}
+    def to_day(text):
+        if text not in days:
+            days[text] = date.fromisoformat(text).toordinal()
+        return days[text]
+    records = np.zeros(len(rows), dtype=dtype)
+    for name in dtype.names:
+        position = header.index(name)
+        if name in PRICE_COLUMNS:
+            records[name] = [to_cents(row[position] or 0) for row in rows]
+        elif name.endswith('_date'):
+            records[name] = [to_day(row[position]) if row[position] else EPOCH_ORDINAL for row in rows]
+        else:
+            records[name] = [int(row[position]) for row in rows]
+    return records
+
+
+def frame_to_records(df, dtype)-> np.ndarray:
+    """Converts a ledger loaded by load_csv() to records, without a Python loop over the rows
+    """
+    records = np.zeros(len(df), dtype=dtype)
+    for name in dtype.names:
+        if name.endswith('_date'):
+            records[name] = (df[name] - pd.Timestamp('1970-01-01')).dt.days.fillna(0).to_numpy() + EPOCH_ORDINAL
+        else:
+            records[name] = df[name].to_numpy()
+    return records
+
+
+def rebuild_binary(csv_file):
+    """Writes the binary ledger from scratch, after reading the whole csv file once. Used the first time and when
+    the csv file was rewritten instead of appended to
+    """
+    bin_file, dtype = LEDGERS[csv_file]
+    size = ledger_size(csv_file)
+    records = frame_to_records(load_csv(csv_file), dtype)
+    atomic_write(bin_file, pack_header(len(records), size, csv_tail(csv_file, size)) + records.tobytes())
+
+
+def appended_records(csv_file, offset:int)-> np.ndarray:
+    """Returns the csv rows after the given byte offset of the ledger as records of its binary dtype
+    """
+    with open(csv_file, 'r', newline='') as file:
+        header = file.readline().strip().split(',')
+    return rows_to_records(list(read_rows_from(csv_file, offset)), header, LEDGERS[csv_file][1])
+
+
+def append_binary(csv_file, rows:int, csv_size:int):
+    """Appends the csv rows after the given offset to the binary ledger. The records are written and flushed before the header
+    is updated, so after a crash the header still describes a consistent file and the rows are appended again next time
+    """
+    bin_file, dtype = LEDGERS[csv_file]
+    records = appended_records(csv_file, csv_size)
+    size = ledger_size(csv_file)
+    with open(bin_file, 'r+b') as file:
+        file.seek(HEADER_SIZE + rows * dtype.itemsize)
+        file.write(records.tobytes())
+        file.truncate()
+        file.flush()
+        os.fsync(file.fileno())
+        file.seek(0)
+        file.write(pack_header(rows + len(records), size, csv_tail(csv_file, size)))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def sync_binary(csv_file)-> int:
+    """Brings the binary ledger up to date with the csv file and returns the amount of records. The csv file stays the ledger
+    that is written to: rows appended since the last sync are added to the binary ledger, a rewritten csv file is converted again
+    """
+    bin_file, dtype = LEDGERS[csv_file]
+    with ledger_lock(): # no process can append to the csv file or the binary ledger meanwhile
+        header = read_header(bin_file)
+        size = ledger_size(csv_file)
+        if header:
+            rows, csv_size, tail = header
+            if csv_size == size and csv_tail(csv_file, size) == tail:
+                return rows
+            if 0 < csv_size < size and csv_tail(csv_file, csv_size) == tail:
+                append_binary(csv_file, rows, csv_size)
+                return read_header(bin_file)[0]
+        rebuild_binary(csv_file)
+        return read_header(bin_file)[0]
+
+
+def map_ledger(csv_file)-> np.ndarray:
+    """Returns the rows of the given ledger as NumPy structured array that is mapped from the binary ledger, so nothing is parsed
+    or copied until it is used. Filtering on the columns is vectorized, for example records[records['product_id'] == 3]
+    """
+    bin_file, dtype = LEDGERS[csv_file]
+    rows = sync_binary(csv_file)
+    if not rows:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(bin_file, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(rows,))
+
+
+def records_to_frame(records:np.ndarray):
+    """Converts records to a dataframe with the same columns and types as load_csv() returns: prices as integer cents and dates as datetime.
+    Empty dates, stored as 1970-01-01, become NaT like in load_csv()
+    """
+    columns = {}
+    for name in records.dtype.names:
+        if name.endswith('_date'):
+            columns[name] = (records[name] - EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[ns]')
+            columns[name][records[name] == EPOCH_ORDINAL] = np.datetime64('NaT')
+        else:
+            columns[name] = records[name].astype('int64')
+    return pd.DataFrame(columns)
+
+
+def load_ledger(csv_file):
+    """Returns the given ledger as dataframe, read from the binary ledger
+    """
+    return records_to_frame(map_ledger(csv_file))
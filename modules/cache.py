@@ -0,0 +1,154 @@
+# module for caching the output of reports over a date range
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import date
+from .const import CACHE_DIR, CACHE_INDEX, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, BOUGHT_CSV, SOLD_CSV, atomic_write, clear_console
+from .indexes import ledger_size, ledger_tail, appended_since, read_rows_from
+from .config import ui_sounds
+
+
+class Tee(io.StringIO):
+    """Text buffer that also writes everything to the terminal, used to print a report while its output is captured for the cache
+    """
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(text)
+        return super().write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def cache_key(report:str, params:dict)-> str:
+    """Returns the key of a report: a hash of the report type and its parameters
+    """
+    return hashlib.sha1(json.dumps([report, params], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_cache_index()-> dict:
+    """Returns the cache index: per key the covered date range, the ledger state at the time the report was made, the size
+    and the last time the entry was used
+    """
+    if not os.path.exists(CACHE_INDEX):
+        return {}
+    try:
+        with open(CACHE_INDEX, 'r') as file:
+            return json.load(file)
+    except ValueError:
+        return {}
+
+
+def save_cache_index(index:dict):
+    """Writes the cache index and removes the least recently used entries when there are too many, or when the cached reports
+    together are larger than the maximum size
+    """
+    entries = sorted(index.items(), key=lambda item: item[1]['last_used'], reverse=True)
+    total = 0
+    for position, (key, entry) in enumerate(entries):
+        total += entry['size']
+        if position >= CACHE_MAX_ENTRIES or total > CACHE_MAX_BYTES:
+            remove_cache_entry(index, key)
+    atomic_write(CACHE_INDEX, json.dumps(index))
+
+
+def remove_cache_entry(index:dict, key:str):
+    """Removes an entry from the index and deletes the cached report
+    """
+    index.pop(key, None)
+    cache_file = os.path.join(CACHE_DIR, f'{key}.txt')
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+
+
+def ledger_state()-> dict:
+    """Returns the size and tail of both ledgers, used to find the rows that were added after a report was cached
+    """
+    bought_size, sold_size = ledger_size(BOUGHT_CSV), ledger_size(SOLD_CSV)
+    return {
+        'bought_size': bought_size,
+        'bought_tail': ledger_tail(BOUGHT_CSV, bought_size),
+        'sold_size': sold_size,
+        'sold_tail': ledger_tail(SOLD_CSV, sold_size)
+        }
+
+
+def touches_range(entry:dict)-> bool:
+    """Returns True when the ledgers changed in a way that affects the date range of the cache entry. Only the rows added since
+    the report was cached are read: a buy or sell on a date outside the range keeps the entry valid. A ledger that was rewritten
+    invalidates every entry
+    """
+    state = entry['state']
+    if not appended_since(BOUGHT_CSV, state['bought_size'], state['bought_tail']) or not appended_since(SOLD_CSV, state['sold_size'], state['sold_tail']):
+        return True
+    for row in read_rows_from(BOUGHT_CSV, state['bought_size']):
+        if entry['first'] <= row[2] <= entry['last']: # buy date, compared as YYYY-MM-DD string
+            return True
+    for row in read_rows_from(SOLD_CSV, state['sold_size']):
+        if entry['first'] <= row[3] <= entry['last']: # sell date
+            return True
+    return False
+
+
+def read_cache(key:str):
+    """Returns the cached report for the key, or None when there is no valid entry. Entries that are affected by new rows in
+    the ledgers are removed
+    """
+    index = load_cache_index()
+    entry = index.get(key)
+    if entry is None:
+        return None
+    cache_file = os.path.join(CACHE_DIR, f'{key}.txt')
+    if not os.path.exists(cache_file) or touches_range(entry):
+        remove_cache_entry(index, key)
+        save_cache_index(index)
+        return None
+    with open(cache_file, 'r') as file:
+        text = file.read()
+    entry['state'] = ledger_state() # the new rows didn't affect this entry, no need to read them again next time
+    entry['last_used'] = time.time()
+    save_cache_index(index)
+    return text
+
+
+def store_cache(key:str, first:date, last:date, state:dict, text:str):
+    """Saves the report output and adds it to the index
+    """
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    atomic_write(os.path.join(CACHE_DIR, f'{key}.txt'), text)
+    index = load_cache_index()
+    index[key] = {
+        'first': str(first),
+        'last': str(last),
+        'state': state,
+        'size': len(text),
+        'last_used': time.time()
+        }
+    save_cache_index(index)
+
+
+def cached_report(report:str, function, start_date, end_date, **kwargs):
+    """Prints a report over the given date range from the cache. When the report isn't cached yet, or the ledgers changed within
+    the date range, the report function is called and its output is cached while it is printed. Reports with an export are never cached
+    """
+    key = cache_key(report, {'start_date': start_date, 'end_date': end_date, **kwargs})
+    text = read_cache(key)
+    if text is not None:
+        clear_console()
+        print(text, end='')
+        ui_sounds('success')
+        return
+    state = ledger_state()
+    output = Tee(sys.stdout)
+    with redirect_stdout(output):
+        function(start_date=start_date, end_date=end_date, **kwargs)
+    store_cache(key, start_date, end_date, state, output.getvalue())
+
@@ -0,0 +1,136 @@
+# module for the product catalog. Every product name is stored once in catalog.csv with a stable integer id,
+# the ledgers only store that id.
+import csv
+import io
+import os
+from .const import CATALOG_CSV, CATALOG_HEADER, GROCERY_NAMES, BOUGHT_CSV, SOLD_CSV, BOUGHT_HEADER, SOLD_HEADER, write_rows, atomic_write, ledger_lock
+
+
+catalog = {} # in-memory copy of catalog.csv: product name -> product id, loaded once per run
+product_names = {} # the same catalog reversed: product id -> product name
+
+
+def read_grocery_names()-> list:
+    """Returns the unique product names from groceries.csv in lowercase, in the order of that file
+    """
+    names = {}
+    if os.path.exists(GROCERY_NAMES):
+        with open(GROCERY_NAMES, 'r') as file:
+            for row in csv.reader(file):
+                if row:
+                    names[row[0].lower()] = None
+    return list(names)
+
+
+def seed_catalog():
+    """Creates catalog.csv and assigns an id to every unique product name from groceries.csv, in the order of that file
+    """
+    names = read_grocery_names()
+    write_rows(CATALOG_CSV, [CATALOG_HEADER.keys()] + [[product_id, name] for product_id, name in enumerate(names, start=1)])
+    print(f'Created {CATALOG_CSV}.')
+
+
+def refresh_catalog()-> int:
+    """Adds the names from groceries.csv that are not in the catalog yet, for example after a new groceries.csv was downloaded.
+    Returns the amount of added products
+    """
+    names = read_grocery_names()
+    new = [name for name in names if name not in load_catalog(reload=True)]
+    get_product_ids(new)
+    return len(new)
+
+
+def load_catalog(reload:bool=False)-> dict:
+    """Returns the catalog as dictionary with the product name as key and the product id as value. The file is read only once
+    per run, new products are added to the in-memory copy by get_product_id(). Use reload to read the file again
+    """
+    if reload:
+        catalog.clear()
+        product_names.clear()
+    if not catalog:
+        if not os.path.exists(CATALOG_CSV):
+            seed_catalog()
+        with open(CATALOG_CSV, 'r') as file:
+            for row in csv.DictReader(file):
+                catalog[row['product_name']] = int(row['product_id'])
+                product_names[int(row['product_id'])] = row['product_name']
+    return catalog
+
+
+def get_product_names()-> dict:
+    """Returns the catalog reversed: the product id as key and the product name as value. Used to join the names
+    back to the ledger data at render time
+    """
+    load_catalog()
+    return product_names
+
+
+def get_product_name(product_id)-> str:
+    """Returns the product name for the given product id
+    """
+    return get_product_names().get(int(product_id), str(product_id))
+
+
+def get_product_id(name:str, create:bool=True):
+    """Returns the id of the given product name. Unknown products are added to the catalog when create is True,
+    otherwise None is returned. New products are added while holding the ledger lock, after reading the products that other
+    processes may have added in the meantime
+    """
+    name = name.lower()
+    products = load_catalog()
+    if name not in products and create:
+        with ledger_lock():
+            products = load_catalog(reload=True)
+            if name not in products:
+                products[name] = max(products.values(), default=0) + 1
+                product_names[products[name]] = name
+                write_rows(CATALOG_CSV, [[products[name], name]])
+    return products.get(name)
+
+
+def get_product_ids(names:list, create:bool=True)-> dict:
+    """Returns the id of every given product name as dictionary, like get_product_id(), with None for unknown names when create is False.
+    All new products are added with one reload of the catalog and one write, so importing many new products stays fast
+    """
+    names = [name.lower() for name in names]
+    products = load_catalog()
+    if create and any(name not in products for name in names):
+        with ledger_lock():
+            products = load_catalog(reload=True)
+            next_id = max(products.values(), default=0) + 1
+            rows = []
+            for name in dict.fromkeys(names):
+                if name not in products:
+                    products[name], product_names[next_id] = next_id, name
+                    rows.append([next_id, name])
+                    next_id += 1
+            write_rows(CATALOG_CSV, rows)
+    return {name: products.get(name) for name in names}
+
+
+def migrate_ledger(csv_file, header:dict):
+    """Rewrites a ledger that still stores product names (the format before the catalog existed) with product ids.
+    The new file replaces the old one atomically. Columns that were added later are left out, they are added by their own migration
+    """
+    with open(csv_file, 'r') as file:
+        reader = csv.DictReader(file)
+        if 'product_name' not in reader.fieldnames:
+            return
+        columns = [key for key in header.keys() if key in reader.fieldnames or key == 'product_id']
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=',')
+        writer.writerow(columns)
+        for row in reader:
+            row['product_id'] = get_product_id(row['product_name'])
+            writer.writerow([row[key] for key in columns])
+    atomic_write(csv_file, buffer.getvalue())
+    print(f'Converted {csv_file} to product ids.')
+
+
+def check_catalog():
+    """Makes sure the catalog exists and converts ledgers that still contain product names
+    """
+    load_catalog()
+    with ledger_lock():
+        migrate_ledger(BOUGHT_CSV, BOUGHT_HEADER)
+        migrate_ledger(SOLD_CSV, SOLD_HEADER)
@@ -2,7 +2,8 @@
 import chime
 import time
 import json
-from .const import SETTINGS, logo, clear_console
+from .const import SETTINGS, CONFIG_DATA, logo, clear_console, atomic_write
+from .feed import emit
 from prettytable import PrettyTable
 
 
@@ -56,19 +57,24 @@ def ui_sounds(message_type:str):
 
 
 def read_config()-> dict:
-    """Reads the settings.json file and returns the items as dictionary
+    """Reads the settings.json file and returns the items as dictionary. Settings that were added after the file was created get their default value
     """
     with open(SETTINGS, 'r') as json_file:
-        return json.load(json_file)
+        return {**CONFIG_DATA, **json.load(json_file)}
     
 
-def write_config(sound:bool=None, printer:bool=None, sound_theme:str=None, adv_time:bool=None, date_alert:bool=None, validate_names:bool=None):
-    """Saves the configuration in settings.json
+def write_config(sound:bool=None, printer:bool=None, sound_theme:str=None, adv_time:bool=None, date_alert:bool=None, validate_names:bool=None, log_commands:bool=None):
+    """Saves the configuration in settings.json. The file is replaced atomically, so a crash never leaves a half written file.
+    Changed values are added to the event feed
     """
     def save_config():
-        with open(SETTINGS, 'w') as json_file:
-            json.dump(data, json_file, indent=4)
+        changes = {key: value for key, value in data.items() if saved.get(key) != value}
+        atomic_write(SETTINGS, json.dumps(data, indent=4))
+        if changes:
+            emit('config', changes)
+            saved.update(changes)
     data = read_config()
+    saved = dict(data)
     if printer != None:
         data['printer'] = printer
         save_config()
@@ -102,6 +108,10 @@ def write_config(sound:bool=None, printer:bool=None, sound_theme:str=None, adv_t
         data['validate_names'] = validate_names
         save_config()
         statement_printer(f'The name validation function is set to {read_config()["validate_names"]}.', sound='success')
+    if log_commands != None:
+        data['log_commands'] = log_commands
+        save_config()
+        statement_printer(f'The command log is set to {read_config()["log_commands"]}.', sound='success')
 
 
 # takes the header dictionary, removes underscores and adds captions.
@@ -1,26 +1,62 @@
-import os, json, csv, sys, time, requests, urllib3
+import os, io, json, csv, sys, time, requests, urllib3
 from datetime import date
 from time import sleep
+from contextlib import contextmanager
 import platform
 from os import system
+try:
+    import fcntl # file locking on Linux and macOS
+except ImportError:
+    import msvcrt # file locking on Windows
+    fcntl = None
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning) # disable warning when working with local certificate
 
-DATA_DIR = os.path.join(os.getcwd(), 'data') # directory for storing data files
+DATA_DIR_ENV = 'SUPERPY_DATA_DIR' # environment variable that points the app to another data directory, used by replay
+REPLAY_ENV = 'SUPERPY_REPLAY' # environment variable that is set for the commands run by replay
+DATA_DIR = os.environ.get(DATA_DIR_ENV) or os.path.join(os.getcwd(), 'data') # directory for storing data files
 BOUGHT_CSV = os.path.join(DATA_DIR, 'bought.csv') # csv file for storing bought products
 SOLD_CSV = os.path.join(DATA_DIR, 'sold.csv') # csv file for storing sold products
 TODAY_TXT = os.path.join(DATA_DIR, 'today.txt') # txt file for storing the program's current date
 SETTINGS = os.path.join(DATA_DIR, 'settings.json') # json file for storing the app settings
 GROCERY_NAMES = os.path.join(DATA_DIR, 'groceries.csv')
+CATALOG_CSV = os.path.join(DATA_DIR, 'catalog.csv') # csv file for storing the product catalog (product id and name)
+ALIASES = os.path.join(DATA_DIR, 'aliases.json') # json file for storing confirmed product name corrections
 LOGO = os.path.join(DATA_DIR, 'logo.txt')
 GROCERY_URL = 'https://raw.githubusercontent.com/ronniebax/static/main/data/groceries.csv'
-EXPORT_DIR = os.path.join(os.getcwd(), 'export')
+EXPORT_DIR = os.path.join(os.path.dirname(DATA_DIR), 'export') # next to the data directory
+EXPIRY_INDEX = os.path.join(DATA_DIR, 'expiry_index.bin') # all lots sorted on expiration date, with the date of their first sale
+EXPIRY_LOTS = os.path.join(DATA_DIR, 'expiry_lots.bin') # lots appended since the expiry index was last merged
+EXPIRY_SALES = os.path.join(DATA_DIR, 'expiry_sales.bin') # sales appended since the expiry index was last merged
+JOURNAL = os.path.join(DATA_DIR, 'journal.json') # write-ahead journal for ledger appends that are not yet committed
+LEDGER_LOCK = os.path.join(DATA_DIR, 'ledger.lock') # lock file that serializes writes to the ledgers between processes
+CACHE_DIR = os.path.join(DATA_DIR, 'cache') # directory for storing cached report output
+CACHE_INDEX = os.path.join(CACHE_DIR, 'index.json') # json file with the date range and ledger state per cached report
+CACHE_MAX_ENTRIES = 50 # the least recently used reports are removed from the cache above this amount
+CACHE_MAX_BYTES = 10 * 1024 * 1024 # or above this total size
+PARALLEL_LOAD_BYTES = 32 * 1024 * 1024 # ledgers larger than this are loaded by multiple processes
+BOUGHT_BIN = os.path.join(DATA_DIR, 'bought.bin') # fixed-width binary copy of bought.csv, read via mmap
+SOLD_BIN = os.path.join(DATA_DIR, 'sold.bin') # fixed-width binary copy of sold.csv
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive') # directory for the settled lots and sales moved out of the ledgers
+ARCHIVE_BOUGHT = os.path.join(ARCHIVE_DIR, 'bought.csv')
+ARCHIVE_SOLD = os.path.join(ARCHIVE_DIR, 'sold.csv')
+ARCHIVE_STATE = os.path.join(ARCHIVE_DIR, 'state.json') # the date up to which rows were archived and the last ids
+FEED_DIR = os.path.join(DATA_DIR, 'feed') # directory for the segments of the event feed
+FEED_OFFSETS = os.path.join(FEED_DIR, 'offsets.json') # the last read sequence number per feed consumer
+FEED_SEGMENT_BYTES = 4 * 1024 * 1024 # a new feed segment is started when the current one reaches this size
+FEED_KEEP_SEGMENTS = 10 # the oldest feed segments are removed above this amount
+IMPORT_INDEX = os.path.join(DATA_DIR, 'import_index.bin') # sorted hashes of the imported rows, used to skip rows that were imported before
+COMMAND_LOG = os.path.join(DATA_DIR, 'command_log.jsonl') # the commands with their arguments and start time, when logging is enabled
+SKETCH_DIR = os.path.join(DATA_DIR, 'sketches') # directory for the daily sketches of the ledgers, used by the approximate reports
+SKETCH_DAYS = os.path.join(SKETCH_DIR, 'days.bin') # one fixed-width record per day with the totals, the distinct product sketch and the count-min sketches
+SKETCH_PRICES = os.path.join(SKETCH_DIR, 'prices.bin') # the amount of sales per day, product and price bucket
+SKETCH_STATE = os.path.join(SKETCH_DIR, 'state.json') # the size and tail of both ledgers that are covered by the sketches
 
 
  # The header for the bought.csv file as dict with align parameter (l/r) as values to be used to set the alignment for the prettytable function
 BOUGHT_HEADER = {
     'id': 'l',
-    'product_name': 'l',
+    'product_id': 'l',
     'buy_date': 'r',
     'price': 'r',
     'expiration_date': 'r'
@@ -31,12 +67,21 @@ BOUGHT_HEADER = {
 SOLD_HEADER = {
     'id': 'l',
     'bought_id': 'l',
-    'product_name': 'l',
+    'product_id': 'l',
     'sell_date': 'r',
-    'sell_price': 'r'
+    'sell_price': 'r',
+    'buy_date': 'r',
+    'buy_price': 'r'
     } 
 
 
+ # the header for the catalog.csv file as dict with align parameter (l/r) as values
+CATALOG_HEADER = {
+    'product_id': 'l',
+    'product_name': 'l'
+    }
+
+
 # initial configuration parameters for the json settings file
 CONFIG_DATA = {
     "sound": True,
@@ -44,40 +89,252 @@ CONFIG_DATA = {
     "printer": True,
     "enable_advance_time": False,
     "enable_date_alert": True,
-    "validate_names": True
+    "validate_names": True,
+    "log_commands": False
 
 }
 
 
+# the money columns of the ledgers. The csv files store prices as decimals, everywhere else they are integer cents
+PRICE_COLUMNS = ('price', 'sell_price', 'buy_price')
+
+
+def to_cents(price)-> int:
+    """Converts a price with at most two decimals, as string or number, to integer cents
+    """
+    return round(float(price) * 100)
+
+
+def format_cents(cents:int)-> str:
+    """Formats integer cents as decimal string with two decimals, the way prices are written to the csv files
+    """
+    sign = '-' if cents < 0 else ''
+    return f'{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}'
+
+
 def get_today():
     """Gets the current date and returns it as a string
     """
     return date.today().strftime('%Y-%m-%d')
 
 
-def write_csv(csv_file, data):
-    """Writes the provided data to the given csv file
+def sync_dir(path):
+    """Flushes the directory entry of the given file to disk, so a rename or a newly created file survives a crash.
+    Not supported on Windows, where the call is skipped
+    """
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def atomic_write(path, text):
+    """Writes the text (or bytes) to a temporary file next to the target file, flushes it to disk and renames it over the target.
+    A crash during the write leaves the previous version of the file intact
+    """
+    tmp_file = f'{path}.{os.getpid()}.tmp' # unique per process, so concurrent writers don't share a temporary file
+    with (open(tmp_file, 'wb') if isinstance(text, bytes) else open(tmp_file, 'w', newline='')) as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_file, path)
+    sync_dir(path)
+
+
+lock_state = {'file': None, 'depth': 0} # the open lock file and the nesting depth of ledger_lock() in this process
+
+
+@contextmanager
+def ledger_lock():
+    """Context manager that holds an exclusive lock on ledger.lock, so only one process at a time can read the available stock and 
+    append to the ledgers. The lock is advisory: every write path in the app takes it. Nested use within one process is allowed
     """
+    if lock_state['depth'] == 0:
+        file = open(LEDGER_LOCK, 'a+')
+        if fcntl:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue # LK_LOCK gives up after 10 seconds, keep waiting
+        lock_state['file'] = file
+    lock_state['depth'] += 1
     try:
-        with open(csv_file, 'a', newline='') as file:
-            writer = csv.writer(file, delimiter=',')
-            writer.writerow(data)
+        yield
+    finally:
+        lock_state['depth'] -= 1
+        if lock_state['depth'] == 0:
+            file = lock_state['file']
+            if fcntl:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            file.close()
+            lock_state['file'] = None
+
+
+def read_last_row(csv_file)-> list:
+    """Returns the last row of the given csv file as a list, by reading only the tail of the file
+    """
+    with open(csv_file, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        position = end
+        block = b''
+        while position > 0 and block.rstrip().count(b'\n') < 1:
+            position = max(0, position - 4096)
+            file.seek(position)
+            block = file.read(end - position)
+    last_line = block.rstrip().rsplit(b'\n', 1)[-1].decode()
+    return next(csv.reader([last_line]), [])
+
+
+def read_archive_state()-> dict:
+    """Returns the archive state: the date before which settled rows were moved to the archive ('cutoff') and the last id
+    of each ledger at that moment ('last_id', by file name). Returns an empty dictionary when nothing was archived yet
+    """
+    if not os.path.exists(ARCHIVE_STATE):
+        return {}
+    with open(ARCHIVE_STATE, 'r') as file:
+        return json.load(file)
+
+
+def append_payload(csv_file, offset:int, payload:str):
+    """Cuts the csv file back to the given offset and appends the payload with a single write and fsync.
+    Because of the truncate the function can safely be repeated when replaying the journal
+    """
+    with open(csv_file, 'ab') as file:
+        file.truncate(offset)
+        file.write(payload.encode())
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def write_rows(csv_file, rows, events:list=None):
+    """Appends the rows to the given csv file as one group commit:
+    - the rows, the current size of the csv file and the feed events of the rows are written to the journal and flushed to disk
+    - the rows are appended to the csv file in one write and flushed to disk
+    - the events are appended to the feed
+    - the journal is removed
+
+    A crash at any point is repaired by recover_journal() on the next start of the app, so committed rows always get their events
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=',').writerows(rows)
+    write_payload(csv_file, buffer.getvalue(), events)
+
+
+def write_payload(csv_file, payload:str, events:list=None, replace:dict=None):
+    """Appends rows that are already formatted as csv text, with the line endings of csv.writer, as one group commit. See write_rows().
+    Files that belong to the rows, given as {prepared file: destination}, are moved into place after the events, so a crash never
+    leaves the rows without them
+    """
+    if not payload:
+        return
+    from .feed import emit_events, feed_sequence # the feed module imports from this module
+    try:
+        with ledger_lock():
+            offset = os.path.getsize(csv_file) if os.path.exists(csv_file) else 0
+            entry = {'file': csv_file, 'offset': offset, 'data': payload}
+            if events:
+                entry['events'], entry['sequence'] = events, feed_sequence() # the last event before these, see recover_journal()
+            if replace:
+                entry['replace'] = replace
+            atomic_write(JOURNAL, json.dumps(entry))
+            append_payload(csv_file, offset, payload)
+            emit_events(events)
+            replace_files(replace or {})
+            os.remove(JOURNAL)
     except Exception as e:
-        print(f'The following error has occurred: {e}.') 
+        print(f'The following error has occurred: {e}.')
         sys.exit(1)
 
 
+def replace_files(replace:dict):
+    """Moves the prepared files to their destination. Files that are already moved are skipped, so the function can safely be repeated
+    when replaying the journal
+    """
+    for source, destination in replace.items():
+        if os.path.exists(source):
+            os.replace(source, destination)
+            sync_dir(destination)
+
+
+def write_csv(csv_file, data):
+    """Writes the provided data as a single row to the given csv file
+    """
+    write_rows(csv_file, [data])
+
+
 def write_date(txt_file, date):
     """Writes the given date to today.txt
     """
     try:
-        with open(txt_file, 'w') as file:
-            file.write(date)
+        atomic_write(txt_file, str(date))
     except Exception as e:
         print(f'The following error has occurred: {e}.')
         sys.exit(1)
 
 
+def truncate_partial_row(csv_file):
+    """Removes an incomplete last row (a row without line ending) from the given csv file. Only the tail of the file is read
+    """
+    with open(csv_file, 'rb+') as file:
+        end = file.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 4096)
+            file.seek(start)
+            block = file.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            file.truncate(position)
+            print(f'Removed an incomplete row from {csv_file}.')
+
+
+def recover_journal():
+    """Replays a committed journal after a crash, so rows that were confirmed to the user are never lost. The feed events of the rows
+    are appended as well, except the ones that already made it to the feed: the journal holds the last sequence number before them.
+    Files that belong to the rows are moved into place.
+    Afterwards incomplete rows are removed from the ledgers. The ledger lock is held, so a journal that another process
+    is still working on is never touched
+    """
+    from .feed import emit_events, feed_sequence # the feed module imports from this module
+    with ledger_lock():
+        if os.path.exists(JOURNAL):
+            try:
+                with open(JOURNAL, 'r') as file:
+                    entry = json.load(file)
+            except ValueError:
+                entry = None # the journal was never completely written, so the ledger hasn't been touched
+            if entry:
+                try:
+                    append_payload(entry['file'], entry['offset'], entry['data'])
+                    print(f'Recovered pending rows for {entry["file"]}.')
+                    pending = entry.get('events', [])[max(0, feed_sequence() - entry.get('sequence', 0)):]
+                    if pending:
+                        emit_events(pending)
+                        print(f'Recovered {len(pending)} pending event(s) for the feed.')
+                    replace_files(entry.get('replace', {}))
+                except Exception as e:
+                    print(f'The following error has occurred: {e}.')
+                    sys.exit(1)
+            os.remove(JOURNAL)
+        for csv_file in (BOUGHT_CSV, SOLD_CSV):
+            if os.path.exists(csv_file):
+                truncate_partial_row(csv_file)
+
+
 def check_data_files():
     """Checks if data directory and data files exist and create them if not present
     """
@@ -88,6 +345,9 @@ def check_data_files():
         except Exception as e:
             print(f'The following error has occurred: {e}.')
 
+    # repair ledgers after a crash during a write
+    recover_journal()
+
     if not os.path.exists(BOUGHT_CSV):
         write_csv(BOUGHT_CSV, BOUGHT_HEADER.keys())
         print(f'Created {BOUGHT_CSV}.')
@@ -102,23 +362,28 @@ def check_data_files():
     # checks if json setting file is present and creates new file when not present
     if not os.path.exists(SETTINGS):
         try:
-            with open(SETTINGS, 'w') as file:
-                json.dump(CONFIG_DATA, file, indent=4)
-                print(f'Created {SETTINGS}.')
+            atomic_write(SETTINGS, json.dumps(CONFIG_DATA, indent=4))
+            print(f'Created {SETTINGS}.')
         except Exception as e:
             print(f'The following error has occurred: {e}.')
 
     # checks if grocery datafile is present and downloads it when not present
     if not os.path.exists(GROCERY_NAMES):
         try:
-            response = requests.get(GROCERY_URL, verify=False)
-            with open(GROCERY_NAMES, 'wb') as file:
-                file.write(response.content)
-                print(f'Successfully downloaded and saved grocery datafile at {GROCERY_NAMES}')
+            download_groceries()
+            print(f'Successfully downloaded and saved grocery datafile at {GROCERY_NAMES}')
         except Exception as e:
             print(f'The following error has occurred: {e}.')
 
 
+def download_groceries(timeout:float=None):
+    """Downloads groceries.csv and replaces the local copy atomically. Raises an error when the download fails or takes longer than the timeout
+    """
+    response = requests.get(GROCERY_URL, verify=False, timeout=timeout)
+    response.raise_for_status()
+    atomic_write(GROCERY_NAMES, response.content)
+
+
 def set_timestamp():
     """Creates string from epoch time and removes dots. The string can be used as unique value for naming report exports
     """
@@ -148,13 +413,16 @@ def set_export_data(name, date, format):
     filename = f'{name}_{date}_{set_timestamp()}.{format}'
     return os.path.join(EXPORT_DIR, filename)
 
+logo_state = {'pause': True} # switched off while reports are run in the background, see maintenance.py
+
+
 def logo(pause:bool=True):
-    """Prints super.py logo from logo.txt as ascii art
+    """Prints super.py logo from logo.txt as ascii art. The pause is skipped for commands run by replay, so it doesn't add to the measured latency
     """
-    with open('data/logo.txt','r') as file:
+    with open(LOGO,'r') as file:
         logo = file.read()
         print(logo)
-        if pause:
+        if pause and logo_state['pause'] and not os.environ.get(REPLAY_ENV):
             sleep(1)
 
 def clear_console():
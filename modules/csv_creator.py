@@ -13,6 +13,7 @@ import csv
 from datetime import timedelta
 import os
 from .functions import string_to_date, read_system_date, get_today
+from .catalog import get_product_id
 from .const import GROCERY_NAMES, check_data_files, BOUGHT_HEADER, SOLD_HEADER, logo, clear_console
 
 
@@ -137,7 +138,7 @@ def generate_csv(start_date, csv_rows:int=500, items:int=None):
             counter += 1
             buy_date = random_date(buy_dates)
             exp_date = random_exp_date(buy_date)
-            writer.writerow([ids, grocery, buy_date, random_price(), exp_date])
+            writer.writerow([ids, get_product_id(grocery), buy_date, random_price(), exp_date])
     clear_console()
     print(f'===> Generated bought file with {counter} rows at: {CSV_BOUGHT}')  
     generate_csv_sold(buy_dates, csv_rows) 
@@ -169,7 +170,7 @@ def generate_csv_sold(date, rows):
                     if buy_date <= sell_date and expiration_date > sell_date and sell_date <= today:
                         ids += 1
                         counter += 1
-                        writer.writerow([ids, bought_id, row['product_name'], sell_date, set_sell_price(float(row['price']))])
+                        writer.writerow([ids, bought_id, row['product_id'], sell_date, set_sell_price(float(row['price'])), row['buy_date'], row['price']])
                         if counter >= output_amount:
                             break # break when desired amount of sold items is reached. 
             x += 1       
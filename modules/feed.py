@@ -0,0 +1,188 @@
+# module for the event feed: an append-only, sequence-numbered log of the buys, sales, date shifts and config changes
+import glob
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from .const import FEED_DIR, FEED_OFFSETS, FEED_SEGMENT_BYTES, FEED_KEEP_SEGMENTS, TODAY_TXT, PRICE_COLUMNS, to_cents
+from .const import ledger_lock, atomic_write, sync_dir, truncate_partial_row
+
+
+def segment_name(first_sequence:int)-> str:
+    """Returns the path of the feed segment that starts with the given sequence number. The number is zero padded, so the
+    segments sort in order by name
+    """
+    return os.path.join(FEED_DIR, f'feed-{first_sequence:012d}.jsonl')
+
+
+def list_segments()-> list:
+    """Returns the paths of the feed segments, oldest first
+    """
+    return sorted(glob.glob(os.path.join(FEED_DIR, 'feed-*.jsonl')))
+
+
+def first_sequence(segment)-> int:
+    """Returns the sequence number of the first event in the segment, taken from the file name
+    """
+    return int(os.path.basename(segment)[5:-6])
+
+
+def last_sequence(segment)-> int:
+    """Returns the sequence number of the last event in the segment by reading only the tail of the file. Returns the number before
+    the first event of the segment when it is empty
+    """
+    with open(segment, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        position = end
+        block = b''
+        while position > 0 and block.rstrip().count(b'\n') < 1:
+            position = max(0, position - 4096)
+            file.seek(position)
+            block = file.read(end - position)
+    last_line = block.rstrip().rsplit(b'\n', 1)[-1]
+    return json.loads(last_line)['sequence'] if last_line else first_sequence(segment) - 1
+
+
+def feed_sequence()-> int:
+    """Returns the sequence number of the last event in the feed, or 0 when the feed is empty. An incomplete last line, left by a crash,
+    is removed first
+    """
+    with ledger_lock():
+        segments = list_segments()
+        if not segments:
+            return 0
+        truncate_partial_row(segments[-1])
+        return last_sequence(segments[-1])
+
+
+def row_to_event(header, row)-> dict:
+    """Converts a ledger row to the data of a buy or sell event: ids as int, prices as integer cents and dates as YYYY-MM-DD strings
+    """
+    data = {}
+    for key, value in zip(header, row):
+        if key in PRICE_COLUMNS:
+            data[key] = to_cents(value)
+        elif key == 'id' or key.endswith('_id'):
+            data[key] = int(value)
+        else:
+            data[key] = str(value)
+    return data
+
+
+def emit_events(events:list):
+    """Appends the events, given as (type, data) tuples, to the feed with a single write and fsync. Every event gets the next
+    sequence number, the time of writing and the system date. The ledger lock is held, so the sequence numbers of concurrent
+    processes never overlap.
+
+    An incomplete last line, left by a crash, is removed first. When the current segment reached FEED_SEGMENT_BYTES the events
+    go into a new segment and the oldest segments above FEED_KEEP_SEGMENTS are removed
+    """
+    if not events:
+        return
+    try:
+        with ledger_lock():
+            os.makedirs(FEED_DIR, exist_ok=True)
+            with open(TODAY_TXT, 'r') as file:
+                system_date = file.readline().strip()
+            sequence = feed_sequence()
+            segments = list_segments()
+            if not segments or os.path.getsize(segments[-1]) >= FEED_SEGMENT_BYTES:
+                segments.append(segment_name(sequence + 1))
+            written = datetime.now().isoformat(timespec='seconds')
+            lines = []
+            for event_type, data in events:
+                sequence += 1
+                lines.append(json.dumps({'sequence': sequence, 'type': event_type, 'time': written, 'date': system_date, 'data': data}) + '\n')
+            with open(segments[-1], 'ab') as file:
+                file.write(''.join(lines).encode())
+                file.flush()
+                os.fsync(file.fileno())
+            if len(segments) > FEED_KEEP_SEGMENTS:
+                for segment in segments[:-FEED_KEEP_SEGMENTS]:
+                    os.remove(segment)
+            sync_dir(segments[-1])
+    except Exception as e:
+        print(f'The following error has occurred: {e}.')
+        sys.exit(1)
+
+
+def emit(event_type:str, data:dict):
+    """Appends a single event to the feed, see emit_events()
+    """
+    emit_events([(event_type, data)])
+
+
+def rows_to_events(event_type:str, header, rows:list)-> list:
+    """Returns an event per ledger row, see row_to_event(). The events are passed to write_rows(), which appends them to the feed
+    together with the rows
+    """
+    return [(event_type, row_to_event(header, row)) for row in rows]
+
+
+def read_events(after:int=0):
+    """Yields the events with a sequence number higher than the given one, in order. Only the segments that can hold those events are read
+    """
+    segments = list_segments()
+    start = 0
+    for position, segment in enumerate(segments):
+        if first_sequence(segment) <= after + 1:
+            start = position
+    for segment in segments[start:]:
+        with open(segment, 'r') as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    break # an event that is still being written, it is read the next time
+                event = json.loads(line)
+                if event['sequence'] > after:
+                    yield event
+
+
+def read_offsets()-> dict:
+    """Returns the last read sequence number per consumer
+    """
+    if not os.path.exists(FEED_OFFSETS):
+        return {}
+    with open(FEED_OFFSETS, 'r') as file:
+        return json.load(file)
+
+
+def store_offset(consumer:str, sequence:int):
+    """Saves the last read sequence number of the consumer
+    """
+    with ledger_lock(): # consumers that store their offset at the same time don't overwrite each other
+        offsets = read_offsets()
+        offsets[consumer] = sequence
+        os.makedirs(FEED_DIR, exist_ok=True)
+        atomic_write(FEED_OFFSETS, json.dumps(offsets, indent=4))
+
+
+def tail_feed(after:int=None, consumer:str=None, limit:int=None, follow:bool=False):
+    """Prints the events after the given sequence number as json lines, so the output can be piped to another program. A consumer
+    continues after its stored offset and the offset is saved after the events are printed. With follow the feed is checked for new
+    events every second until the program is interrupted. A warning is printed to stderr when events after the offset were already
+    removed by the retention policy
+    """
+    if after is None:
+        after = read_offsets().get(consumer, 0) if consumer else 0
+    segments = list_segments()
+    if segments and first_sequence(segments[0]) > after + 1:
+        print(f'Warning: events {after + 1} to {first_sequence(segments[0]) - 1} were removed from the feed.', file=sys.stderr)
+    printed = 0
+    try:
+        while True:
+            offset = after
+            for event in read_events(after):
+                if limit and printed >= limit:
+                    break
+                print(json.dumps(event))
+                after = event['sequence']
+                printed += 1
+            sys.stdout.flush()
+            if consumer and after != offset:
+                store_offset(consumer, after)
+            if not follow or (limit and printed >= limit):
+                break
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
@@ -1,9 +1,18 @@
 import csv
+import os
+import sys
+import numpy as np
+from operator import itemgetter
 from thefuzz import process
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
 from prettytable import PrettyTable
+from tabulate import tabulate
 from .config import statement_printer, write_config, read_config, ui_sounds, clean_header
-from .const import BOUGHT_CSV, SOLD_CSV, TODAY_TXT, BOUGHT_HEADER, SOLD_HEADER, GROCERY_NAMES, write_csv, write_date, get_today, logo, clear_console
+from .catalog import load_catalog, get_product_id, get_product_names
+from .aliases import lookup_alias, add_alias
+from .binary import map_ledger
+from .feed import emit, rows_to_events
+from .const import BOUGHT_CSV, SOLD_CSV, TODAY_TXT, BOUGHT_HEADER, SOLD_HEADER, PRICE_COLUMNS, to_cents, format_cents, write_rows, ledger_lock, read_last_row, read_archive_state, write_date, get_today, logo, clear_console
 
 
 def string_to_date(date:str):
@@ -37,7 +46,10 @@ def reset_date(silent:bool=True):
     will be set to False.
     """
     today = get_today()
+    previous_date = read_system_date()
     write_date(TODAY_TXT, today)
+    if str(previous_date) != today:
+        emit('date', {'from': str(previous_date), 'to': today})
     write_config(adv_time=False)
     if not silent:
         clear_console()
@@ -82,6 +94,7 @@ def advance_time(days:int, date=None):
     elif date:
         new_date = date
     write_date(TODAY_TXT, new_date)
+    emit('date', {'from': str(current_date), 'to': str(new_date)})
     write_config(adv_time=True)
     clear_console()
     logo()
@@ -89,40 +102,40 @@ def advance_time(days:int, date=None):
 
 
 def check_advance_time():
-    """Reads the current configuration and sets the date to today when advance_time is disabled, to make sure the system date is equal to the current date
+    """Reads the current configuration and sets the date to today when advance_time is disabled, to make sure the system date is equal to the current date.
+    Nothing is written when the system date is already today
     """
-    if not read_config()['enable_advance_time']:
+    if not read_config()['enable_advance_time'] and str(read_system_date()) != get_today():
         reset_date()
 
 
 def get_grocery_list()-> list:
-    """Returns all known unique product names as a list. Reads both the bought.csv and groceries.csv files
+    """Returns all known unique product names as a list. The names come from the product catalog, which holds the names from
+    groceries.csv and every product that has been bought
     """
-    groceries = set() # a set is used instead of a list since iterating over a set proved to be about 10x faster, also no concerns about dupes
-    with open(BOUGHT_CSV, 'r') as file_1:
-        with open(GROCERY_NAMES, 'r') as file_2:
-            reader_1 = csv.DictReader(file_1, delimiter=',')
-            reader_2 = csv.reader(file_2, delimiter=',')
-            for row in reader_1:
-                if row['product_name'] not in groceries:
-                    groceries.add(row['product_name'])  
-            for row in reader_2:
-                if row[0] not in groceries:
-                    groceries.add(row[0])               
-    return list(groceries)
+    return list(load_catalog())
 
 
 def check_product_names(word:str):
-    """Validator function that checks the given string and compares it with existing strings in groceries.csv and bought.csv. The list of strings
-    is collected via get_grocery_list(). The process module from thefuzz compares the given string with those in the list from get_grocery_list(). 
-    When no exact match is found, user input is asked via product_name_validator()
+    """Validator function that checks the given string and compares it with the product names in the catalog. Exact matches
+    and earlier confirmed corrections (aliases) are returned right away. Otherwise the list of strings is collected via get_grocery_list() 
+    and the process module from thefuzz compares the given string with those in that list. 
+    When no exact match is found, user input is asked via product_name_validator() and a confirmed correction is stored as alias
     """
     original_word = word.lower()
     if read_config()['validate_names']:
+        if original_word in load_catalog():
+            return original_word
+        alias = lookup_alias(original_word)
+        if alias:
+            return alias
         groceries = get_grocery_list()
         checked_word = str(process.extract(original_word, groceries, limit=1)[0][0]).lower()
         if original_word != checked_word:
-            return product_name_validator(original_word, checked_word)
+            validated_word = product_name_validator(original_word, checked_word)
+            if validated_word != original_word: # a declined suggestion isn't stored, so the word is checked again next time
+                add_alias(original_word, validated_word)
+            return validated_word
     return original_word
     
 
@@ -144,22 +157,28 @@ def product_name_validator(original_word:str, checked_word:str):
         return product_name_validator(original_word, checked_word)
 
 
-def buy_product(product_name:str, price:float, expiration_date, amount:int=1):
-    """Adds a product (in lowercase) to the bought.csv file the amount of times passed via the amount argument by:
+def buy_product(product_name:str, price:int, expiration_date, amount:int=1):
+    """Adds a product, with its price in cents, to the bought.csv file the amount of times passed via the amount argument by:
     - validating the product name
+    - looking up the product id in the catalog (new products are added to the catalog)
     - generating a buy id
     - putting all values in a list
+    - appending all rows to the csv file with a single group commit
+    Generating the ids and writing is done while holding the ledger lock, so concurrent processes never use the same id.
     After writing to the csv file a table with details from the last added row will be printed
     """
     validate_dates()
     validated_name = check_product_names(product_name)
+    product_id = get_product_id(validated_name)
     date = read_system_date()
-    buy_id = generate_id(BOUGHT_CSV)
-    for x in range(amount):
-        data = [buy_id, validated_name.lower(), date, price, expiration_date]
-        write_csv(BOUGHT_CSV, data)
-        buy_id +=1
-    table, table_csv = table_printer(BOUGHT_HEADER, get_last_line(BOUGHT_CSV))
+    with ledger_lock():
+        buy_id = generate_id(BOUGHT_CSV)
+        rows = []
+        for x in range(amount):
+            rows.append([buy_id, product_id, date, format_cents(price), expiration_date])
+            buy_id +=1
+        write_rows(BOUGHT_CSV, rows, rows_to_events('buy', BOUGHT_HEADER, rows)) # all rows are committed at once, with their events
+    table, table_csv = table_printer(BOUGHT_HEADER, rows[-1:])
     clear_console()
     logo()
     statement_printer(f'===> The following item has successfully been added to the database {amount} time(s):', sleep=0.009, sound='success')
@@ -167,26 +186,27 @@ def buy_product(product_name:str, price:float, expiration_date, amount:int=1):
 
 
 def generate_id(datafile):
-    """Gets the last row number from the given file and adds 1, so the value can be used as ID and makes sure the ID is equal to the row number
+    """Gets the id of the last row from the given file and adds 1, so the value can be used as ID. Only the tail of the file is read.
+    When all rows were moved to the archive, the numbering continues after the last archived id. For a file that never had rows
+    the id is 2, equal to the row number of the first row. Call this function while holding the ledger lock
     """
-    with open (datafile, 'r') as file:
-        count = sum(1 for _ in file)
-        return count +1
-
-
-def get_last_line(inputfile)-> list:
-    """Fetching the last line from the provided CSV file and returns the values as list of lists. This data is used for printing
-    a table after adding a line to the given file
-    """ 
-    with open(inputfile, 'r') as file:
-        last_line = file.readlines()[-1].strip()
-        return [last_line.split(',')]
+    last_row = read_last_row(datafile)
+    try:
+        return int(last_row[0]) + 1
+    except (IndexError, ValueError):
+        return read_archive_state().get('last_id', {}).get(os.path.basename(datafile), 1) + 1 # only the header is present
 
 
 def table_printer(header:dict, rows:list):
-    """Prints a table with a header and the last row from the csv file to be shown as confirmation after buying or selling a product
+    """Prints a table with a header and the last row from the csv file to be shown as confirmation after buying or selling a product.
+    A product id column is shown as the product name from the catalog
     """
     clear_console()
+    if 'product_id' in header:
+        position = list(header).index('product_id')
+        names = get_product_names()
+        header = dict(('product_name' if k == 'product_id' else k, v) for k, v in header.items())
+        rows = [r[:position] + [names[int(r[position])]] + r[position + 1:] for r in rows]
     c_header = clean_header(header)
     x = PrettyTable()
     x.field_names = c_header.keys()
@@ -199,31 +219,139 @@ def table_printer(header:dict, rows:list):
     return table, table_csv
 
 
-def read_csv_dict(csv_file)-> dict:
-    """Reads a csv file and returns an iterable dictionary. The value is casted into a list to prevent I/O errors
+class BoughtRow:
+    """A row from bought.csv with typed values: ids as int, the price as integer cents and the dates as day ordinals (date.toordinal()), 
+    so dates are parsed once and compared as integers. __slots__ keeps the memory per row to a fraction of a dictionary
+    """
+    __slots__ = ('id', 'product_id', 'buy_date', 'price', 'expiration_date')
+    optional = () # columns that can be empty in the ledger
+
+    def __init__(self, id:int, product_id:int, buy_date:int, price:int, expiration_date:int):
+        self.id = id
+        self.product_id = product_id
+        self.buy_date = buy_date
+        self.price = price
+        self.expiration_date = expiration_date
+
+    def to_csv(self)-> list:
+        """Returns the row as list of values for writing to bought.csv
+        """
+        return [self.id, self.product_id, ordinal_to_string(self.buy_date), format_cents(self.price), ordinal_to_string(self.expiration_date)]
+
+
+class SoldRow:
+    """A row from sold.csv with typed values, see BoughtRow. The buy date and buy price are copied from the bought item when it is sold.
+    They are None for a sale of which the bought id doesn't exist, backfill leaves those columns empty
+    """
+    __slots__ = ('id', 'bought_id', 'product_id', 'sell_date', 'sell_price', 'buy_date', 'buy_price')
+    optional = ('buy_date', 'buy_price')
+
+    def __init__(self, id:int, bought_id:int, product_id:int, sell_date:int, sell_price:int, buy_date:int, buy_price:int):
+        self.id = id
+        self.bought_id = bought_id
+        self.product_id = product_id
+        self.sell_date = sell_date
+        self.sell_price = sell_price
+        self.buy_date = buy_date
+        self.buy_price = buy_price
+
+
+def ordinal_to_string(day:int)-> str:
+    """Converts a day ordinal to a string formatted as YYYY-MM-DD
     """
-    with open(csv_file) as file:
-        reader = csv.DictReader(file)
-        return list(reader)
+    return date.fromordinal(day).strftime('%Y-%m-%d')
+
+
+class DayCache(dict):
+    """Dictionary that converts a YYYY-MM-DD string to a day ordinal the first time it is looked up. Ledgers contain few distinct
+    dates, so almost every lookup is a dictionary hit instead of parsing the date again
+    """
+    def __missing__(self, text:str)-> int:
+        day = self[text] = date.fromisoformat(text).toordinal()
+        return day
+
+
+def read_rows(csv_file, row_class)-> list:
+    """Reads a ledger and returns all rows as row_class objects (BoughtRow or SoldRow). Columns are looked up by name in the header,
+    so extra columns are ignored. Empty values of the optional columns of the row class are read as None
+    """
+    days = DayCache()
+    converters = dict.fromkeys(PRICE_COLUMNS, to_cents)
+    def converter(name:str):
+        convert = converters.get(name, days.__getitem__ if name.endswith('date') else int)
+        if name in row_class.optional:
+            return lambda value: convert(value) if value else None
+        return convert
+    with open(csv_file, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        columns = itemgetter(*[header.index(name) for name in row_class.__slots__])
+        c0, c1, c2, c3, c4, *rest = [converter(name) for name in row_class.__slots__]
+        if not rest:
+            return [row_class(c0(v0), c1(v1), c2(v2), c3(v3), c4(v4)) for v0, v1, v2, v3, v4 in map(columns, filter(None, reader))]
+        c5, c6 = rest
+        return [row_class(c0(v0), c1(v1), c2(v2), c3(v3), c4(v4), c5(v5), c6(v6)) for v0, v1, v2, v3, v4, v5, v6 in map(columns, filter(None, reader))]
+
+
+def read_bought_rows()-> list:
+    """Returns all rows from bought.csv as BoughtRow objects
+    """
+    return read_rows(BOUGHT_CSV, BoughtRow)
+
+
+def read_sold_rows()-> list:
+    """Returns all rows from sold.csv as SoldRow objects
+    """
+    return read_rows(SOLD_CSV, SoldRow)
+
+
+def find_available_lots(rows, product_id:int, sold_ids, date, amount:int)-> list:
+    """Returns up to the given amount of rows, in the order of the bought.csv file, that
+    - have the given product id
+    - are not in sold_ids (the bought ids from sold.csv)
+    - have a buy date smaller or equal to the given date
+    - have an expiration date greater then, or equal to the given date
+    These are the allocation rules for selling, used by the simulation. The sell command applies the same rules to the
+    binary ledger with find_available_records()
+    """
+    day = date.toordinal()
+    result = []
+    for row in rows:
+        if row.product_id == product_id and row.buy_date <= day and row.expiration_date >= day and row.id not in sold_ids:
+            result.append(row)
+            if len(result) == amount:
+                break
+    return result
+
+
+def find_available_records(records, product_id:int, sold_ids, date, amount:int)-> list:
+    """Vectorized version of find_available_lots() for the records of the binary ledger: the columns are filtered as arrays
+    and only the matching rows are converted to BoughtRow objects
+    """
+    if product_id is None:
+        return []
+    day = date.toordinal()
+    records = records[(records['product_id'] == product_id) & (records['buy_date'] <= day) & (records['expiration_date'] >= day)]
+    records = records[~np.isin(records['id'], sold_ids)][:amount]
+    return [record_to_row(record) for record in records]
+
+
+def record_to_row(record)-> BoughtRow:
+    """Converts a record from the binary bought ledger to a BoughtRow
+    """
+    return BoughtRow(int(record['id']), int(record['product_id']), int(record['buy_date']), int(record['price']), int(record['expiration_date']))
 
 
 def check_bought_items(product:str, id:list, amount:int)-> dict:
-    """Checks the bought.csv file and returns a row when
-    - the given product exits in bought.csv
-    - the row id is not already in the sold.csv (bought id)
-    - the buy dat is smaller or equal to the system date
-    _ the expiration date is greater then, or equal to the system date
+    """Checks the bought ledger and returns the rows to sell via find_available_records(), based on the system date. 
     If the amount of available items is less than the given amount, a message containing the available amount will be printed
     When a product is unavailable a message will be printed
     """
     system_date = read_system_date()
-    csv_data = read_csv_dict(BOUGHT_CSV)
-    result = []
-    for row in csv_data:
-        if product.lower() == row['product_name'].lower() and row['id'] not in id and string_to_date(row['buy_date']) <= system_date and string_to_date(row['expiration_date']) >= system_date:
-            result.append(row)
-            if len(result) == amount:
-                return result
+    product_id = get_product_id(product, create=False)
+    result = find_available_records(map_ledger(BOUGHT_CSV), product_id, id, system_date, amount)
+    if len(result) == amount:
+        return result
     if len(result) != 0:
         statement_printer(f'Product {product} is only available {len(result)} times at this moment', sound='error', h_space=True)
         return
@@ -235,18 +363,20 @@ def check_bought_items(product:str, id:list, amount:int)-> dict:
         return 
 
 
-def sell_product(name:str, price:float, amount:int=1):
+def sell_product(name:str, price:int, amount:int=1):
     """Function for checking if a product name is valid and the product is available for sale. Calls the store function when the item is available.
-    After updating the csv file a table containing data from the last row from that file will be printed. 
+    Checking the available items and storing the sale is done while holding the ledger lock, so two processes selling at the same time
+    can never get the same bought item. After updating the csv file a table containing data from the last stored row will be printed. 
     """
     validated_name = check_product_names(name)
-    available_item = check_bought_items(validated_name, get_bought_ids(), amount)
+    validate_dates()
+    with ledger_lock():
+        available_item = check_bought_items(validated_name, get_bought_ids(), amount)
+        if available_item:
+            rows = store_sold_item(available_item, price)
     if available_item:
-        count = 0
-        for item in available_item:
-            store_sold_item(item['id'], validated_name, price)
-            count +=1
-        table, table_csv = table_printer(SOLD_HEADER, get_last_line(SOLD_CSV))
+        count = len(rows)
+        table, table_csv = table_printer(SOLD_HEADER, rows[-1:])
         clear_console()
         logo()
         statement_printer(f'===> The following item has successfully been registered as a sale {count} time(s):', sleep=0.009, sound='success')
@@ -255,29 +385,114 @@ def sell_product(name:str, price:float, amount:int=1):
 
 # return all bought ids from the sold.csv file as list, with optional date argument to filter by date
 def get_bought_ids(date:datetime=None)-> list:
-    """Reads the sold.csv file and returns all bougt id's as a list. When a date is passed only bought id's smaller or equal to the given 
+    """Reads the sold ledger and returns all bougt id's as a list of integers. When a date is passed only bought id's smaller or equal to the given 
     date will be added to the list. This is important for generating inventory reports. 
     """
-    csv_data = read_csv_dict(SOLD_CSV)
-    bought_id_list = []
+    records = map_ledger(SOLD_CSV)
     if not date: 
-        for row in csv_data:
-            bought_id_list.append(row['bought_id'])
-        return bought_id_list
-    for row in csv_data:
-        if string_to_date(row['sell_date']) <= date: 
-            bought_id_list.append(int(row['bought_id']))
-    return bought_id_list
-
-
-def store_sold_item(bought_id:int, product_name:str, sell_price:float):
-    """Writes the sold item to the sold.csv file after:
-    - checking and validating the system date
-    - generating an id
-    - putting all row items in a list
+        return records['bought_id'].tolist()
+    return records['bought_id'][records['sell_date'] <= date.toordinal()].tolist()
+
+
+def store_sold_item(items:list, sell_price:int)-> list:
+    """Writes the sold items to the sold.csv file with the given sell price in cents, see store_sold_lines(). Returns the rows written
+    """
+    return store_sold_lines([(items, sell_price)])
+
+
+def store_sold_lines(lines:list)-> list:
+    """Writes the sold items of one or more lines, given as (items, sell price) tuples, to the sold.csv file after:
+    - generating an id for every item
+    - putting all row items in a list, including the buy date and buy price of the item, so reports don't need bought.csv for the costs
+
+    All rows are appended with a single group commit. The system date should be validated by the caller, before taking the ledger lock.
+    Returns the rows written
     """
+    with ledger_lock():
+        sell_id = generate_id(SOLD_CSV)
+        sell_date = read_system_date()
+        rows = []
+        for items, sell_price in lines:
+            for item in items:
+                rows.append([sell_id, item.id, item.product_id, sell_date, format_cents(sell_price), ordinal_to_string(item.buy_date), format_cents(item.price)])
+                sell_id += 1
+        write_rows(SOLD_CSV, rows, rows_to_events('sell', SOLD_HEADER, rows))
+    return rows
+
+
+def read_basket(basket_file)-> list:
+    """Reads a basket file: a csv file with the columns product, price and the optional column amount (default 1), for example:
+    product,price,amount
+    banana,1.20,3
+    "cocoa butter alternative",4.50,1
+    Returns the lines as (product name, price in cents, amount) tuples. Exits with a message when a line is invalid
+    """
+    lines = []
+    try:
+        with open(basket_file, 'r', newline='') as file:
+            for number, row in enumerate(csv.DictReader(file), start=2):
+                try:
+                    price, amount = to_cents(row['price']), int(row.get('amount') or 1)
+                except (TypeError, ValueError):
+                    sys.exit(f'Error: Line {number} of the basket has an invalid price or amount.\n')
+                if not row['product'] or amount < 1:
+                    sys.exit(f'Error: Line {number} of the basket needs a product name and an amount greater than 0.\n')
+                lines.append((row['product'].lower(), price, amount))
+    except (OSError, KeyError) as e:
+        sys.exit(f'Error: The basket can\'t be read ({e}). The file needs the columns product and price.\n')
+    if not lines:
+        sys.exit('Error: The basket is empty.\n')
+    return lines
+
+
+def allocate_basket(lines:list, date)-> tuple:
+    """Allocates stock for every basket line, given as (product id, price, amount) tuples, with the allocation rules of the sell command.
+    The lots in stock on the given date are filtered once and grouped per product, then every line takes the first lots of its product,
+    so a product on several lines never gets the same lot twice. Returns the (items, price) tuple per line and the indexes of the
+    lines that are short on stock
+    """
+    records = map_ledger(BOUGHT_CSV)
+    day = date.toordinal()
+    product_ids = [product_id for product_id, price, amount in lines if product_id is not None]
+    records = records[np.isin(records['product_id'], product_ids) & (records['buy_date'] <= day) & (records['expiration_date'] >= day)]
+    records = records[~np.isin(records['id'], get_bought_ids())]
+    lots = {}
+    for record in records:
+        lots.setdefault(int(record['product_id']), []).append(record_to_row(record))
+    allocated, short = [], []
+    for position, (product_id, price, amount) in enumerate(lines):
+        available = lots.get(product_id, [])
+        items, lots[product_id] = available[:amount], available[amount:]
+        if len(items) < amount:
+            short.append(position)
+        allocated.append((items, price))
+    return allocated, short
+
+
+def sell_basket(basket_file):
+    """Sells all lines of a basket file (see read_basket()) as one transaction. The product names are validated first, then the stock for all
+    lines is allocated in one pass while holding the ledger lock and all sold rows are appended with a single group commit.
+    When any line is short on stock nothing is registered and the short lines are printed
+    """
+    lines = read_basket(basket_file)
     validate_dates()
-    sell_id = generate_id(SOLD_CSV)
-    data = [sell_id, bought_id, product_name.lower(), read_system_date(), sell_price]
-    write_csv(SOLD_CSV, data)
-    
\ No newline at end of file
+    names = {}
+    for name, price, amount in lines:
+        if name not in names:
+            names[name] = check_product_names(name)
+    with ledger_lock():
+        basket = [(get_product_id(names[name], create=False), price, amount) for name, price, amount in lines]
+        allocated, short = allocate_basket(basket, read_system_date())
+        if not short:
+            rows = store_sold_lines(allocated)
+    clear_console()
+    logo()
+    if short:
+        details = [[names[lines[position][0]], lines[position][2], len(allocated[position][0])] for position in short]
+        statement_printer('===> The basket has not been registered, the following products are short on stock:', sleep=0.009, sound='error')
+        print(tabulate(details, headers=['Product name', 'Amount', 'Available'], tablefmt='psql'), '\n')
+        return
+    details = [[names[name], amount, price / 100, amount * price / 100] for name, price, amount in lines] # cents are shown as decimals
+    details.append(['TOTAL', sum(amount for name, price, amount in lines), None, sum(amount * price for name, price, amount in lines) / 100])
+    statement_printer(f'===> The basket has successfully been registered as {len(rows)} sale(s):', sleep=0.009, sound='success')
+    print(tabulate(details, headers=['Product name', 'Amount', 'Sell price', 'Total'], tablefmt='psql', floatfmt='.2f'), '\n')
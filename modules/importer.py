@@ -0,0 +1,240 @@
+# module for importing delivery files of suppliers or other systems into bought.csv, skipping the rows that were imported before
+import json
+import operator
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from .const import BOUGHT_CSV, IMPORT_INDEX, atomic_write, write_payload, ledger_lock, logo, clear_console
+from .config import statement_printer
+from .catalog import get_product_ids
+from .aliases import lookup_alias
+from .functions import generate_id, read_system_date
+
+
+IMPORT_FIELDS = ('product_name', 'buy_date', 'price', 'expiration_date', 'amount') # buy_date and amount are optional
+HASH_FIELDS = ('product_id', 'buy_date', 'price', 'expiration_date', 'amount') # the content of a row that is hashed
+REQUIRED_FIELDS = ('product_name', 'price', 'expiration_date')
+DEFAULT_MAPPING = {'columns': {}, 'date_format': '%Y-%m-%d', 'delimiter': ',', 'decimal': '.'}
+CHUNK_ROWS = 200000 # rows that are read, deduplicated and appended at once
+HASH_KEY = '0123456789123456' # fixed key, so the row hashes are the same in every run
+OCCURRENCE_FACTOR = np.uint64(0x9E3779B97F4A7C15) # spreads the hashes of repeated rows within a file
+MAX_EXAMPLES = 5 # line numbers of invalid rows that are printed
+PENDING_INDEX = IMPORT_INDEX + '.pending' # the index with the hashes of the chunk that is being appended
+
+
+def read_mapping(mapping_file)-> dict:
+    """Returns the import settings of the mapping file: the column of the file per field, the date format, the delimiter and the
+    decimal separator. Settings that are not in the file keep their default value
+    """
+    mapping = json.loads(json.dumps(DEFAULT_MAPPING))
+    if mapping_file:
+        try:
+            with open(mapping_file, 'r') as file:
+                mapping.update(json.load(file))
+        except (OSError, ValueError) as e:
+            sys.exit(f'Error: The mapping file can\'t be read ({e}).\n')
+    unknown = [field for field in mapping['columns'] if field not in IMPORT_FIELDS]
+    if unknown:
+        sys.exit(f'Error: Unknown field(s) in the mapping: {", ".join(unknown)}. Use {", ".join(IMPORT_FIELDS)}.\n')
+    return mapping
+
+
+def map_columns(columns:dict, file_columns:list)-> dict:
+    """Completes the column per field with the columns of the file that have the name of a field. Exits with a message when a
+    required field has no column
+    """
+    columns = dict(columns)
+    for field in IMPORT_FIELDS:
+        if field not in columns and field in file_columns:
+            columns[field] = field
+    missing = [field for field in REQUIRED_FIELDS if columns.get(field) not in file_columns]
+    if missing:
+        sys.exit(f'Error: The file has no column for {", ".join(missing)}. Add the column names to the mapping file.\n')
+    return {field: column for field, column in columns.items() if column in file_columns}
+
+
+def load_import_index()-> np.ndarray:
+    """Returns the hashes of all imported rows as sorted array
+    """
+    if not os.path.exists(IMPORT_INDEX):
+        return np.zeros(0, dtype=np.uint64)
+    return np.fromfile(IMPORT_INDEX, dtype=np.uint64)
+
+
+def contains(index:np.ndarray, hashes:np.ndarray)-> np.ndarray:
+    """Returns True for the hashes that are in the sorted index, with a binary search per hash
+    """
+    if not len(index):
+        return np.zeros(len(hashes), dtype=bool)
+    positions = np.searchsorted(index, hashes).clip(max=len(index) - 1)
+    return index[positions] == hashes
+
+
+def product_ids(names:pd.Series, known:dict, dry_run:bool)-> pd.Series:
+    """Returns the product id per name. Names are normalized to lowercase with single spaces and looked up via the aliases and the
+    catalog, new products are added to the catalog. Every unique name is looked up once per import, the results are kept in known.
+    During a dry run new products get a temporary negative id
+    """
+    products = {}
+    for name in names.unique():
+        if name not in known:
+            product = ' '.join(name.lower().split())
+            if product:
+                products[name] = lookup_alias(product) or product
+            else:
+                known[name] = np.nan
+    ids = get_product_ids(list(products.values()), create=not dry_run)
+    for name, product in products.items():
+        known[name] = ids[product] or known.setdefault(product, -len(known) - 1) # names of the same new product share the temporary id
+    return names.map(known)
+
+
+def convert_unique(column:pd.Series, convert)-> pd.Series:
+    """Applies the conversion to the unique values of the column only and spreads the results over the rows. Delivery files repeat
+    the same names, dates and prices many times, so this is much faster than converting every row
+    """
+    codes, uniques = pd.factorize(column)
+    return pd.Series(convert(pd.Series(uniques)).to_numpy()[codes], index=column.index)
+
+
+def parse_dates(column:pd.Series, date_format:str)-> pd.Series:
+    """Converts date strings in the given format to days since 1970-01-01, with NaN for invalid dates
+    """
+    dates = pd.to_datetime(column.str.strip(), format=date_format, errors='coerce')
+    return (dates - pd.Timestamp('1970-01-01')).dt.days
+
+
+def parse_prices(column:pd.Series, decimal:str)-> pd.Series:
+    """Converts decimal prices with the given decimal separator to cents, with NaN for invalid and negative prices
+    """
+    prices = column.str.strip()
+    if decimal != '.':
+        prices = prices.str.replace(decimal, '.', regex=False)
+    cents = (pd.to_numeric(prices, errors='coerce') * 100).round()
+    return cents.where(cents >= 0)
+
+
+def normalize_chunk(chunk, mapping:dict, known:dict, system_date:str, dry_run:bool):
+    """Converts a chunk of the file to the values of bought.csv: product id, buy date and expiration date as days since 1970-01-01,
+    price in cents and the amount of items per row. Without a buy date column the system date is used. Returns the dataframe and a boolean
+    array that is True for the invalid rows: no product name, an invalid date or price, an amount below 1 or an expiration date before
+    the buy date. Products are only added to the catalog for valid rows
+    """
+    columns = mapping['columns']
+    df = pd.DataFrame(index=chunk.index)
+    for field in ('buy_date', 'expiration_date'):
+        if field in columns:
+            df[field] = convert_unique(chunk[columns[field]], lambda column: parse_dates(column, mapping['date_format']))
+        else:
+            df[field] = (pd.Timestamp(system_date) - pd.Timestamp('1970-01-01')).days
+    df['price'] = convert_unique(chunk[columns['price']], lambda column: parse_prices(column, mapping['decimal']))
+    df['amount'] = convert_unique(chunk[columns['amount']], lambda column: pd.to_numeric(column, errors='coerce')) if 'amount' in columns else 1
+    invalid = (df.isna().any(axis=1) | (df['expiration_date'] < df['buy_date']) | (df['amount'] < 1) | (df['amount'] % 1 != 0)).to_numpy()
+    df['product_id'] = product_ids(chunk[columns['product_name']][~invalid], known, dry_run)
+    invalid |= df['product_id'].isna().to_numpy()
+    return df.fillna(0).astype('int64'), invalid
+
+
+def row_hashes(df, fields:list, seen:pd.Series)-> tuple:
+    """Returns a 64 bit hash per row of the given fields of the row and the amount of times the same content occurred before in the file.
+    Repeated rows within a file stay separate rows, while a row that is in two overlapping files gets the same hash in both. The occurrences
+    per content hash of the previous chunks are kept in seen, which is returned updated with this chunk
+    """
+    hashes = pd.util.hash_pandas_object(df[fields], index=False, hash_key=HASH_KEY)
+    hashes = pd.Series(hashes.to_numpy())
+    occurrence = hashes.groupby(hashes).cumcount().to_numpy(dtype=np.uint64) + hashes.map(seen).fillna(0).to_numpy(dtype=np.uint64)
+    seen = seen.add(hashes.value_counts(), fill_value=0)
+    with np.errstate(over='ignore'):
+        return hashes.to_numpy() ^ (occurrence * OCCURRENCE_FACTOR), seen
+
+
+def to_date(days:pd.Series)-> pd.Series:
+    """Converts days since 1970-01-01 to YYYY-MM-DD strings
+    """
+    return (pd.Timestamp('1970-01-01') + pd.to_timedelta(days, unit='D')).dt.strftime('%Y-%m-%d')
+
+
+def to_payload(df, first_id:int)-> str:
+    """Formats the rows for bought.csv, one row per item with ids counting up from first_id, as csv text. The items of a row only
+    differ in their id, so the rest of the line is formatted once per row of the file
+    """
+    to_price = lambda cents: (cents // 100).astype(str) + '.' + (cents % 100).astype(str).str.zfill(2)
+    lines = (',' + convert_unique(df['product_id'], lambda ids: ids.astype(str)) + ',' + convert_unique(df['buy_date'], to_date) + ',' + convert_unique(df['price'], to_price)
+             + ',' + convert_unique(df['expiration_date'], to_date) + '\r\n')
+    lines = np.repeat(lines.to_numpy(), df['amount'].to_numpy())
+    ids = np.arange(first_id, first_id + len(lines)).astype(str)
+    return ''.join(map(operator.add, ids.tolist(), lines.tolist()))
+
+
+def to_events(df, first_id:int)-> list:
+    """Returns the buy event of every item that to_payload() formats, with the same ids and the data of a buy in the feed: prices in
+    cents and dates as YYYY-MM-DD strings
+    """
+    amounts = df['amount'].to_numpy()
+    columns = [df['product_id'], convert_unique(df['buy_date'], to_date), df['price'], convert_unique(df['expiration_date'], to_date)]
+    items = zip(range(first_id, first_id + int(amounts.sum())), *(np.repeat(column.to_numpy(), amounts).tolist() for column in columns))
+    return [('buy', {'id': buy_id, 'product_id': product_id, 'buy_date': buy_date, 'price': price, 'expiration_date': expiration_date})
+            for buy_id, product_id, buy_date, price, expiration_date in items]
+
+
+def import_file(csv_file, mapping_file=None, dry_run:bool=False):
+    """Imports a delivery file into bought.csv. The file is read in chunks of CHUNK_ROWS rows, with the columns, date format,
+    delimiter and decimal separator of the mapping file. Product names are matched with the catalog. Rows of which the content
+    hash is in the import index were imported before and are skipped, the other rows are appended to bought.csv with one group
+    commit per chunk, together with their buy events and the index with their hashes. A buy date that isn't in the file is left out
+    of the hash, so the same file imported on another system date is still recognized. A row with an amount is added once per item.
+    The ledger lock is held during the import. With dry_run nothing is written
+    """
+    start = time.perf_counter()
+    mapping = read_mapping(mapping_file)
+    try:
+        file_columns = list(pd.read_csv(csv_file, sep=mapping['delimiter'], nrows=0).columns)
+    except (OSError, ValueError) as e:
+        sys.exit(f'Error: The file can\'t be read ({e}).\n')
+    mapping['columns'] = map_columns(mapping['columns'], file_columns)
+    fields = [field for field in HASH_FIELDS if field != 'buy_date' or field in mapping['columns']]
+    stats = {'Rows read': 0, 'Invalid': 0, 'Duplicates': 0, 'Imported rows': 0, 'Items added': 0}
+    examples = []
+    known, seen = {}, pd.Series(dtype='float64')
+    system_date = str(read_system_date())
+    with ledger_lock():
+        index = load_import_index()
+        buy_id = generate_id(BOUGHT_CSV)
+        line = 2 # the first row below the header
+        for chunk in pd.read_csv(csv_file, sep=mapping['delimiter'], usecols=list(mapping['columns'].values()), dtype=str,
+                                 keep_default_na=False, chunksize=CHUNK_ROWS):
+            df, invalid = normalize_chunk(chunk, mapping, known, system_date, dry_run)
+            stats['Rows read'] += len(df)
+            stats['Invalid'] += int(invalid.sum())
+            examples.extend((np.flatnonzero(invalid)[:MAX_EXAMPLES - len(examples)] + line).tolist())
+            line += len(df)
+            df = df[~invalid]
+            hashes, seen = row_hashes(df, fields, seen)
+            new = ~contains(index, hashes)
+            stats['Duplicates'] += int((~new).sum())
+            df, hashes = df[new], hashes[new]
+            if not len(df):
+                continue
+            items = int(df['amount'].sum())
+            if not dry_run:
+                index = np.union1d(index, hashes)
+                atomic_write(PENDING_INDEX, index.tobytes()) # moved into place with the rows, see write_payload()
+                write_payload(BOUGHT_CSV, to_payload(df, buy_id), to_events(df, buy_id), {PENDING_INDEX: IMPORT_INDEX})
+            buy_id += items
+            stats['Imported rows'] += len(df)
+            stats['Items added'] += items
+    elapsed = time.perf_counter() - start
+    stats['Seconds'] = round(elapsed, 3)
+    stats['Rows per second'] = round(stats['Rows read'] / elapsed) if elapsed else stats['Rows read']
+
+    clear_console()
+    logo()
+    print(f'{"Dry run of the import" if dry_run else "Import"} of {csv_file}:')
+    print(tabulate([stats.values()], headers=list(stats.keys()), tablefmt='psql'), '\n')
+    if examples:
+        print(f'Invalid rows at line(s): {", ".join(map(str, examples))}\n')
+    if not dry_run:
+        statement_printer(f'===> Added {stats["Items added"]} item(s) to {BOUGHT_CSV}.', sound='success')
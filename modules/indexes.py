@@ -0,0 +1,297 @@
+# module for the persistent indexes that are kept next to the ledgers
+import csv
+import io
+import os
+import struct
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from .const import BOUGHT_CSV, SOLD_CSV, EXPIRY_INDEX, EXPIRY_LOTS, EXPIRY_SALES, to_cents, atomic_write, ledger_lock
+from .loader import load_csv
+
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# one record per lot of bought.csv, sorted on expiration date and id: dates as day ordinals (date.toordinal()), the price in cents and
+# the date of the first sale of the lot, UNSOLD when it isn't sold
+LOT_DTYPE = np.dtype([
+    ('expiration_date', '<i4'),
+    ('id', '<i8'),
+    ('buy_date', '<i4'),
+    ('product_id', '<i4'),
+    ('price', '<i8'),
+    ('sell_date', '<i4')
+    ])
+SALE_DTYPE = np.dtype([('bought_id', '<i8'), ('sell_date', '<i4')]) # a sale of a lot, as kept in the delta of the index
+UNSOLD = np.iinfo(np.int32).max
+
+# file header: magic, version, amount of sorted lots, amount of records in the delta files, and the size and last 64 bytes of both ledgers
+# that are covered
+HEADER = struct.Struct('<4sHQQQQ64sQ64s')
+HEADER_SIZE = 256 # the sorted lots start at a fixed offset, the rest of the header is padding
+MAGIC = b'SPEX'
+INDEX_VERSION = 3 # version 3 is the binary index with the sell date per lot, a saved index of another version is rebuilt
+MERGE_RECORDS = 10000 # the delta files are merged into the sorted lots when they hold more than this and more than 1/8 of the lots
+
+
+def ledger_size(csv_file)-> int:
+    """Returns the size of the given ledger in bytes, or 0 when the file doesn't exist
+    """
+    return os.path.getsize(csv_file) if os.path.exists(csv_file) else 0
+
+
+def ledger_tail(csv_file, size:int)-> str:
+    """Returns the last bytes before the given offset of the ledger as text. Saved together with the size to detect
+    whether a ledger only grew since then, or has been rewritten
+    """
+    if not size or not os.path.exists(csv_file):
+        return ''
+    with open(csv_file, 'rb') as file:
+        file.seek(max(0, size - 64))
+        return file.read(min(size, 64)).decode(errors='replace')
+
+
+def csv_tail(csv_file, size:int)-> bytes:
+    """Returns the last 64 bytes before the given offset of the csv file, used to detect whether it only grew since then
+    """
+    with open(csv_file, 'rb') as file:
+        file.seek(max(0, size - 64))
+        return file.read(min(size, 64))
+
+
+def appended_since(csv_file, size:int, tail:str)-> bool:
+    """Returns True when the ledger still starts with the content that was there at the given size, meaning rows were
+    only appended since then
+    """
+    return ledger_size(csv_file) >= size and ledger_tail(csv_file, size) == tail
+
+
+def read_rows_from(csv_file, offset:int):
+    """Yields the rows of the given csv file as lists, starting at the given byte offset. An offset of 0 skips the header.
+    Used to read only the rows that were appended since an index was last saved
+    """
+    with open(csv_file, 'rb') as file:
+        file.seek(offset)
+        reader = csv.reader(io.TextIOWrapper(file, newline=''))
+        if offset == 0:
+            next(reader, None)
+        for row in reader:
+            if row:
+                yield row
+
+
+def to_ordinals(column)-> np.ndarray:
+    """Converts a datetime column to date ordinals, the same numbers as date.toordinal() returns
+    """
+    return (column - pd.Timestamp('1970-01-01')).dt.days.to_numpy() + EPOCH_ORDINAL
+
+
+def first_sales(sales:np.ndarray)-> np.ndarray:
+    """Returns one sale per bought id, the one with the earliest sell date, sorted on bought id
+    """
+    sales = np.sort(sales, order=['bought_id', 'sell_date'])
+    return sales[np.unique(sales['bought_id'], return_index=True)[1]]
+
+
+def apply_sales(lots:np.ndarray, sales:np.ndarray):
+    """Sets the sell date of the lots that were sold earlier in the given sales, which are sorted on bought id with one sale per id
+    """
+    if not len(lots) or not len(sales):
+        return
+    positions = np.searchsorted(sales['bought_id'], lots['id']).clip(max=len(sales) - 1)
+    found = sales['bought_id'][positions] == lots['id']
+    lots['sell_date'] = np.where(found, np.minimum(lots['sell_date'], sales['sell_date'][positions]), lots['sell_date'])
+
+
+def read_header():
+    """Returns the amounts of sorted lots, delta lots and delta sales and the covered size and tail of both ledgers from the header of
+    the expiry index, or None when the file is missing or not an index of the current version
+    """
+    if not os.path.exists(EXPIRY_INDEX):
+        return None
+    with open(EXPIRY_INDEX, 'rb') as file:
+        data = file.read(HEADER.size)
+    if len(data) < HEADER.size:
+        return None
+    magic, version, rows, lots, sales, bought_size, bought_tail, sold_size, sold_tail = HEADER.unpack(data)
+    if magic != MAGIC or version != INDEX_VERSION:
+        return None
+    return {'rows': rows, 'lots': lots, 'sales': sales, 'bought_size': bought_size, 'bought_tail': bought_tail.rstrip(b'\0'),
+            'sold_size': sold_size, 'sold_tail': sold_tail.rstrip(b'\0')}
+
+
+def pack_header(rows:int, lots:int, sales:int)-> bytes:
+    """Returns the header of the expiry index with the current size and tail of both ledgers, padded to HEADER_SIZE
+    """
+    bought_size, sold_size = ledger_size(BOUGHT_CSV), ledger_size(SOLD_CSV)
+    return HEADER.pack(MAGIC, INDEX_VERSION, rows, lots, sales, bought_size, csv_tail(BOUGHT_CSV, bought_size), sold_size,
+                       csv_tail(SOLD_CSV, sold_size)).ljust(HEADER_SIZE, b'\0')
+
+
+def read_delta(path, dtype, count:int)-> np.ndarray:
+    """Returns the first count records of a delta file. Records after them are left by an interrupted update and are ignored
+    """
+    if not count:
+        return np.zeros(0, dtype=dtype)
+    return np.fromfile(path, dtype=dtype, count=count)
+
+
+def append_delta(path, dtype, count:int, records:np.ndarray):
+    """Appends the records to a delta file after its first count records and flushes them to disk
+    """
+    with open(path, 'ab') as file:
+        file.truncate(count * dtype.itemsize)
+        file.write(records.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def rows_to_lots(rows:list)-> np.ndarray:
+    """Converts rows from bought.csv to unsold lots
+    """
+    lots = np.zeros(len(rows), dtype=LOT_DTYPE)
+    lots['id'] = [int(row[0]) for row in rows]
+    lots['product_id'] = [int(row[1]) for row in rows]
+    lots['buy_date'] = [date.fromisoformat(row[2]).toordinal() for row in rows]
+    lots['price'] = [to_cents(row[3]) for row in rows]
+    lots['expiration_date'] = [date.fromisoformat(row[4]).toordinal() for row in rows]
+    lots['sell_date'] = UNSOLD
+    return lots
+
+
+def rows_to_sales(rows:list)-> np.ndarray:
+    """Converts rows from sold.csv to sales of lots
+    """
+    sales = np.zeros(len(rows), dtype=SALE_DTYPE)
+    sales['bought_id'] = [int(row[1]) for row in rows]
+    sales['sell_date'] = [date.fromisoformat(row[3]).toordinal() for row in rows]
+    return sales
+
+
+class ExpiryIndex:
+    """All lots from bought.csv sorted on expiration date, with the date of their first sale. Answering which lots expire in a date window
+    costs two binary searches on the memory-mapped file plus reading the matching lots.
+
+    The sorted lots are saved in expiry_index.bin after a header with the size of both ledgers. When the ledgers only grew since then,
+    the appended lots and sales are added to two small delta files, which are merged into the sorted lots once they grow large. When a
+    ledger shrunk or was rewritten, the index is rebuilt
+    """
+    def __init__(self, header:dict):
+        self.rows = header['rows']
+        self.lots = read_delta(EXPIRY_LOTS, LOT_DTYPE, header['lots'])
+        self.sales = first_sales(read_delta(EXPIRY_SALES, SALE_DTYPE, header['sales']))
+
+    def sorted_lots(self)-> np.ndarray:
+        """Returns the sorted lots, mapped from the file so only the part that is used is read
+        """
+        if not self.rows:
+            return np.zeros(0, dtype=LOT_DTYPE)
+        return np.memmap(EXPIRY_INDEX, dtype=LOT_DTYPE, mode='r', offset=HEADER_SIZE, shape=(self.rows,))
+
+    def between(self, first:int, last:int)-> np.ndarray:
+        """Returns the lots with an expiration ordinal from first up to and including last, with the sales of the delta applied,
+        sorted on expiration date and id
+        """
+        lots = self.sorted_lots()
+        expiration = lots['expiration_date']
+        lots = np.array(lots[np.searchsorted(expiration, first, 'left'):np.searchsorted(expiration, last, 'right')])
+        delta = self.lots[(self.lots['expiration_date'] >= first) & (self.lots['expiration_date'] <= last)]
+        lots = np.sort(np.concatenate([lots, delta]), order=['expiration_date', 'id']) if len(delta) else lots
+        apply_sales(lots, self.sales)
+        return lots
+
+
+def rebuild_expiry_index():
+    """Builds the index from scratch by loading both ledgers once, in parallel when they are large, and empties the delta files
+    """
+    bought, sold = load_csv(BOUGHT_CSV), load_csv(SOLD_CSV)
+    lots = np.zeros(len(bought), dtype=LOT_DTYPE)
+    lots['expiration_date'], lots['buy_date'] = to_ordinals(bought['expiration_date']), to_ordinals(bought['buy_date'])
+    lots['id'], lots['product_id'], lots['price'], lots['sell_date'] = bought['id'], bought['product_id'], bought['price'], UNSOLD
+    sales = np.zeros(len(sold), dtype=SALE_DTYPE)
+    sales['bought_id'], sales['sell_date'] = sold['bought_id'], to_ordinals(sold['sell_date'])
+    write_expiry_index(lots, first_sales(sales))
+
+
+def write_expiry_index(lots:np.ndarray, sales:np.ndarray):
+    """Sorts the lots, applies the sales and replaces the index with them, with empty delta files
+    """
+    lots = np.sort(lots, order=['expiration_date', 'id'])
+    apply_sales(lots, sales)
+    atomic_write(EXPIRY_INDEX, pack_header(len(lots), 0, 0) + lots.tobytes())
+
+
+def refresh_expiry_index(header:dict)-> dict:
+    """Brings the index up to date with the ledgers and returns the header that describes it. Appended lots and sales are written to the
+    delta files before the header is updated, so after a crash the header still describes a consistent index and the rows are added
+    again next time
+    """
+    bought_size, sold_size = ledger_size(BOUGHT_CSV), ledger_size(SOLD_CSV)
+    if header and header['bought_size'] == bought_size and header['sold_size'] == sold_size:
+        return header
+    if not header or not header['bought_size'] or csv_tail(BOUGHT_CSV, header['bought_size']) != header['bought_tail'] or bought_size < header['bought_size'] \
+            or csv_tail(SOLD_CSV, header['sold_size']) != header['sold_tail'] or sold_size < header['sold_size']:
+        rebuild_expiry_index()
+        return read_header()
+    lots = rows_to_lots(list(read_rows_from(BOUGHT_CSV, header['bought_size'])))
+    sales = rows_to_sales(list(read_rows_from(SOLD_CSV, header['sold_size'])))
+    if header['lots'] + len(lots) + header['sales'] + len(sales) > max(MERGE_RECORDS, header['rows'] // 8):
+        index = ExpiryIndex(header)
+        write_expiry_index(np.concatenate([index.sorted_lots(), index.lots, lots]), first_sales(np.concatenate([index.sales, sales])))
+        return read_header()
+    append_delta(EXPIRY_LOTS, LOT_DTYPE, header['lots'], lots)
+    append_delta(EXPIRY_SALES, SALE_DTYPE, header['sales'], sales)
+    with open(EXPIRY_INDEX, 'r+b') as file:
+        file.write(pack_header(header['rows'], header['lots'] + len(lots), header['sales'] + len(sales)))
+        file.flush()
+        os.fsync(file.fileno())
+    return read_header()
+
+
+def load_expiry_index()-> ExpiryIndex:
+    """Brings the expiry index up to date with the ledgers and returns it. The ledger lock is held, so no process appends to the
+    ledgers or the index meanwhile
+    """
+    with ledger_lock():
+        return ExpiryIndex(refresh_expiry_index(read_header()))
+
+
+def lots_to_rows(lots:np.ndarray)-> list:
+    """Converts index entries back to rows with the same keys as bought.csv, with date objects for the dates
+    """
+    return [{
+        'id': lot_id,
+        'product_id': product_id,
+        'buy_date': date.fromordinal(buy_date),
+        'price': price,
+        'expiration_date': date.fromordinal(expiration_date)
+        } for lot_id, product_id, buy_date, price, expiration_date in zip(lots['id'].tolist(), lots['product_id'].tolist(), lots['buy_date'].tolist(),
+                                                                          lots['price'].tolist(), lots['expiration_date'].tolist())]
+
+
+def in_stock(lots:np.ndarray, day:date)-> np.ndarray:
+    """Returns the lots that were bought on or before the given day and not sold on or before it, like the inventory report
+    """
+    return lots[(lots['buy_date'] <= day.toordinal()) & (lots['sell_date'] > day.toordinal())]
+
+
+def get_expiring_lots(day:date, within:int)-> list:
+    """Returns the unsold lots that are in stock on the given day and expire within the given amount of days
+    """
+    lots = load_expiry_index().between(day.toordinal(), (day + timedelta(within)).toordinal())
+    return lots_to_rows(in_stock(lots, day))
+
+
+def get_stock_lots(day:date)-> list:
+    """Returns the unsold lots that are in stock on the given day: bought on or before and expiring on or after that day
+    """
+    lots = load_expiry_index().between(day.toordinal(), UNSOLD)
+    return lots_to_rows(in_stock(lots, day))
+
+
+def get_expired_lots(day:date, first:date=None)-> list:
+    """Returns the lots that expired unsold before the given day. With the first argument only lots that expired
+    on or after that date are returned
+    """
+    lots = load_expiry_index().between(first.toordinal() if first else 0, day.toordinal() - 1)
+    return lots_to_rows(lots[lots['sell_date'] > day.toordinal()])
@@ -0,0 +1,224 @@
+# module for checking the integrity of the ledgers in one streaming pass
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from .const import BOUGHT_CSV, SOLD_CSV, logo, clear_console
+from .config import statement_printer
+from .catalog import get_product_names
+from .archive import ledger_files
+from .loader import stream_csv
+
+
+# the checks with their description, in the order they are printed
+CHECKS = {
+    'bought_invalid': 'Bought: rows with a missing or invalid value',
+    'bought_duplicate': 'Bought: ids used more than once',
+    'bought_order': 'Bought: ids not higher than the ids above them',
+    'bought_product': 'Bought: product ids missing from the catalog',
+    'bought_expiration': 'Bought: expiration date before the buy date',
+    'sold_invalid': 'Sold: rows with a missing or invalid value',
+    'sold_duplicate': 'Sold: ids used more than once',
+    'sold_order': 'Sold: ids not higher than the ids above them',
+    'sold_unknown': 'Sold: bought ids that don\'t exist',
+    'sold_twice': 'Sold: bought ids sold more than once',
+    'sold_dates': 'Sold: sell date before the buy date or after the expiration date',
+    'sold_product': 'Sold: product differs from the bought item',
+    'sold_buy_values': 'Sold: buy date or buy price differs from the bought item'
+    }
+MAX_EXAMPLES = 5 # line numbers printed per check
+
+
+def grow(array:np.ndarray, size:int)-> np.ndarray:
+    """Returns the array enlarged with zeros to at least the given size, doubling the size to keep the amount of copies low
+    """
+    if size <= len(array):
+        return array
+    return np.concatenate([array, np.zeros(max(size, 2 * len(array)) - len(array), dtype=array.dtype)])
+
+
+class Bitset:
+    """Set of non-negative integers stored as one bit per number, so the ids of a 10 million row ledger take about 1.2 MB
+    """
+    def __init__(self):
+        self.bits = np.zeros(1024, dtype=np.uint8)
+
+    def contains(self, values:np.ndarray)-> np.ndarray:
+        """Returns a boolean array that is True for the values in the set
+        """
+        inside = values < len(self.bits) * 8
+        result = np.zeros(len(values), dtype=bool)
+        result[inside] = (self.bits[values[inside] >> 3] & (1 << (values[inside] & 7)).astype(np.uint8)) != 0
+        return result
+
+    def add(self, values:np.ndarray):
+        """Adds the values to the set
+        """
+        if len(values):
+            self.bits = grow(self.bits, int(values.max()) // 8 + 1)
+            np.bitwise_or.at(self.bits, values >> 3, (1 << (values & 7)).astype(np.uint8))
+
+
+class LedgerCheck:
+    """State of a check of both ledgers: the ids seen so far as bitsets, the buy date, expiration date, product and price per bought id,
+    and the violations found per check
+    """
+    def __init__(self):
+        self.bought_ids = Bitset()
+        self.sold_ids = Bitset()
+        self.sold_lots = Bitset()
+        self.buy_days = np.zeros(1024, dtype=np.int32) # dates as days since 1970-01-01, by bought id
+        self.expiration_days = np.zeros(1024, dtype=np.int32)
+        self.products = np.zeros(1024, dtype=np.int32)
+        self.prices = np.zeros(1024, dtype=np.int64) # in cents
+        self.last_id = {'bought': -1, 'sold': -1} # the highest id so far in the file that is being checked
+        self.max_id = 0 # ids above this are invalid, see check_ledgers()
+        self.counts = dict.fromkeys(CHECKS, 0)
+        self.examples = {key: [] for key in CHECKS}
+        self.rows = 0
+        self.file_name = '' # the file that is being checked, used in the examples
+
+    def report(self, key:str, mask:np.ndarray, rows:np.ndarray):
+        """Counts the rows where the mask is True as violations of the given check and keeps the first line numbers as example
+        """
+        count = int(mask.sum())
+        if count:
+            self.counts[key] += count
+            room = MAX_EXAMPLES - len(self.examples[key])
+            if room > 0:
+                self.examples[key].extend(f'{self.file_name} line {row}' for row in rows[mask][:room].tolist())
+
+    def check_ids(self, ledger:str, ids:np.ndarray, rows:np.ndarray, seen:Bitset):
+        """Checks that the ids are unique over all files of the ledger and increasing in the order of the file, the order generate_id()
+        relies on
+        """
+        previous = np.maximum.accumulate(np.concatenate([[self.last_id[ledger]], ids]))[:-1]
+        self.report(f'{ledger}_order', ids <= previous, rows)
+        self.last_id[ledger] = max(self.last_id[ledger], int(ids.max()))
+        self.report(f'{ledger}_duplicate', seen.contains(ids) | pd.Series(ids).duplicated().to_numpy(), rows)
+        seen.add(ids)
+
+    def check_bought(self, chunk, rows:np.ndarray, catalog:np.ndarray):
+        """Checks a chunk of rows from bought.csv, with the dates as strings, and stores the dates, product and price per bought id
+        """
+        ids = to_number(chunk['id'])
+        products = to_number(chunk['product_id'])
+        prices = to_number(chunk['price'])
+        buy_days = to_days(chunk['buy_date'])
+        expiration_days = to_days(chunk['expiration_date'])
+        invalid = (invalid_ids(ids, self.max_id) | invalid_ids(products, self.max_id) | prices.isna() | buy_days.isna() | expiration_days.isna()).to_numpy()
+        self.report('bought_invalid', invalid, rows)
+        valid = ~invalid
+        if not valid.any():
+            return
+        ids, products, rows = ids[valid].to_numpy('int64'), products[valid].to_numpy('int64'), rows[valid]
+        buy_days, expiration_days = buy_days[valid].to_numpy('int32'), expiration_days[valid].to_numpy('int32')
+        prices = column_to_cents(prices[valid])
+        self.check_ids('bought', ids, rows, self.bought_ids)
+        self.report('bought_product', ~np.isin(products, catalog), rows)
+        self.report('bought_expiration', expiration_days < buy_days, rows)
+        size = int(ids.max()) + 1
+        self.buy_days, self.expiration_days, self.products = grow(self.buy_days, size), grow(self.expiration_days, size), grow(self.products, size)
+        self.prices = grow(self.prices, size)
+        self.buy_days[ids], self.expiration_days[ids], self.products[ids], self.prices[ids] = buy_days, expiration_days, products, prices
+
+    def check_sold(self, chunk, rows:np.ndarray):
+        """Checks a chunk of rows from sold.csv, with the dates as strings, against the bought ids seen before
+        """
+        ids = to_number(chunk['id'])
+        lots = to_number(chunk['bought_id'])
+        products = to_number(chunk['product_id'])
+        prices = to_number(chunk['sell_price'])
+        sell_days = to_days(chunk['sell_date'])
+        buy_days, buy_prices = to_days(chunk['buy_date']), to_number(chunk['buy_price']) # empty for bought ids that don't exist
+        invalid = (invalid_ids(ids, self.max_id) | invalid_ids(lots, np.inf) | invalid_ids(products, self.max_id) | prices.isna() | sell_days.isna()).to_numpy()
+        self.report('sold_invalid', invalid, rows)
+        valid = ~invalid
+        if not valid.any():
+            return
+        ids, lots, products, rows = ids[valid].to_numpy('int64'), lots[valid].to_numpy('int64'), products[valid].to_numpy('int64'), rows[valid]
+        sell_days = sell_days[valid].to_numpy('int32')
+        buy_days, buy_prices = buy_days[valid].to_numpy('float'), buy_prices[valid]
+        self.check_ids('sold', ids, rows, self.sold_ids)
+        known = self.bought_ids.contains(lots)
+        self.report('sold_unknown', ~known, rows)
+        lots, products, sell_days, rows, buy_days, buy_prices = lots[known], products[known], sell_days[known], rows[known], buy_days[known], buy_prices[known]
+        self.report('sold_twice', self.sold_lots.contains(lots) | pd.Series(lots).duplicated().to_numpy(), rows)
+        self.sold_lots.add(lots)
+        self.report('sold_dates', (sell_days < self.buy_days[lots]) | (sell_days > self.expiration_days[lots]), rows)
+        self.report('sold_product', products != self.products[lots], rows)
+        buy_missing = np.isnan(buy_days) | buy_prices.isna().to_numpy()
+        differs = (buy_days != self.buy_days[lots]) | (column_to_cents(buy_prices.fillna(0)) != self.prices[lots])
+        self.report('sold_buy_values', buy_missing | differs, rows)
+
+
+def invalid_ids(column, max_id)-> pd.Series:
+    """Returns True for the values that are not a whole number from 0 up to and including max_id
+    """
+    return column.isna() | (column < 0) | (column > max_id) | (column % 1 != 0)
+
+
+def to_number(column)-> pd.Series:
+    """Returns the column as numbers with NaN for invalid values. Columns that pandas already parsed as numbers are returned as they are,
+    only a chunk with an invalid value in the column is converted value by value
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        return column
+    return pd.to_numeric(column, errors='coerce')
+
+
+def column_to_cents(column)-> np.ndarray:
+    """Converts a column of prices without missing values to integer cents, so prices are compared without rounding errors
+    """
+    return (column.to_numpy(dtype=float) * 100).round().astype(np.int64)
+
+
+def to_days(column)-> pd.Series:
+    """Converts a column of YYYY-MM-DD strings to days since 1970-01-01, with NaN for invalid dates
+    """
+    dates = pd.to_datetime(column, format='%Y-%m-%d', errors='coerce')
+    return (dates - pd.Timestamp('1970-01-01')).dt.days
+
+
+def check_ledgers(workers:int=None):
+    """Checks both ledgers, including the archive, in one streaming pass per file and prints the violations per check with the first line numbers.
+    The files are read in chunks, so memory use depends on the highest id instead of the amount of rows: a bit per id for the id sets and
+    20 bytes per bought id for the dates, product and price. Ids higher than the size of the files in bytes are reported as invalid. With more than one worker the chunks of large ledgers are parsed in parallel.
+    Exits with status 1 when a violation was found
+    """
+    clear_console()
+    logo()
+    start = time.perf_counter()
+    state = LedgerCheck()
+    catalog = np.fromiter(get_product_names(), dtype='int64')
+    for ledger in (BOUGHT_CSV, SOLD_CSV): # all bought ids are known before the sales are checked
+        files = ledger_files(ledger)
+        # every row takes more than one byte, so an id higher than the size of the files can't come from generate_id(). This also
+        # limits the size of the id sets and of the arrays by bought id
+        state.max_id = sum(os.path.getsize(csv_file) for csv_file in files)
+        for csv_file in files:
+            state.file_name = os.path.basename(csv_file) if csv_file == ledger else f'archive/{os.path.basename(csv_file)}'
+            offset = 2 # the line number in the file of the first row, below the header
+            # the order is checked per file: compact keeps old unsold lots in the ledger while later ids are archived. The id sets
+            # are kept, so ids are still unique over both files
+            state.last_id = dict.fromkeys(state.last_id, -1)
+            for chunk in stream_csv(csv_file, workers, raw=True):
+                rows = np.arange(offset, offset + len(chunk))
+                offset += len(chunk)
+                if ledger == BOUGHT_CSV:
+                    state.check_bought(chunk, rows, catalog)
+                else:
+                    state.check_sold(chunk, rows)
+            state.rows += offset - 2
+    elapsed = time.perf_counter() - start
+
+    table = [[description, state.counts[key], ', '.join(state.examples[key])] for key, description in CHECKS.items()]
+    total = sum(state.counts.values())
+    print(f'Integrity check of {state.rows} rows in {elapsed:.2f} seconds:')
+    print(tabulate(table, headers=['Check', 'Violations', 'Examples'], tablefmt='psql'), '\n')
+    if total:
+        statement_printer(f'===> Found {total} violation(s).', sound='error')
+        sys.exit(1)
+    statement_printer('===> No violations found.', sound='success')
@@ -0,0 +1,111 @@
+# module for loading large ledgers into pandas dataframes, in parallel when the file is large
+import io
+import os
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .const import PARALLEL_LOAD_BYTES, PRICE_COLUMNS
+
+
+CHUNK_BYTES = 8 * 1024 * 1024 # size of the byte ranges that are parsed at once when streaming a ledger
+
+
+def split_ranges(csv_file, parts:int=None, chunk_bytes:int=None)-> tuple:
+    """Splits the csv file after the header into the given amount of byte ranges, or into ranges of about chunk_bytes. Every range ends right
+    after a newline, so no row is split between two ranges. Returns the header as list of column names and the ranges as (start, end) tuples
+    """
+    size = os.path.getsize(csv_file)
+    if chunk_bytes:
+        parts = max(1, size // chunk_bytes)
+    with open(csv_file, 'rb') as file:
+        header_line = file.readline()
+        start = file.tell()
+        ranges = []
+        for part in range(1, parts + 1):
+            if start >= size:
+                break
+            end = size if part == parts else max(start, size * part // parts)
+            if end < size:
+                file.seek(end)
+                file.readline() # move to the end of the row that contains the split point
+                end = file.tell()
+            ranges.append((start, end))
+            start = end
+    return header_line.decode().strip().split(','), ranges
+
+
+def parse_range(csv_file, header:list, start:int, end:int, raw:bool=False):
+    """Parses the rows between the given byte offsets into a dataframe. Columns ending with _date are converted to datetime and prices to cents.
+    With raw the dates and prices are kept as in the file and invalid values don't raise an error. Runs in a worker process
+    """
+    with open(csv_file, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    if raw:
+        return pd.read_csv(io.BytesIO(data), header=None, names=header)
+    df = pd.read_csv(io.BytesIO(data), header=None, names=header)
+    return parse_columns(df)
+
+
+def parse_columns(df):
+    """Converts all columns ending with _date from YYYY-MM-DD strings to datetime and the prices to integer cents
+    """
+    for column in df.columns:
+        if column.endswith('_date'):
+            df[column] = pd.to_datetime(df[column], format='%Y-%m-%d')
+    return parse_prices(df)
+
+
+def parse_prices(df):
+    """Converts the price columns from decimals to integer cents. Empty prices, the buy price of a sale of which the bought id
+    doesn't exist, become 0
+    """
+    for column in PRICE_COLUMNS:
+        if column in df.columns:
+            df[column] = (df[column].astype(float) * 100).round().fillna(0).astype('int64')
+    return df
+
+
+def unknown_costs(df)-> pd.Series:
+    """Returns True for the sales of which the buy price is unknown: backfill leaves the buy date and buy price empty when the bought id
+    doesn't exist. The empty price reads as 0 cents, so these sales are left out of costs and profit instead of counting as free
+    """
+    return df['buy_date'].isna()
+
+
+def load_csv(csv_file, workers:int=None):
+    """Loads a ledger as a dataframe with typed columns: ids as int, prices as integer cents and the dates as datetime.
+    Files larger than PARALLEL_LOAD_BYTES are split into newline aligned byte ranges that are parsed by a pool of worker processes,
+    one range per CPU core, and the results are concatenated in the original order. Smaller files are read directly, since starting
+    the workers would take longer than reading the file
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or os.path.getsize(csv_file) < PARALLEL_LOAD_BYTES:
+        return parse_columns(pd.read_csv(csv_file))
+    header, ranges = split_ranges(csv_file, workers)
+    if not ranges:
+        return parse_columns(pd.read_csv(csv_file))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        frames = list(pool.map(parse_range, [csv_file] * len(ranges), [header] * len(ranges), *zip(*ranges)))
+    return pd.concat(frames, ignore_index=True)
+
+
+def stream_csv(csv_file, workers:int=None, raw:bool=False):
+    """Yields the ledger as dataframes of about CHUNK_BYTES each, in file order, typed like load_csv() or with raw without parsing the dates and prices. Only a few
+    chunks are in memory at any time. With more than one worker the chunks are parsed by a pool of worker processes, each taking the next
+    byte range, while the caller processes the chunks that are ready
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or os.path.getsize(csv_file) < PARALLEL_LOAD_BYTES:
+        for chunk in pd.read_csv(csv_file, chunksize=CHUNK_BYTES // 40): # about 40 bytes per row
+            yield chunk if raw else parse_columns(chunk)
+        return
+    header, ranges = split_ranges(csv_file, chunk_bytes=CHUNK_BYTES)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(pool.submit(parse_range, csv_file, header, start, end, raw))
+            if len(pending) >= 2 * workers: # bounded amount of parsed chunks waiting to be processed
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,10 +1,23 @@
 # Imports
-from .functions import advance_time, reset_date, buy_product, check_advance_time, sell_product, string_to_date, read_system_date
+import sys
+from .functions import advance_time, reset_date, buy_product, check_advance_time, sell_product, sell_basket, string_to_date, read_system_date
 from .parser import init_parser
 from .const import check_data_files, get_today
-from .reporting import get_inventory_report, get_revenue_report, get_profit_report
+from .reporting import get_inventory_report, get_revenue_report, get_profit_report, get_expiring_report, get_waste_report, get_top_report, get_reorder_report, get_compare_report, get_stock_history_report
 from .config import write_config, display_config
 from .csv_creator import generate_csv
+from .catalog import check_catalog
+from .simulation import simulate
+from .archive import compact
+from .backfill import check_sold_columns, backfill
+from .feed import tail_feed
+from .importer import import_file
+from .replay import log_command, replay
+from .maintenance import maintenance
+from .integrity import check_ledgers
+from .cache import cached_report
+from .sketches import get_approx_revenue_report, get_approx_profit_report
+from .aliases import display_aliases, add_alias, remove_alias, prune_aliases
 
 # Do not change these lines.
 __winc_id__ = "a2bc36ea784242e4989deb157d527ba0"
@@ -24,6 +37,15 @@ def main():
     # first check if data files are present and create them when not present
     check_data_files()
 
+    # add the command to the command log when enabled
+    log_command(sys.argv[1:])
+
+    # make sure the product catalog exists and the ledgers store product ids
+    check_catalog()
+
+    # make sure the sales store the buy date and buy price of the bought items
+    check_sold_columns()
+
     # check if the advance time option has been enabled and set system date to today if not.
     check_advance_time()
 
@@ -54,38 +76,125 @@ def main():
             write_config(date_alert=cli.date_alert)
         elif cli.config == 'validate':
             write_config(validate_names=cli.validate)
+        elif cli.config == 'log':
+            write_config(log_commands=cli.log_commands)
+
+    # integrity check of the ledgers
+    elif cli.command == 'check':
+        check_ledgers(workers=cli.workers)
+
+    # moving settled rows to the archive
+    elif cli.command == 'compact':
+        compact(keep=cli.keep, dry_run=cli.dry_run)
+
+    # copying the buy columns into sold.csv
+    elif cli.command == 'backfill':
+        backfill()
+
+    # maintenance jobs
+    elif cli.command == 'maintenance':
+        maintenance(jobs=cli.jobs, budget=cli.budget, keep=cli.keep)
+
+    # replaying a command log
+    elif cli.command == 'replay':
+        replay(cli.log, cli.data, speed=cli.speed, max_rate=cli.max)
+
+    # importing delivery files
+    elif cli.command == 'import':
+        import_file(cli.file, mapping_file=cli.mapping, dry_run=cli.dry_run)
+
+    # reading the event feed
+    elif cli.command == 'feed':
+        tail_feed(after=cli.after, consumer=cli.consumer, limit=cli.limit, follow=cli.follow)
+
+    # product name aliases
+    elif cli.command == 'alias':
+        if cli.show:
+            display_aliases()
+        elif cli.add:
+            add_alias(*cli.add, silent=False)
+        elif cli.remove:
+            remove_alias(cli.remove)
+        elif cli.prune:
+            prune_aliases(cli.prune)
 
     # generate testdata
     elif cli.command == 'testdata':
         generate_csv(start_date=cli.startdate, csv_rows=cli.rows, items=cli.items)
 
+    # simulation
+    elif cli.command == 'simulate':
+        simulate(cli.days, buys=cli.buys, sells=cli.sells, items=cli.items, amount=cli.amount, script=cli.script, dry_run=cli.dry_run, seed=cli.seed)
+
     # buying
     elif cli.command == 'buy':
         buy_product(cli.product_name, cli.price, cli.expiration_date, cli.amount)
 
     # selling
     elif cli.command == 'sell':
-        sell_product(cli.product_name, cli.price, cli.amount)
+        if cli.basket:
+            sell_basket(cli.basket)
+        else:
+            sell_product(cli.product_name, cli.price, cli.amount)
 
     # reporting
     elif cli.command == 'report':
+        if cli.report in ('revenue', 'profit') and cli.export and cli.approx:
+            sys.exit('Error: An approximate report can\'t be exported. Use either --export or --approx.\n')
+
+        # table options of the report, the top report has its own --number instead
+        view = {'limit': cli.limit, 'sort_by': cli.sort_by, 'page': cli.page} if 'limit' in cli else {}
 
         # inventory report
         if cli.report == 'inventory':
             if cli.now:
-                get_inventory_report(option='today', export=cli.export, product=cli.product, file_type=cli.type)
+                get_inventory_report(option='today', export=cli.export, product=cli.product, file_type=cli.type, **view)
             elif cli.yesterday:
-                get_inventory_report(option='yesterday', export=cli.export, product=cli.product, file_type=cli.type)
+                get_inventory_report(option='yesterday', export=cli.export, product=cli.product, file_type=cli.type, **view)
             else:
-                get_inventory_report(date=cli.date, export=cli.export, product=cli.product, file_type=cli.type)
+                get_inventory_report(date=cli.date, export=cli.export, product=cli.product, file_type=cli.type, **view)
 
-        # revenue report 
+        # revenue report, served from the cache when there is no export and no estimate is asked
         elif cli.report == 'revenue':
-            get_revenue_report(start_date=cli.first, end_date=cli.last, export=cli.export, file_type=cli.type)
+            if cli.export:
+                get_revenue_report(start_date=cli.first, end_date=cli.last, export=cli.export, file_type=cli.type, **view)
+            elif cli.approx:
+                get_approx_revenue_report(start_date=cli.first, end_date=cli.last, **view)
+            else:
+                cached_report('revenue', get_revenue_report, cli.first, cli.last, **view)
 
-        # profit report 
+        # profit report, served from the cache when there is no export and no estimate is asked
         elif cli.report == 'profit':
-            get_profit_report(start_date=cli.first, end_date=cli.last, export=cli.export, file_type=cli.type)    
+            if cli.export:
+                get_profit_report(start_date=cli.first, end_date=cli.last, export=cli.export, file_type=cli.type, **view)    
+            elif cli.approx:
+                get_approx_profit_report(start_date=cli.first, end_date=cli.last, **view)
+            else:
+                cached_report('profit', get_profit_report, cli.first, cli.last, **view)
+
+        # expiring items report
+        elif cli.report == 'expiring':
+            get_expiring_report(within=cli.within, export=cli.export, product=cli.product, file_type=cli.type, **view)
+
+        # waste report
+        elif cli.report == 'waste':
+            get_waste_report(start_date=cli.first, within=cli.within, export=cli.export, file_type=cli.type, **view)
+
+        # best sellers / slow movers
+        elif cli.report == 'top':
+            get_top_report(start_date=cli.first, end_date=cli.last, n=cli.number, measure=cli.by, bottom=cli.bottom, export=cli.export, file_type=cli.type)
+
+        # period over period comparison
+        elif cli.report == 'compare':
+            get_compare_report(periods=cli.period, measure=cli.by, export=cli.export, file_type=cli.type, **view)
+
+        # stock level per day
+        elif cli.report == 'stock-history':
+            get_stock_history_report(start_date=cli.first, end_date=cli.last, product=cli.product, export=cli.export, file_type=cli.type, **view)
+
+        # reorder suggestions
+        elif cli.report == 'reorder':
+            get_reorder_report(days=cli.days, cover=cli.cover, alpha=cli.alpha, export=cli.export, file_type=cli.type, **view)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,122 @@
+# module for the maintenance jobs, that do the expensive work of the app in one batch, for example at night from cron
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import timedelta
+from tabulate import tabulate
+from .const import BOUGHT_CSV, SOLD_CSV, download_groceries, logo_state, logo, clear_console
+from .config import statement_printer
+from .catalog import refresh_catalog
+from .binary import sync_binary
+from .indexes import load_expiry_index
+from .sketches import sync_sketches
+from .archive import compact_ledgers
+from .cache import cached_report
+from .functions import read_system_date
+from .reporting import get_revenue_report, get_profit_report
+
+
+def refresh_groceries(deadline:float, keep:int)-> tuple:
+    """Downloads groceries.csv again and adds the new names to the catalog. The download gives up at the deadline
+    """
+    download_groceries(timeout=max(1.0, deadline - time.perf_counter()))
+    return 'done', f'{refresh_catalog()} new product(s)'
+
+
+def compact_job(deadline:float, keep:int)-> tuple:
+    """Moves the rows that were settled more than keep days ago to the archive, see compact_ledgers(). Can't be stopped halfway
+    """
+    cutoff, rows = compact_ledgers(keep)
+    return 'done', f'{rows[0][1] + rows[1][1]} row(s) settled before {cutoff} archived'
+
+
+def rebuild_indexes(deadline:float, keep:int)-> tuple:
+    """Brings the binary ledgers, the expiry index and the daily sketches up to date with the csv files, one at a time until the deadline
+    """
+    steps = {
+        'bought.bin': lambda: sync_binary(BOUGHT_CSV),
+        'sold.bin': lambda: sync_binary(SOLD_CSV),
+        'expiry index': load_expiry_index,
+        'sketches': sync_sketches
+        }
+    done = []
+    for name, step in steps.items():
+        if time.perf_counter() > deadline:
+            return 'partial', f'{", ".join(done) or "nothing"} updated, {len(steps) - len(done)} left'
+        step()
+        done.append(name)
+    return 'done', f'{", ".join(done)} updated'
+
+
+def report_ranges(day)-> list:
+    """Returns the date ranges of the reports that are cached in advance: the last 7 and 30 days, the current month and the previous
+    month. All ranges end before the given day, so sales of that day don't invalidate them
+    """
+    yesterday = day - timedelta(1)
+    month_start = day.replace(day=1)
+    previous_month_start = (month_start - timedelta(1)).replace(day=1)
+    ranges = [(day - timedelta(7), yesterday), (day - timedelta(30), yesterday), (month_start, yesterday), (previous_month_start, month_start - timedelta(1))]
+    return [(first, last) for first, last in dict.fromkeys(ranges) if first <= last]
+
+
+def warm_caches(deadline:float, keep:int)-> tuple:
+    """Runs the revenue and profit report over the ranges of report_ranges(), so the report cache holds them. Reports that are
+    still in the cache are only read. The output is discarded and the logo pause is skipped. Stops at the deadline
+    """
+    reports = [(report, function, first, last) for first, last in report_ranges(read_system_date())
+               for report, function in (('revenue', get_revenue_report), ('profit', get_profit_report))]
+    logo_state['pause'] = False
+    try:
+        for position, (report, function, first, last) in enumerate(reports):
+            if time.perf_counter() > deadline:
+                return 'partial', f'{position} of {len(reports)} report(s) cached'
+            with redirect_stdout(io.StringIO()):
+                cached_report(report, function, first, last, limit=None, sort_by=None, page=1) # the same key as the report command without options
+    finally:
+        logo_state['pause'] = True
+    return 'done', f'{len(reports)} report(s) cached'
+
+
+# the jobs in the order they run, with their time budget in seconds. Compacting comes before the indexes, since it rewrites the ledgers
+JOBS = {
+    'catalog': (refresh_groceries, 30),
+    'compact': (compact_job, 300),
+    'indexes': (rebuild_indexes, 300),
+    'cache': (warm_caches, 300)
+    }
+
+
+def maintenance(jobs:list=None, budget:float=None, keep:int=30):
+    """Runs the given maintenance jobs, or all jobs, and prints a status summary. Every job gets its own time budget: jobs that consist of
+    steps stop when the budget is spent ('partial'), a job that can't be stopped halfway is reported as 'over budget'. With a total budget
+    the remaining jobs are skipped once it is spent. A failing job doesn't stop the next jobs, but the command exits with status 1
+    """
+    start = time.perf_counter()
+    table = []
+    for name in jobs or JOBS:
+        job, job_budget = JOBS[name]
+        if budget is not None:
+            job_budget = min(job_budget, budget - (time.perf_counter() - start))
+            if job_budget <= 0:
+                table.append([name, 'skipped', 0, 0, 'the total budget was spent'])
+                continue
+        job_start = time.perf_counter()
+        try:
+            status, details = job(job_start + job_budget, keep)
+        except (Exception, SystemExit) as e:
+            status, details = 'failed', f'{type(e).__name__}: {e}'[:100]
+        seconds = time.perf_counter() - job_start
+        if status == 'done' and seconds > job_budget:
+            status = 'over budget'
+        table.append([name, status, round(seconds, 2), round(job_budget, 2), details])
+
+    clear_console()
+    logo(pause=False)
+    print('Maintenance jobs:')
+    print(tabulate(table, headers=['Job', 'Status', 'Seconds', 'Budget', 'Details'], tablefmt='psql'), '\n')
+    failed = [row[0] for row in table if row[1] == 'failed']
+    if failed:
+        statement_printer(f'===> Failed job(s): {", ".join(failed)}.', sound='error')
+        sys.exit(1)
+    statement_printer(f'===> Maintenance finished in {time.perf_counter() - start:.2f} seconds.', sound='success')
@@ -1,6 +1,7 @@
 import argparse
 from .functions import get_today, read_system_date, string_to_date, date_to_string
 from .config import ui_sounds
+from .const import DATA_DIR, COMMAND_LOG, to_cents
 from datetime import  datetime
 import re
 from chime import themes
@@ -59,6 +60,55 @@ def validate_amount(amount):
         raise argparse.ArgumentTypeError(f'Invalid data type -> "{amount}". Type should be int.')
        
 
+def validate_speed(speed):
+    """Validator for the replay speed. The data type must be float and the value must be greater than 0
+    """
+    try:
+        if float(speed) > 0:
+            return float(speed)
+        ui_sounds('error')
+        raise argparse.ArgumentTypeError('The entered speed should be greater than 0.')
+    except ValueError:
+        ui_sounds('error')
+        raise argparse.ArgumentTypeError(f'Invalid data type -> "{speed}". Type should be float.')
+
+
+def validate_sequence(sequence):
+    """Validator for the sequence number of the event feed. The data type must be int and the value can't be negative
+    """
+    try:
+        if int(sequence) >= 0:
+            return int(sequence)
+        ui_sounds('error')
+        raise argparse.ArgumentTypeError('The entered sequence number can\'t be negative.')
+    except ValueError:
+        ui_sounds('error')
+        raise argparse.ArgumentTypeError(f'Invalid data type -> "{sequence}". Type should be int.')
+
+
+def validate_price(price):
+    """Validator for prices. Converts the entered decimal price to integer cents, the way prices are handled by the app
+    """
+    try:
+        return to_cents(price)
+    except (ValueError, OverflowError):
+        ui_sounds('error')
+        raise argparse.ArgumentTypeError(f'Invalid data type -> "{price}". Type should be a number, for example 1.25.')
+
+
+def validate_alpha(alpha):
+    """Validator for the smoothing factor. The value must be a number greater than 0 and smaller than or equal to 1. 
+    """
+    try:
+        if 0 < float(alpha) <= 1:
+            return float(alpha)
+        ui_sounds('error')
+        raise argparse.ArgumentTypeError('The smoothing factor should be greater than 0 and smaller than or equal to 1.')
+    except ValueError:
+        ui_sounds('error')
+        raise argparse.ArgumentTypeError(f'Invalid data type -> "{alpha}". Type should be float.')
+
+
 # regex validation to check if the sting contains alphanumeric characters. Spaces and dashes are also accepted
 def validate_product_name(name:str):
     """Regex validation for the product name. Raises an error when an invalid character is used. 
@@ -68,6 +118,26 @@ def validate_product_name(name:str):
     else:
         raise argparse.ArgumentTypeError(f'Product name {name} is invalid. The string must only contain alphanumeric characters. Spaces and dashes and ampersands are allowed')
 
+def add_view_arguments(report):
+    """Adds the --limit, --sort-by and --page arguments to a report subparser
+    """
+    report.add_argument(
+        '--limit',
+        type=validate_amount,
+        metavar='N',
+        help='Shows at most the given amount of rows of the main table, as integer. Totals are still calculated over all rows')
+    report.add_argument(
+        '--sort-by',
+        metavar='COLUMN',
+        help='Sorts the main table by the given column, for example: name, revenue or items. Numbers are sorted from high to low')
+    report.add_argument(
+        '--page',
+        type=validate_amount,
+        default=1,
+        metavar='N',
+        help='The page to show when --limit is used, as integer. Default is 1')
+
+
 def init_parser():
     """Creates all parsers, subparsers and arguments. Extensive help is included. 
     """
@@ -207,8 +277,181 @@ def init_parser():
         action='store_false',
         dest='validate',
         help='Disables the product name validation')
+
+
+    # command log options
+    log = config.add_parser(
+        'log', 
+        help='If enabled every command is added to data/command_log.jsonl with its arguments and start time, so the workload can be replayed with the replay command',)
+    log = log.add_mutually_exclusive_group(required=True)
+    log.add_argument(
+        '-e',
+        '--enable',
+        action='store_true',
+        dest='log_commands',
+        help='Enables the command log',)
+    log.add_argument(
+        '-d',
+        '--disable',
+        action='store_false',
+        dest='log_commands',
+        help='Disables the command log')
     
 
+    # integrity check
+    check = subparser.add_parser('check', help='Checks both ledgers for invalid rows, duplicate ids, unknown or twice sold bought ids and sales outside the buy and expiration date')
+    check.add_argument(
+        '-w',
+        '--workers',
+        type=validate_amount,
+        metavar='',
+        help='The amount of processes that parse large ledgers, as integer. Default is the amount of CPU cores')
+
+
+    # compacting the ledgers
+    compact = subparser.add_parser('compact', help='Moves settled lots (sold or expired) and their sales to the archive, so the ledgers only hold the stock and the recent history. Reports read the archive when needed')
+    compact.add_argument(
+        '-k',
+        '--keep',
+        type=validate_amount,
+        default=30,
+        metavar='',
+        help='The amount of days of history to keep in the ledgers, counted back from the current system date. Default is 30')
+    compact.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Shows the amount of rows that would be archived without changing anything')
+
+
+    # backfilling the buy columns of sold.csv
+    subparser.add_parser('backfill', help='Copies the buy date and buy price of the bought items into the sales that don\'t have them yet, in sold.csv and its archive')
+
+
+    # maintenance jobs
+    maintenance = subparser.add_parser('maintenance', help='Runs the expensive jobs in one batch, for example at night from cron: refreshing the catalog, compacting the ledgers, updating the indexes and filling the report cache')
+    maintenance.add_argument(
+        '-j',
+        '--jobs',
+        nargs='+',
+        choices=['catalog', 'compact', 'indexes', 'cache'],
+        metavar='',
+        help='The jobs to run: catalog, compact, indexes and/or cache. Default is all jobs')
+    maintenance.add_argument(
+        '-b',
+        '--budget',
+        type=validate_amount,
+        metavar='',
+        help='The total amount of seconds for all jobs. Jobs that would start after this are skipped. Every job also has its own budget')
+    maintenance.add_argument(
+        '-k',
+        '--keep',
+        type=validate_amount,
+        default=30,
+        metavar='',
+        help='The amount of days of history to keep in the ledgers when compacting. Default is 30')
+
+
+    # replaying a command log
+    replay = subparser.add_parser('replay', help='Runs the commands of a command log against a copy of the data directory and prints the latency percentiles per command and the throughput')
+    replay.add_argument(
+        '-l',
+        '--log',
+        default=COMMAND_LOG,
+        metavar='',
+        help='Path to the command log. Default is data/command_log.jsonl')
+    replay.add_argument(
+        '-d',
+        '--data',
+        default=DATA_DIR,
+        metavar='',
+        help='The data directory that is copied before the replay, for example a copy made at the start of the logged day. Default is the data directory of the app')
+    replay_speed = replay.add_mutually_exclusive_group()
+    replay_speed.add_argument(
+        '-s',
+        '--speed',
+        type=validate_speed,
+        default=1.0,
+        metavar='',
+        help='Replays the commands at this multiple of the original speed, for example 10 to replay an hour in 6 minutes. Default is 1')
+    replay_speed.add_argument(
+        '--max',
+        action='store_true',
+        help='Runs every command right after the previous one finished')
+
+
+    # importing delivery files
+    importer = subparser.add_parser('import', help='Adds the rows of a delivery file to bought.csv. Rows that were imported before, for example from an overlapping file, are skipped')
+    importer.add_argument(
+        '-f',
+        '--file',
+        required=True,
+        metavar='',
+        help='Path to the csv file to import')
+    importer.add_argument(
+        '-m',
+        '--mapping',
+        metavar='',
+        help='Path to a json file with the column per field and the date format, delimiter and decimal separator of the file. Without a mapping the columns need the names product_name, price and expiration_date, with the optional buy_date and amount')
+    importer.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Shows the amount of new, duplicate and invalid rows without changing anything')
+
+
+    # reading the event feed
+    feed = subparser.add_parser('feed', help='Prints the events of the buys, sales, date shifts and config changes as json lines, in order of their sequence number')
+    feed.add_argument(
+        '-a',
+        '--after',
+        type=validate_sequence,
+        metavar='',
+        help='Prints the events after this sequence number. Default is 0, or the stored offset of the consumer')
+    feed.add_argument(
+        '-c',
+        '--consumer',
+        metavar='',
+        help='Name of the consumer. The feed continues after the last event printed for this consumer, which is stored after printing')
+    feed.add_argument(
+        '-n',
+        '--limit',
+        type=validate_amount,
+        metavar='',
+        help='The maximum amount of events to print')
+    feed.add_argument(
+        '--follow',
+        action='store_true',
+        help='Keeps waiting for new events until the program is interrupted with Ctrl+C')
+
+
+    # product name aliases
+    alias = subparser.add_parser('alias', help='List, add, remove or prune the learned product name aliases. Confirmed name corrections are stored as alias, so the same input is never asked again')
+    alias = alias.add_mutually_exclusive_group(required=True)
+    alias.add_argument(
+        '-s',
+        '--show',
+        action='store_true',
+        help='Shows all aliases')
+    alias.add_argument(
+        '-a',
+        '--add',
+        nargs=2,
+        type=validate_product_name,
+        metavar=('NAME', 'PRODUCT'),
+        help='Adds an alias: the entered name followed by the product name to register instead. Use double quotes for names containing spaces')
+    alias.add_argument(
+        '-r',
+        '--remove',
+        type=validate_product_name,
+        metavar='',
+        help='Removes the alias for the given name')
+    alias.add_argument(
+        '-p',
+        '--prune',
+        type=validate_amount,
+        metavar='',
+        help='Removes the aliases that were not used for the given amount of days')
+
+
     # test data generator
     testdata = subparser.add_parser('testdata', help='Generates a bought.csv and sold.csv file that can be used for test purposes. Each run the previously generated test files will be overwritten')
     testdata.add_argument(
@@ -234,6 +477,61 @@ def init_parser():
         help='Enter the amount of unique items (products) the files should contain')
     
 
+    # simulation
+    simulate = subparser.add_parser('simulate', help='Simulates a number of days of buying and selling in memory and reports the throughput. The ledgers are written once at the end')
+    simulate.add_argument(
+        '-d',
+        '--days',
+        type=validate_amount,
+        required=True,
+        metavar='N',
+        help='Enter the amount of days to simulate as integer, starting at the current system date')
+    simulate.add_argument(
+        '-b',
+        '--buys',
+        type=int,
+        default=20,
+        metavar='N',
+        help='The amount of buy operations per day for a random scenario. Default is 20')
+    simulate.add_argument(
+        '-s',
+        '--sells',
+        type=int,
+        default=100,
+        metavar='N',
+        help='The amount of sell operations per day for a random scenario. Default is 100')
+    simulate.add_argument(
+        '-i',
+        '--items',
+        type=validate_amount,
+        default=50,
+        metavar='N',
+        help='The amount of unique products in a random scenario. Default is 50')
+    simulate.add_argument(
+        '-a',
+        '--amount',
+        type=validate_amount,
+        default=5,
+        metavar='N',
+        help='The maximum amount of items per operation in a random scenario. Default is 5')
+    simulate.add_argument(
+        '--script',
+        required=False,
+        metavar='FILE',
+        help='Path to a json file with the operations to run instead of a random scenario. See the README for the format')
+    simulate.add_argument(
+        '--seed',
+        type=int,
+        required=False,
+        metavar='N',
+        help='Optional seed for the random scenario, to repeat the same run')
+    simulate.add_argument(
+        '--dry-run',
+        action='store_true',
+        dest='dry_run',
+        help='Runs the simulation without writing to the ledgers or changing the date')
+
+
     # buy products
     buy = subparser.add_parser('buy', help='Function to register bought products.')
     buy.add_argument(
@@ -246,10 +544,10 @@ def init_parser():
     buy.add_argument(
         '-p',
         '--price', 
-        type=float, 
+        type=validate_price, 
         required=True, 
         metavar='',
-        help='Enter the price of the product as float.')
+        help='Enter the price of the product as number with up to two decimals, for example 1.25.')
     buy.add_argument(
         '-e',
         '--expiration_date', 
@@ -270,20 +568,24 @@ def init_parser():
 
     # sell products
     sell = subparser.add_parser('sell', help='Function to register sold products.')
-    sell.add_argument(
+    sell_items = sell.add_mutually_exclusive_group(required=True)
+    sell_items.add_argument(
         '-n',
         '--product_name', 
         type =validate_product_name, 
-        required=True, 
         metavar='',
         help='Enter the name of the product.')
+    sell_items.add_argument(
+        '-b',
+        '--basket',
+        metavar='',
+        help='Sells all products in a csv file with the columns product, price and amount as one transaction. Nothing is registered when a product is short on stock')
     sell.add_argument(
         '-p',
         '--price', 
-        type=float, 
-        required=True,
+        type=validate_price, 
         metavar='', 
-        help='Enter the selling price of the product as float.')
+        help='Enter the selling price of the product as number with up to two decimals, for example 1.25. Required with --product_name')
     sell.add_argument(
         '-a,',
         '--amount', 
@@ -325,6 +627,7 @@ def init_parser():
         choices=['csv', 'xlsx'],
         metavar='',
         help='Sets the output file type of the export file. Default is CSV')
+    add_view_arguments(inventory)
     inventory = inventory.add_mutually_exclusive_group(required=True)
     inventory.add_argument(
         '-n',
@@ -353,14 +656,14 @@ def init_parser():
         '--first',
         type=validate_date,
         required=True,
-        metavar='',
+        metavar='DATE',
         help='Enter the start date of the report as: YYYY-MM-DD.')
     revenue.add_argument(
         '-l',
         '--last',
         type=validate_date,
         required=True,
-        metavar='',
+        metavar='DATE',
         help='Enter the end date of the report as: YYYY-MM-DD.')
     revenue.add_argument(
         '-e',
@@ -368,6 +671,11 @@ def init_parser():
         required=False,
         action='store_true',
         help='Exports the report data to a csv file. No calculating or aggregating will be done. The report contains all items within the given time frame')
+    revenue.add_argument(
+        '--approx',
+        required=False,
+        action='store_true',
+        help='Estimates the report from the daily sketches instead of reading the ledgers, fast over any time frame, but not together with --export. The totals are exact, the revenue per product is estimated within the printed error bounds')
     revenue.add_argument(
         '-t',
         '--type',
@@ -375,8 +683,9 @@ def init_parser():
         nargs='?',
         default='csv',
         choices=['csv', 'xlsx'],
-        metavar='',
+        metavar='TYPE',
         help='Sets the output file type of the export file. Default is CSV')
+    add_view_arguments(revenue)
 
 
     # profit reporting
@@ -389,14 +698,14 @@ def init_parser():
         '--first',
         type=validate_date,
         required=True,
-        metavar='', 
+        metavar='DATE', 
         help='Enter the start date of the report as: YYYY-MM-DD.')
     profit.add_argument(
         '-l',
         '--last',
         type=validate_date,
         required=True,
-        metavar='',
+        metavar='DATE',
         help='Enter the end date of the report as: YYYY-MM-DD.')
     profit.add_argument(
         '-e',
@@ -405,6 +714,179 @@ def init_parser():
         action='store_true',
         help='Exports the profit report data to a csv file without grouping first. ')
     profit.add_argument(
+        '--approx',
+        required=False,
+        action='store_true',
+        help='Estimates the report from the daily sketches instead of reading the ledgers, fast over any time frame, but not together with --export. The totals are exact, the profit per product is estimated within the printed error bounds')
+    profit.add_argument(
+        '-t',
+        '--type',
+        required=False,
+        nargs='?',
+        default='csv',
+        choices=['csv', 'xlsx'],
+        metavar='TYPE',
+        help='Sets the output file type of the export file. Default is CSV')
+    add_view_arguments(profit)
+
+
+    # expiring items report
+    expiring = report.add_parser(
+        'expiring',
+        help='Lists the unsold items that expire within the given amount of days from the current system date'
+    )
+    expiring.add_argument(
+        '-w',
+        '--within',
+        type=validate_amount,
+        required=True,
+        metavar='DAYS',
+        help='Enter the amount of days as integer.')
+    expiring.add_argument(
+        '-p',
+        '--product',
+        required=False,
+        type = validate_product_name,
+        metavar='NAME',
+        help='Optional product filter. Enter a product name to only show the expiring items of that product')
+    expiring.add_argument(
+        '-e',
+        '--export',
+        required=False,
+        action='store_true',
+        help='Exports the expiring items to a csv file')
+    expiring.add_argument(
+        '-t',
+        '--type',
+        required=False,
+        nargs='?',
+        default='csv',
+        choices=['csv', 'xlsx'],
+        metavar='TYPE',
+        help='Sets the output file type of the export file. Default is CSV')
+    add_view_arguments(expiring)
+
+
+    # waste reporting
+    waste = report.add_parser(
+        'waste',
+        help='Get an overview of the items that expired unsold (written off) and optionally a forecast of the items that will expire'
+    )
+    waste.add_argument(
+        '-f',
+        '--first',
+        type=validate_date,
+        required=False,
+        metavar='',
+        help='Optional start date as: YYYY-MM-DD. Only items that expired on or after this date are included.')
+    waste.add_argument(
+        '-w',
+        '--within',
+        type=validate_amount,
+        required=False,
+        metavar='',
+        help='Optional amount of days as integer. Adds a forecast of the items in stock that will expire within this amount of days.')
+    waste.add_argument(
+        '-e',
+        '--export',
+        required=False,
+        action='store_true',
+        help='Exports the written off items to a csv file')
+    waste.add_argument(
+        '-t',
+        '--type',
+        required=False,
+        nargs='?',
+        default='csv',
+        choices=['csv', 'xlsx'],
+        metavar='',
+        help='Sets the output file type of the export file. Default is CSV')
+    add_view_arguments(waste)
+
+
+    # best sellers and slow movers
+    top = report.add_parser(
+        'top',
+        help='Get the best selling (or with --bottom the slowest) products over a given time frame'
+    )
+    top.add_argument(
+        '-f',
+        '--first',
+        type=validate_date,
+        required=True,
+        metavar='',
+        help='Enter the start date of the report as: YYYY-MM-DD.')
+    top.add_argument(
+        '-l',
+        '--last',
+        type=validate_date,
+        required=True,
+        metavar='',
+        help='Enter the end date of the report as: YYYY-MM-DD.')
+    top.add_argument(
+        '-n',
+        '--number',
+        type=validate_amount,
+        default=10,
+        metavar='',
+        help='The amount of products to show as integer. Default is 10')
+    top.add_argument(
+        '-b',
+        '--by',
+        default='units',
+        choices=['units', 'revenue', 'profit'],
+        metavar='',
+        help='Rank the products by units, revenue or profit. Default is units')
+    top.add_argument(
+        '-s',
+        '--bottom',
+        action='store_true',
+        help='Shows the slowest products instead of the best sellers, including products that were in stock but not sold')
+    top.add_argument(
+        '-e',
+        '--export',
+        required=False,
+        action='store_true',
+        help='Exports the ranking to a csv file')
+    top.add_argument(
+        '-t',
+        '--type',
+        required=False,
+        nargs='?',
+        default='csv',
+        choices=['csv', 'xlsx'],
+        metavar='',
+        help='Sets the output file type of the export file. Default is CSV')
+
+
+    # period over period comparison
+    compare = report.add_parser(
+        'compare',
+        help='Compares the units, revenue, costs and profit per product over two or more time frames'
+    )
+    compare.add_argument(
+        '-p',
+        '--period',
+        type=validate_date,
+        nargs=2,
+        action='append',
+        required=True,
+        metavar=('FIRST', 'LAST'),
+        help='Enter the start and end date of a time frame as: YYYY-MM-DD YYYY-MM-DD. Use the argument once per time frame, the first time frame is the base of the comparison')
+    compare.add_argument(
+        '-b',
+        '--by',
+        default='revenue',
+        choices=['units', 'revenue', 'cost', 'profit'],
+        metavar='',
+        help='The measure to show per product: units, revenue, cost or profit. Default is revenue. The export contains all measures')
+    compare.add_argument(
+        '-e',
+        '--export',
+        required=False,
+        action='store_true',
+        help='Exports all measures per product and time frame to a csv file')
+    compare.add_argument(
         '-t',
         '--type',
         required=False,
@@ -413,6 +895,99 @@ def init_parser():
         choices=['csv', 'xlsx'],
         metavar='',
         help='Sets the output file type of the export file. Default is CSV')
+    add_view_arguments(compare)
 
 
-    return parser.parse_args()
+    # stock level per day
+    stock_history = report.add_parser(
+        'stock-history',
+        help='Get the items in stock and their value per day over a given time frame, in total and per product'
+    )
+    stock_history.add_argument(
+        '-f',
+        '--first',
+        type=validate_date,
+        required=True,
+        metavar='DATE',
+        help='Enter the start date of the report as: YYYY-MM-DD.')
+    stock_history.add_argument(
+        '-l',
+        '--last',
+        type=validate_date,
+        required=True,
+        metavar='DATE',
+        help='Enter the end date of the report as: YYYY-MM-DD.')
+    stock_history.add_argument(
+        '-p',
+        '--product',
+        required=False,
+        type = validate_product_name,
+        metavar='NAME',
+        help='Optional product filter. Enter a product name to get the stock per day of that product only')
+    stock_history.add_argument(
+        '-e',
+        '--export',
+        required=False,
+        action='store_true',
+        help='Exports the stock per product and day to a csv file')
+    stock_history.add_argument(
+        '-t',
+        '--type',
+        required=False,
+        nargs='?',
+        default='csv',
+        choices=['csv', 'xlsx'],
+        metavar='TYPE',
+        help='Sets the output file type of the export file. Default is CSV')
+    add_view_arguments(stock_history)
+
+
+    # reorder suggestions
+    reorder = report.add_parser(
+        'reorder',
+        help='Get a reorder suggestion per product, based on the recent daily sales and the current stock'
+    )
+    reorder.add_argument(
+        '-d',
+        '--days',
+        type=validate_amount,
+        default=28,
+        metavar='',
+        help='The amount of days of sales history to base the forecast on, as integer. Default is 28')
+    reorder.add_argument(
+        '-c',
+        '--cover',
+        type=validate_amount,
+        default=7,
+        metavar='',
+        help='The amount of days the stock should cover after ordering, as integer. Default is 7')
+    reorder.add_argument(
+        '-a',
+        '--alpha',
+        type=validate_alpha,
+        default=0.3,
+        metavar='',
+        help='The smoothing factor of the forecast between 0 and 1. A higher value gives more weight to recent sales. Default is 0.3')
+    reorder.add_argument(
+        '-e',
+        '--export',
+        required=False,
+        action='store_true',
+        help='Exports the suggestions for all products to a csv file')
+    reorder.add_argument(
+        '-t',
+        '--type',
+        required=False,
+        nargs='?',
+        default='csv',
+        choices=['csv', 'xlsx'],
+        metavar='',
+        help='Sets the output file type of the export file. Default is CSV')
+    add_view_arguments(reorder)
+
+
+    args = parser.parse_args()
+    if args.command == 'sell' and args.product_name and args.price is None:
+        ui_sounds('error')
+        parser.error('the argument -p/--price is required with -n/--product_name')
+    return args
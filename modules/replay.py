@@ -0,0 +1,118 @@
+# module for logging the commands and replaying a command log to measure the latency per command
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from tabulate import tabulate
+from .const import COMMAND_LOG, SETTINGS, DATA_DIR_ENV, REPLAY_ENV, logo, clear_console
+from .config import statement_printer, read_config
+
+
+SUPER_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'super.py') # the entry point that runs main()
+REPLAY_SETTINGS = {'sound': False, 'printer': False, 'enable_date_alert': False, 'validate_names': False, 'log_commands': False} # no sounds, delays or questions
+COPY_IGNORE = ('*.lock', '*.tmp', 'command_log.jsonl') # files that are not copied to the data directory of the replay
+GROUPED_COMMANDS = ('report', 'config') # commands that are measured per subcommand, like 'report revenue'
+
+
+def log_command(args:list):
+    """Appends the command with its arguments and the start time to the command log, when enabled in the settings. The commands
+    run by replay and the replay command itself are not logged
+    """
+    if not args or args[0] == 'replay' or os.environ.get(REPLAY_ENV) or not read_config()['log_commands']:
+        return
+    with open(COMMAND_LOG, 'a') as file:
+        file.write(json.dumps({'time': time.time(), 'cwd': os.getcwd(), 'args': args}) + '\n')
+
+
+def read_log(log_file)-> list:
+    """Returns the entries of the command log in order of their start time. Exits with a message when the log can't be read or is empty
+    """
+    try:
+        with open(log_file, 'r') as file:
+            entries = [json.loads(line) for line in file if line.strip()]
+    except (OSError, ValueError) as e:
+        sys.exit(f'Error: The command log can\'t be read ({e}).\n')
+    if not entries:
+        sys.exit('Error: The command log is empty. Enable it with: config log --enable\n')
+    return sorted(entries, key=lambda entry: entry['time'])
+
+
+def copy_data_dir(data_dir)-> str:
+    """Copies the data directory to a temporary directory and changes the settings of the copy, so the commands run without sounds,
+    typewriter delays and questions. Returns the path of the copy
+    """
+    if not os.path.isdir(data_dir):
+        sys.exit(f'Error: The data directory {data_dir} doesn\'t exist.\n')
+    copy = os.path.join(tempfile.mkdtemp(prefix='superpy-replay-'), 'data')
+    shutil.copytree(data_dir, copy, ignore=shutil.ignore_patterns(*COPY_IGNORE))
+    settings = os.path.join(copy, os.path.basename(SETTINGS))
+    if os.path.exists(settings):
+        with open(settings, 'r') as file:
+            data = json.load(file)
+        with open(settings, 'w') as file:
+            json.dump({**data, **REPLAY_SETTINGS}, file, indent=4)
+    return copy
+
+
+def command_type(args:list)-> str:
+    """Returns the name under which the latency of the command is reported, for example 'sell' or 'report revenue'
+    """
+    if args[0] in GROUPED_COMMANDS and len(args) > 1 and not args[1].startswith('-'):
+        return f'{args[0]} {args[1]}'
+    return args[0]
+
+
+def run_command(entry:dict, environment:dict)-> tuple:
+    """Runs the command through super.py, in the working directory it was logged in, and returns the latency in seconds and the exit code.
+    The output is discarded
+    """
+    cwd = entry.get('cwd') if os.path.isdir(entry.get('cwd', '')) else None
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, SUPER_PY, *entry['args']], cwd=cwd, env=environment, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start, result.returncode
+
+
+def replay(log_file, data_dir, speed:float=1.0, max_rate:bool=False):
+    """Replays the command log against a copy of the data directory and prints the latency percentiles per command type and the throughput.
+    Every command is run as its own process through super.py, like it was entered by the user. The commands start at their logged
+    time relative to the first command, divided by the speed, or right after each other with max_rate. A command that would start
+    while the previous one is still running starts when it finished; the largest delay is printed. The copy is removed afterwards
+    """
+    entries = read_log(log_file)
+    copy = copy_data_dir(data_dir)
+    environment = {**os.environ, DATA_DIR_ENV: copy, REPLAY_ENV: '1'}
+    latencies, errors = {}, {}
+    delay = 0.0
+    first = entries[0]['time']
+    start = time.perf_counter()
+    try:
+        for entry in entries:
+            if not max_rate:
+                wait = (entry['time'] - first) / speed - (time.perf_counter() - start)
+                if wait > 0:
+                    time.sleep(wait)
+                delay = max(delay, -wait)
+            latency, exit_code = run_command(entry, environment)
+            name = command_type(entry['args'])
+            latencies.setdefault(name, []).append(latency)
+            errors[name] = errors.get(name, 0) + (exit_code != 0)
+    finally:
+        shutil.rmtree(os.path.dirname(copy), ignore_errors=True)
+    elapsed = time.perf_counter() - start
+
+    table = []
+    for name, values in sorted(latencies.items()) + [('TOTAL', [value for values in latencies.values() for value in values])]:
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+        table.append([name, len(values), errors.get(name, sum(errors.values())), round(p50, 1), round(p95, 1), round(p99, 1), round(max(values) * 1000, 1)])
+    clear_console()
+    logo(pause=False)
+    mode = 'maximum rate' if max_rate else f'{speed:g}x speed'
+    print(f'Replay of {len(entries)} command(s) from {log_file} at {mode}:')
+    print(tabulate(table, headers=['Command', 'Count', 'Errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Max (ms)'], tablefmt='psql'), '\n')
+    if not max_rate:
+        print(f'Largest delay behind the original schedule: {delay:.2f} seconds.\n')
+    statement_printer(f'===> Replayed {len(entries)} command(s) in {elapsed:.2f} seconds: {len(entries) / elapsed:.2f} command(s) per second.', sound='success')
@@ -1,10 +1,16 @@
 import pandas as pd
+import numpy as np
 from tabulate import tabulate
-from .functions import read_system_date, get_bought_ids, validate_dates, date_to_string
-from .const import BOUGHT_CSV, logo, SOLD_CSV, set_export_data, clear_console
+from .functions import read_system_date, validate_dates, date_to_string
+from .const import BOUGHT_CSV, BOUGHT_HEADER, PRICE_COLUMNS, logo, SOLD_CSV, set_export_data, clear_console
+from .archive import load_history, read_chunks, get_archived_expired_lots
+from .indexes import get_expiring_lots, get_expired_lots, get_stock_lots
+from .loader import unknown_costs
 from datetime import timedelta
 from .config import ui_sounds, statement_printer
+from .catalog import get_product_names, get_product_id
 import sys
+import heapq
 
 def compare_dates(start_date, end_date):
     """Exits when an invalid date interval is given. 
@@ -14,33 +20,102 @@ def compare_dates(start_date, end_date):
         sys.exit(f'Error: The end date ({date_to_string(end_date)}) must be greater than, or equal to the start date ({date_to_string(start_date)}).\n')
 
 
-def get_inventory_report(option:str='today', date=None, export:bool=None, product:str=None, file_type:str=None):
+def add_product_names(df):
+    """Replaces the product_id column of the dataframe by a product_name column with the names from the catalog.
+    Names are only joined at render or export time, all filtering and grouping is done on the ids
+    """
+    position = df.columns.get_loc('product_id')
+    df.insert(position, 'product_name', df['product_id'].map(get_product_names()))
+    return df.drop('product_id', axis=1)
+
+
+def to_decimals(df, columns=PRICE_COLUMNS):
+    """Returns the dataframe with the given money columns converted from integer cents to decimals. All calculations are done in cents,
+    the conversion is only done to print or export a table
+    """
+    return df.assign(**{column: df[column] / 100 for column in columns if column in df.columns})
+
+
+def sort_table(table, sort_by:str):
+    """Sorts a report table on the column that matches sort_by (case insensitive, a part of the column name is enough).
+    Numbers are sorted from high to low, the product name from A to Z. Exits when no column matches
+    """
+    key = sort_by.lower()
+    if key in ('name', 'product', 'product name'):
+        if 'Product name' in table.columns:
+            return table.sort_values(by='Product name', kind='stable')
+        return table.sort_index(kind='stable')
+    columns = [column for column in table.columns if column.lower() == key] or [column for column in table.columns if key in column.lower()]
+    if not columns:
+        clear_console()
+        sys.exit(f'Error: The report can\'t be sorted by {sort_by}. Choose one of: name, {", ".join(column.lower() for column in table.columns)}.\n')
+    return table.sort_values(by=columns[0], ascending=False, kind='stable')
+
+
+def print_table(table, total:str=None, limit:int=None, sort_by:str=None, page:int=1, **kwargs):
+    """Prints a report table with tabulate, showing only the rows of the requested page. The totals row (the row with the total label as index,
+    calculated by the pivot table over all rows) is always printed as last row, whatever page is shown. Sorting is done on the whole table.
+    Only the shown rows are formatted, so printing a page of a table with thousands of products costs the same as printing a small table.
+    The kwargs are passed to tabulate
+    """
+    totals = None
+    if total is not None and total in table.index:
+        totals = table.loc[[total]]
+        table = table.drop(total)
+    if sort_by:
+        table = sort_table(table, sort_by)
+    rows = len(table)
+    if limit:
+        first = (page - 1) * limit
+        table = table.iloc[first:first + limit]
+    if totals is not None:
+        table = pd.concat([table, totals])
+    print(tabulate(table, headers='keys', tablefmt='psql', **kwargs))
+    if limit:
+        pages = max(1, -(-rows // limit))
+        if page > pages:
+            print(f'Page {page} is empty, the report has {pages} page(s) of {limit} rows.')
+        elif rows > limit:
+            print(f'Rows {first + 1} to {min(first + limit, rows)} of {rows} (page {page} of {pages}). Use --page to show another page.')
+
+
+def print_unknown_costs(sales:int, treatment:str):
+    """Prints how many sales with an unknown buy price (see unknown_costs()) the report left out of its costs, when there are any
+    """
+    if sales:
+        print(f'Warning: {sales} sale(s) with an unknown buy price are {treatment}. Their bought items don\'t exist.\n')
+
+
+def get_inventory_report(option:str='today', date=None, export:bool=None, product:str=None, file_type:str=None, **view):
     """Helper function for making the inventory report on the right date. 
-    It calculates the right date based on the current system date and passes the on to the make_inventory_table() function
+    It calculates the right date based on the current system date and passes the on to the make_inventory_table() function.
+    The view arguments (limit, sort_by, page) are passed on as well
     """
     now = read_system_date()
     if date:
-        return make_inventory_table(date, export=export, product=product, file_type=file_type)
+        return make_inventory_table(date, export=export, product=product, file_type=file_type, **view)
     validate_dates()
     if option.lower() == 'yesterday':
         yesterday = now - timedelta(1)
-        return make_inventory_table(yesterday, export=export, product=product, file_type=file_type)
-    return make_inventory_table(now, export=export, product=product, file_type=file_type)
+        return make_inventory_table(yesterday, export=export, product=product, file_type=file_type, **view)
+    return make_inventory_table(now, export=export, product=product, file_type=file_type, **view)
 
 
-def make_inventory_table(date, export:bool=None, product:str=None, file_type:str=None):
+def make_inventory_table(date, export:bool=None, product:str=None, file_type:str=None, limit:int=None, sort_by:str=None, page:int=1):
     """Prints the inventory details from the given date as pivot table. When a product name is passed
     as argument a table with details about the given product will be printed. If the product wasn't in stock the table will be empty. 
     Optionally the data will be exported. By default as csv. The file type can be set by using the file_type argument.  
+    The summary can be sorted and split in pages with the limit, sort_by and page arguments, the totals are calculated over all products
     """
     clear_console()
     logo()
-    index_list = get_bought_ids(date) # get all ids sold before or on the given date
-    df = pd.read_csv(BOUGHT_CSV) 
+    sold = load_history(SOLD_CSV, date)
+    index_list = sold.loc[sold['sell_date'] <= pd.Timestamp(date), 'bought_id'] # get all ids sold before or on the given date
+    df = load_history(BOUGHT_CSV, date) 
 
-    # assigning datetime datatype to columns
-    df['buy_date'] = pd.to_datetime(df['buy_date']).dt.date 
-    df['expiration_date'] = pd.to_datetime(df['expiration_date']).dt.date 
+    # assigning date datatype to columns
+    df['buy_date'] = df['buy_date'].dt.date 
+    df['expiration_date'] = df['expiration_date'].dt.date 
     
     df = df[~df['id'].isin(index_list)] # leave out items from index_list (the sold items)
     df = df[(df['expiration_date']>= date)] # expiration date greater or equal to given date
@@ -48,16 +123,9 @@ def make_inventory_table(date, export:bool=None, product:str=None, file_type:str
 
     df = df.drop('id', axis=1) # remove id column from report
 
-    if export:
-        filename = set_export_data(name='inventory', date=date, format=file_type)
-        if file_type == 'xlsx':
-            df.to_excel(filename, index=False)
-        else:    
-            df.to_csv(filename, index=False)
-
-    # new dataframe to display details per product
+    # new dataframe to display details per product, filtered on the product id
     if product:
-        product_table = df[(df['product_name'] == product.lower())]
+        product_table = to_decimals(add_product_names(df[(df['product_id'] == get_product_id(product, create=False))]))
         product_table = product_table.rename(columns={
             'product_name': 'Product name',
             'buy_date': 'Buy date',
@@ -68,6 +136,14 @@ def make_inventory_table(date, export:bool=None, product:str=None, file_type:str
         print(f'\nInventory on {date} for product {product}:') 
         print(tabulate(product_table, headers='keys', tablefmt='psql', floatfmt='.2f', showindex=False),'\n')
 
+    df = add_product_names(df)
+    if export:
+        filename = set_export_data(name='inventory', date=date, format=file_type)
+        if file_type == 'xlsx':
+            to_decimals(df).to_excel(filename, index=False)
+        else:    
+            to_decimals(df).to_csv(filename, index=False)
+
     df = df.assign(new1='') # creating a new column before renaming it
     df = df.rename(columns={
         'product_name': 'Product name',
@@ -88,33 +164,36 @@ def make_inventory_table(date, export:bool=None, product:str=None, file_type:str
         }, 
         fill_value=0
         )
+    summary = to_decimals(summary, ['Total value'])
 
     ui_sounds('success')
     print(f'\nInventory summary on {date}:')
-    print(tabulate(summary, headers='keys', tablefmt='psql', floatfmt='.2f'),'\n') # print the summary
+    print_table(summary, total='TOTALS', limit=limit, sort_by=sort_by, page=page, floatfmt='.2f') # print the summary
+    print()
     if export:
         statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
 
 
-def get_revenue_report(start_date, end_date, export:bool=None, profit:bool=None, file_type:str='csv'):
+def get_revenue_report(start_date, end_date, export:bool=None, profit:bool=None, file_type:str='csv', limit:int=None, sort_by:str=None, page:int=1):
     """Prints the revenue details over the given time frame per product as a table. Optionally the data will be exported. By default as csv.
     The file type can be set by using the file_type argument.  
-    At the bottom a table with the revenue per day will be printed.
+    The table per product can be sorted and split in pages with the limit, sort_by and page arguments.
+    At the bottom a table with the revenue per day will be printed, with the total revenue over all products.
     """
     compare_dates(start_date, end_date)
     if not profit:
         clear_console()
         logo()
     
-    df = pd.read_csv(SOLD_CSV)
-    df['sell_date'] = pd.to_datetime(df['sell_date']).dt.date 
+    df = load_history(SOLD_CSV, start_date)
+    df['sell_date'] = df['sell_date'].dt.date 
 
     date_filter = (df['sell_date'] >= start_date) & (df['sell_date'] <= end_date) 
     df = df.loc[date_filter]
 
-    # returns total revenue, amount of items and the dataframe to be used in the profit report
+    # returns total revenue in cents, amount of items and the dataframe to be used in the profit report
     if profit:
-        df = df.drop(['id', 'product_name'], axis=1)
+        df = df[['bought_id', 'sell_date', 'sell_price', 'product_id', 'buy_date', 'buy_price']]
         df = df.rename(columns={
             'bought_id': 'id'
         })
@@ -122,15 +201,16 @@ def get_revenue_report(start_date, end_date, export:bool=None, profit:bool=None,
         return df['sell_price'].sum(), rows, df
 
 
-    df = df.drop(['bought_id', 'id'], axis=1) # remove columns from dataframe
+    df = df.drop(['bought_id', 'id', 'buy_date', 'buy_price'], axis=1) # remove columns from dataframe
+    df = add_product_names(df)
 
     if export:
         date_string = date_to_string(start_date) + '-' + date_to_string(end_date)
         filename = set_export_data(name='revenue', date=date_string, format=file_type)
         if file_type == 'xlsx':
-            df.to_excel(filename, index=False)
+            to_decimals(df).to_excel(filename, index=False)
         else:    
-            df.to_csv(filename, index=False)
+            to_decimals(df).to_csv(filename, index=False)
     
     # new column and rename other columns for display purposes
     df = df.assign(new1='')
@@ -156,9 +236,9 @@ def get_revenue_report(start_date, end_date, export:bool=None, profit:bool=None,
     
     # pivot table for printing revenue per day
     column_order = ['Total items', 'Revenue']
-    overview = overview.reindex(column_order, axis=1)
+    overview = to_decimals(overview.reindex(column_order, axis=1), ['Revenue'])
     print(f'Revenue overview from {start_date} to {end_date}:')
-    print(tabulate(overview, headers='keys', tablefmt='psql', floatfmt='.2f'))
+    print_table(overview, limit=limit, sort_by=sort_by, page=page, floatfmt='.2f')
 
     summary = pd.pivot_table(
         df,
@@ -171,6 +251,7 @@ def get_revenue_report(start_date, end_date, export:bool=None, profit:bool=None,
         }, 
         fill_value=0
         )
+    summary = to_decimals(summary, ['Revenue'])
     ui_sounds('success')
     print(f'\n\nRevenue summary from {start_date} to {end_date}:')
     print(tabulate(summary, headers='keys', tablefmt='psql', floatfmt='.2f'),'\n')
@@ -179,22 +260,24 @@ def get_revenue_report(start_date, end_date, export:bool=None, profit:bool=None,
         statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
 
 
-def get_profit_report(start_date, end_date, export:bool=None, file_type:str='csv'):
+def get_profit_report(start_date, end_date, export:bool=None, file_type:str='csv', limit:int=None, sort_by:str=None, page:int=1):
     """Prints the profit details over the given time frame. The generated report gives an overview in two perspectives:
     - Profit based on total revenue minus the total costs over the given time frame
     - Profit based on the sold items only, per product
 
     Optionally the data will be exported. By default as csv. The file type can be set by using the file_type argument. At the bottom a table with the revenue per day will be printed.
+    The table per product can be sorted and split in pages with the limit, sort_by and page arguments, the totals are calculated over all products.
+    Sales with an unknown buy price are left out of the profit per product, their amount is printed below the table.
     """
     compare_dates(start_date, end_date)
     clear_console()
     logo()
     
-    df = pd.read_csv(BOUGHT_CSV)
-    df_bought = df
+    df = load_history(BOUGHT_CSV, start_date)
 
     # assign date value to columns
-    df['buy_date'] = pd.to_datetime(df['buy_date']).dt.date 
+    df['buy_date'] = df['buy_date'].dt.date 
+    df['expiration_date'] = df['expiration_date'].dt.date 
 
     # set date filter to given time frame
     date_filter = (df['buy_date'] >= start_date) & (df['buy_date'] <= end_date)  
@@ -204,13 +287,13 @@ def get_profit_report(start_date, end_date, export:bool=None, file_type:str='csv
     revenue, items_sold, df_sold = get_revenue_report(start_date, end_date, export=False, profit=True)
     items_bought = df.shape[0]
 
-    # data for dataframe
+    # data for dataframe, the amounts are summed in cents and shown as decimals
     data = {
         'Items bought': items_bought,
         'Items sold': [items_sold],
-        'Costs': [costs],
-        'Revenue': [revenue],
-        'Profit': [revenue - costs],
+        'Costs': [costs / 100],
+        'Revenue': [revenue / 100],
+        'Profit': [(revenue - costs) / 100],
         'Margin': [(revenue - costs)/revenue]
     }
 
@@ -223,18 +306,20 @@ def get_profit_report(start_date, end_date, export:bool=None, file_type:str='csv
     print(f'\nProfit report based on sold items vs bought items, from {start_date} to {end_date:}')
     print(tabulate(totals, headers='keys', tablefmt='psql', floatfmt=fl_format, showindex=False),'\n')
   
-    # merge bought and sold data
-    mrg = df_sold.merge(df_bought, on='id', how='left')
-
-    # calculate profit and margin + round to two decimals
+    # the sold rows hold the buy date and buy price of every item, so no join with the bought data is needed. Sales with an unknown
+    # buy price are left out
+    unknown = unknown_costs(df_sold)
+    mrg = df_sold[~unknown].rename(columns={'buy_price': 'price'})
+    mrg['buy_date'] = mrg['buy_date'].dt.date
+    mrg = add_product_names(mrg)
+
+    # calculate profit and margin, the profit in cents is exact so nothing needs to be rounded
     mrg['profit'] = mrg['sell_price'] - mrg['price']
-    mrg['profit'] = mrg['profit'].round(2)
     mrg['margin'] = mrg['profit'] / mrg['sell_price']
-    mrg['margin'] = mrg['margin'].round(2)
 
     # export to file    
     if export:
-        export_df = mrg
+        export_df = to_decimals(mrg, PRICE_COLUMNS + ('profit',)).assign(margin=mrg['margin'].round(2))
         export_df  = export_df.drop('id', axis=1)
         date_string = date_to_string(start_date) + '-' + date_to_string(end_date)
         filename = set_export_data(name='profit', date=date_string, format=file_type)
@@ -272,10 +357,434 @@ def get_profit_report(start_date, end_date, export:bool=None, file_type:str='csv
         fill_value=0
         )
     column_order = ['Items', 'Buy price', 'Sell price', 'Profit', 'Margin']
-    overview = overview.reindex(column_order, axis=1)
+    overview = to_decimals(overview.reindex(column_order, axis=1), ['Buy price', 'Sell price', 'Profit'])
 
     print(f'\nProfit report based on sold items only, from {start_date} to {end_date:}')
-    print(tabulate(overview, headers='keys', tablefmt='psql', floatfmt=fl_format, showindex=True),'\n')
+    print_table(overview, total='TOTAL', limit=limit, sort_by=sort_by, page=page, floatfmt=fl_format, showindex=True)
+    print()
+    print_unknown_costs(int(unknown.sum()), 'left out of the profit per product')
 
     if export:
-        statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
\ No newline at end of file
+        statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
+
+
+def summarize_lots(df, items:str, value:str):
+    """Returns a pivot table with the amount of lots and their total buy price per product, or None when there are no lots.
+    The items and value arguments are used as column names
+    """
+    if df.empty:
+        return None
+    df = df.assign(new1='')
+    df = df.rename(columns={
+        'product_name': 'Product name',
+        'new1': items,
+        'price': value
+    })
+    summary = pd.pivot_table(
+        df,
+        values=[value, items],
+        index=['Product name'],
+        margins=True,
+        margins_name='TOTALS',
+        aggfunc={
+            value: 'sum',
+            items: 'count'
+        },
+        fill_value=0
+        )
+    return to_decimals(summary.reindex([items, value], axis=1), [value])
+
+
+def get_expiring_report(within:int, export:bool=None, product:str=None, file_type:str='csv', limit:int=None, sort_by:str=None, page:int=1):
+    """Prints the unsold items that expire within the given amount of days from the current system date, with the days left per item
+    and a summary of the value at risk per product. The lots are taken from the expiry index, so only the matching lots are read.
+    Optionally the data will be exported. By default as csv. The file type can be set by using the file_type argument.
+    The list of items can be sorted and split in pages with the limit, sort_by and page arguments, the summary covers all items.
+    """
+    clear_console()
+    logo()
+    now = read_system_date()
+    last = now + timedelta(within)
+    df = pd.DataFrame(get_expiring_lots(now, within), columns=list(BOUGHT_HEADER))
+    if product:
+        df = df[(df['product_id'] == get_product_id(product, create=False))]
+    df = add_product_names(df.drop('id', axis=1))
+    df['days_left'] = [(expiration_date - now).days for expiration_date in df['expiration_date']]
+
+    if export:
+        filename = set_export_data(name='expiring', date=date_to_string(now), format=file_type)
+        if file_type == 'xlsx':
+            to_decimals(df).to_excel(filename, index=False)
+        else:
+            to_decimals(df).to_csv(filename, index=False)
+
+    details = to_decimals(df).rename(columns={
+        'product_name': 'Product name',
+        'buy_date': 'Buy date',
+        'price': 'Buy price',
+        'expiration_date': 'Expiration date',
+        'days_left': 'Days left'
+    })
+    print(f'\nItems expiring from {now} to {last}:')
+    print_table(details, limit=limit, sort_by=sort_by, page=page, floatfmt='.2f', showindex=False)
+    print()
+
+    summary = summarize_lots(df, 'Total items', 'Value at risk')
+    ui_sounds('success')
+    if summary is None:
+        print(f'No items expire from {now} to {last}.\n')
+    else:
+        print(f'Expiring summary from {now} to {last}:')
+        print(tabulate(summary, headers='keys', tablefmt='psql', floatfmt='.2f'),'\n')
+    if export:
+        statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
+
+
+def get_waste_report(start_date=None, within:int=None, export:bool=None, file_type:str='csv', limit:int=None, sort_by:str=None, page:int=1):
+    """Prints the items that expired unsold before the current system date (written off) per product. With a start date only items that
+    expired on or after that date are included. When the within argument is passed a forecast of the items that will expire unsold within
+    that amount of days is printed as well, based on the current stock.
+    Optionally the written off items will be exported. By default as csv. The file type can be set by using the file_type argument.
+    The written off items per product can be sorted and split in pages with the limit, sort_by and page arguments, the totals are calculated over all products.
+    """
+    now = read_system_date()
+    if start_date:
+        compare_dates(start_date, now)
+    clear_console()
+    logo()
+    df = pd.DataFrame(get_expired_lots(now, start_date) + get_archived_expired_lots(now, start_date), columns=list(BOUGHT_HEADER))
+    df = add_product_names(df.drop('id', axis=1))
+
+    if export:
+        date_string = (date_to_string(start_date) + '-' if start_date else '') + date_to_string(now)
+        filename = set_export_data(name='waste', date=date_string, format=file_type)
+        if file_type == 'xlsx':
+            to_decimals(df).to_excel(filename, index=False)
+        else:
+            to_decimals(df).to_csv(filename, index=False)
+
+    period = f'from {start_date} to {now - timedelta(1)}' if start_date else f'before {now}'
+    summary = summarize_lots(df, 'Items written off', 'Value written off')
+    ui_sounds('success')
+    if summary is None:
+        print(f'\nNo items expired unsold {period}.\n')
+    else:
+        print(f'\nItems expired unsold {period}:')
+        print_table(summary, total='TOTALS', limit=limit, sort_by=sort_by, page=page, floatfmt='.2f')
+        print()
+
+    if within:
+        forecast = pd.DataFrame(get_expiring_lots(now, within), columns=list(BOUGHT_HEADER))
+        forecast = summarize_lots(add_product_names(forecast.drop('id', axis=1)), 'Items at risk', 'Value at risk')
+        if forecast is None:
+            print(f'No items will expire from {now} to {now + timedelta(within)}.\n')
+        else:
+            print(f'Waste forecast: items in stock that expire from {now} to {now + timedelta(within)} when they are not sold:')
+            print(tabulate(forecast, headers='keys', tablefmt='psql', floatfmt='.2f'),'\n')
+    if export:
+        statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
+
+
+def get_top_report(start_date, end_date, n:int=10, measure:str='units', bottom:bool=False, export:bool=None, file_type:str='csv', chunksize:int=100000):
+    """Prints the best (or with bottom=True the slowest) selling n products over the given time frame, ranked by units, revenue or profit.
+    The sold.csv file (and its archive, when the time frame starts before the archive cutoff) is read in chunks and the totals per product
+    are updated per chunk, so only the running totals are kept in memory.
+    The ranking is taken from the totals with a heap of size n instead of sorting all products.
+    For the profit ranking the costs are the buy prices stored in the sold rows, sales with an unknown buy price are left out. For the slowest products, products that were in stock during the
+    time frame without being sold are ranked as well.
+    Optionally the ranking will be exported. By default as csv. The file type can be set by using the file_type argument.
+    """
+    compare_dates(start_date, end_date)
+    clear_console()
+    logo()
+    first, last = date_to_string(start_date), date_to_string(end_date)
+    totals = {} # product id -> [units, revenue, costs], the amounts in cents
+    left_out = 0 # sales with an unknown buy price, not ranked by profit
+
+    if bottom:
+        for chunk in read_chunks(BOUGHT_CSV, start_date, chunksize):
+            in_stock = chunk[(chunk['buy_date'] <= last) & (chunk['expiration_date'] >= first)] # dates are compared as YYYY-MM-DD strings
+            for product_id in in_stock['product_id'].unique():
+                totals.setdefault(product_id, [0, 0, 0])
+
+    for chunk in read_chunks(SOLD_CSV, start_date, chunksize):
+        chunk = chunk[(chunk['sell_date'] >= first) & (chunk['sell_date'] <= last)]
+        if measure == 'profit':
+            unknown = unknown_costs(chunk)
+            left_out += int(unknown.sum())
+            chunk = chunk[~unknown].assign(cost=chunk['buy_price'])
+        else:
+            chunk = chunk.assign(cost=0)
+        grouped = chunk.groupby('product_id').agg(units=('sell_price', 'size'), revenue=('sell_price', 'sum'), cost=('cost', 'sum'))
+        for product_id, units, revenue, cost in grouped.itertuples():
+            total = totals.setdefault(product_id, [0, 0, 0])
+            total[0] += int(units)
+            total[1] += int(revenue)
+            total[2] += int(cost)
+
+    key = {
+        'units': lambda item: item[1][0],
+        'revenue': lambda item: item[1][1],
+        'profit': lambda item: item[1][1] - item[1][2]
+        }[measure]
+    ranking = (heapq.nsmallest if bottom else heapq.nlargest)(n, totals.items(), key=key)
+
+    names = get_product_names()
+    columns = ['Rank', 'Product name', 'Units', 'Revenue'] + (['Costs', 'Profit'] if measure == 'profit' else [])
+    rows = []
+    for rank, (product_id, (units, revenue, cost)) in enumerate(ranking, start=1):
+        row = [rank, names.get(product_id, product_id), units, revenue / 100]
+        if measure == 'profit':
+            row += [cost / 100, (revenue - cost) / 100]
+        rows.append(row)
+
+    if export:
+        filename = set_export_data(name='top', date=first + '-' + last, format=file_type)
+        export_df = pd.DataFrame(rows, columns=columns)
+        if file_type == 'xlsx':
+            export_df.to_excel(filename, index=False)
+        else:
+            export_df.to_csv(filename, index=False)
+
+    ui_sounds('success')
+    print(f'\n{"Slowest" if bottom else "Top"} {n} products by {measure} from {start_date} to {end_date} ({len(totals)} products ranked):')
+    print(tabulate(rows, headers=columns, tablefmt='psql', floatfmt='.2f'),'\n')
+    print_unknown_costs(left_out, 'left out of the ranking')
+    if export:
+        statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
+
+
+def get_reorder_report(days:int=28, cover:int=7, alpha:float=0.3, export:bool=None, file_type:str='csv', limit:int=None, sort_by:str=None, page:int=1):
+    """Prints a reorder suggestion per product, based on the sales of the last given amount of days up to the current system date.
+
+    The sold.csv file is read once into a product x day matrix. The daily sales rate of all products is forecasted in one pass over the
+    matrix, as the moving average over the whole period and with exponential smoothing (alpha sets the weight of the most recent day).
+    The forecast is joined with the current stock from the expiry index to get the days of stock left and the amount to order to
+    cover the given amount of days. Only products that need to be ordered are printed, the export contains all products.
+    The suggestions are sorted on days of stock left, unless sort_by is passed, and can be split in pages with the limit and page arguments.
+    """
+    clear_console()
+    logo()
+    now = read_system_date()
+    first = now - timedelta(days - 1)
+
+    df = load_history(SOLD_CSV, first)
+    df = df[(df['sell_date'] >= pd.Timestamp(first)) & (df['sell_date'] <= pd.Timestamp(now))]
+    stock = pd.Series([lot['product_id'] for lot in get_stock_lots(now)], dtype='int64').value_counts()
+
+    # one row per product that was sold or is in stock, one column per day
+    product_ids = np.union1d(df['product_id'].unique(), stock.index.to_numpy())
+    sales = np.zeros((len(product_ids), days))
+    rows = np.searchsorted(product_ids, df['product_id'].to_numpy())
+    columns = (df['sell_date'] - pd.Timestamp(first)).dt.days.to_numpy()
+    np.add.at(sales, (rows, columns), 1)
+
+    moving_average = sales.mean(axis=1)
+    smoothed = sales[:, 0]
+    for day_sales in sales.T[1:]:
+        smoothed = alpha * day_sales + (1 - alpha) * smoothed
+
+    in_stock = stock.reindex(product_ids, fill_value=0).to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_left = np.where(smoothed > 0, in_stock / smoothed, np.inf)
+    order = np.maximum(np.ceil(smoothed * cover - in_stock), 0).astype(int)
+
+    names = get_product_names()
+    result = pd.DataFrame({
+        'Product name': [names.get(product_id, product_id) for product_id in product_ids],
+        'Stock': in_stock,
+        'Sold per day (avg)': moving_average,
+        'Sold per day (forecast)': smoothed,
+        'Days of stock left': days_left,
+        'Order amount': order
+    })
+
+    if export:
+        filename = set_export_data(name='reorder', date=date_to_string(now), format=file_type)
+        if file_type == 'xlsx':
+            result.to_excel(filename, index=False)
+        else:
+            result.to_csv(filename, index=False)
+
+    result = result[result['Order amount'] > 0].sort_values(by=['Days of stock left', 'Order amount'], ascending=[True, False])
+    ui_sounds('success')
+    print(f'\nReorder suggestions on {now} to cover {cover} days, based on the sales from {first} to {now}:')
+    print_table(result, limit=limit, sort_by=sort_by, page=page, floatfmt='.2f', showindex=False)
+    print()
+    if export:
+        statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
+
+
+def get_compare_report(periods:list, measure:str='revenue', export:bool=None, file_type:str='csv', limit:int=None, sort_by:str=None, page:int=1):
+    """Prints a comparison of two or more time frames, given as (first, last) date tuples. The first time frame is the base: per product the
+    chosen measure (units, revenue, cost or profit) is printed per time frame, with the change of the last time frame compared to the base.
+
+    The sold rows of all time frames are loaded once, tagged with their time frame (a row falls in every time frame that contains its sell date)
+    and the units, revenue and costs per product and time frame are calculated with a single groupby. The costs are the buy prices stored in the sold rows.
+    Sales with an unknown buy price count in the units and revenue, but not in the costs and profit.
+    Optionally all measures will be exported. By default as csv. The file type can be set by using the file_type argument.
+    The table per product can be sorted and split in pages with the limit, sort_by and page arguments, the totals are calculated over all products.
+    """
+    if len(periods) < 2:
+        clear_console()
+        sys.exit('Error: Enter at least two time frames to compare, for example: -p 2023-09-01 2023-09-07 -p 2023-09-08 2023-09-14.\n')
+    for first, last in periods:
+        compare_dates(first, last)
+    clear_console()
+    logo()
+    earliest, latest = min(first for first, last in periods), max(last for first, last in periods)
+    labels = [f'P{number}' for number in range(1, len(periods) + 1)]
+
+    df = load_history(SOLD_CSV, earliest)
+    df = df[(df['sell_date'] >= pd.Timestamp(earliest)) & (df['sell_date'] <= pd.Timestamp(latest))]
+    unknown = unknown_costs(df)
+    df = df.assign(cost=df['buy_price'].where(~unknown, 0), known_revenue=df['sell_price'].where(~unknown, 0))
+    tagged = pd.concat([
+        df[(df['sell_date'] >= pd.Timestamp(first)) & (df['sell_date'] <= pd.Timestamp(last))].assign(period=label)
+        for label, (first, last) in zip(labels, periods)
+        ])
+
+    # one row per product, one column per measure and time frame
+    grouped = tagged.groupby(['product_id', 'period']).agg(units=('sell_price', 'size'), revenue=('sell_price', 'sum'), cost=('cost', 'sum'),
+                                                           known_revenue=('known_revenue', 'sum'))
+    grouped['profit'] = grouped['known_revenue'] - grouped['cost'] # over the sales with a known buy price only
+    measures = ['units', 'revenue', 'cost', 'profit']
+    table = grouped.unstack('period').reindex(columns=pd.MultiIndex.from_product([measures, labels]), fill_value=0).fillna(0).astype('int64')
+    for name in measures:
+        table[(name, 'change')] = table[(name, labels[-1])] - table[(name, labels[0])]
+    table.index = table.index.map(get_product_names())
+    table.index.name = 'Product name'
+    table = table.sort_index()
+
+    if export:
+        export_df = table.copy()
+        for name in measures[1:]: # the amounts in cents
+            export_df[name] = export_df[name] / 100
+        export_df.columns = [f'{name}_{label.lower()}' for name, label in export_df.columns]
+        date_string = date_to_string(earliest) + '-' + date_to_string(latest)
+        filename = set_export_data(name='compare', date=date_string, format=file_type)
+        if file_type == 'xlsx':
+            export_df.to_excel(filename)
+        else:
+            export_df.to_csv(filename)
+
+    overview = table[measure].rename(columns={'change': 'Change'})
+    overview = pd.concat([overview, overview.sum().to_frame('TOTAL').T]).rename_axis('Product name')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = pd.Series(np.where(overview[labels[0]] != 0, overview['Change'] / overview[labels[0]], np.nan), index=overview.index)
+    overview['Change %'] = change.astype(object).where(change.notna(), None) # tabulate prints None as missingval, but a float NaN as nan%
+    if measure != 'units':
+        overview = to_decimals(overview, [*labels, 'Change'])
+
+    totals = grouped.groupby('period').sum().reindex(labels, fill_value=0)
+    summary = pd.DataFrame({
+        'Time frame': labels,
+        'First': [first for first, last in periods],
+        'Last': [last for first, last in periods],
+        'Items sold': totals['units'].to_numpy(),
+        'Revenue': totals['revenue'].to_numpy() / 100,
+        'Costs': totals['cost'].to_numpy() / 100,
+        'Profit': totals['profit'].to_numpy() / 100
+    })
+
+    ui_sounds('success')
+    print('\nTime frames:')
+    print(tabulate(summary, headers='keys', tablefmt='psql', floatfmt='.2f', showindex=False),'\n')
+    print(f'{measure.capitalize()} per product, change from {labels[0]} to {labels[-1]}:')
+    print_table(overview, total='TOTAL', limit=limit, sort_by=sort_by, page=page, floatfmt=['', *['.2f'] * (len(labels) + 1), '.1%'], missingval='-')
+    print()
+    print_unknown_costs(int(unknown.sum()), 'counted in the units and revenue, but left out of the costs and profit')
+    if export:
+        statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
+
+
+def get_stock_history(start_date, end_date, product_id:int=None)-> tuple:
+    """Returns the items in stock and their value per product and day over the given time frame, as two dataframes with a row per product
+    and a column per day. A lot is in stock from its buy date up to the day it was sold or up to and including its expiration date,
+    the same rules as the inventory report.
+
+    Instead of filtering the ledgers once per day, every lot becomes two events: +1 on the day it enters the stock and -1 on the day it leaves.
+    The events are summed per product and day, which sorts them once, and a cumulative sum over the days gives the stock on every day.
+    Events before the time frame are moved to its first day, so that day starts with the stock at that moment. The value is in cents
+    """
+    first, last = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    bought = load_history(BOUGHT_CSV, start_date)
+    sold = load_history(SOLD_CSV, start_date)
+    if product_id is not None:
+        bought = bought[bought['product_id'] == product_id]
+
+    # a lot leaves the stock on the day of its first sale, or the day after its expiration date
+    first_sale = bought['id'].map(sold.groupby('bought_id')['sell_date'].min())
+    end = (bought['expiration_date'] + pd.Timedelta(days=1)).where(first_sale.isna() | (first_sale > bought['expiration_date']), first_sale)
+    lots = bought.assign(start=bought['buy_date'], end=end)
+    lots = lots[(lots['start'] < lots['end']) & (lots['start'] <= last) & (lots['end'] > first)]
+
+    events = pd.concat([
+        pd.DataFrame({'product_id': lots['product_id'], 'day': lots['start'], 'items': 1, 'value': lots['price']}),
+        pd.DataFrame({'product_id': lots['product_id'], 'day': lots['end'], 'items': -1, 'value': -lots['price']})
+        ])
+    events = events[events['day'] <= last].assign(day=lambda df: df['day'].clip(lower=first))
+    changes = events.groupby(['product_id', 'day']).sum()
+
+    days = pd.date_range(first, last)
+    items = changes['items'].unstack('day').reindex(columns=days).fillna(0).cumsum(axis=1).astype(int)
+    value = changes['value'].unstack('day').reindex(columns=days).fillna(0).cumsum(axis=1).astype('int64')
+    return items, value
+
+
+def get_stock_history_report(start_date, end_date, product:str=None, export:bool=None, file_type:str='csv', limit:int=None, sort_by:str=None, page:int=1):
+    """Prints the stock level over the given time frame: the items in stock and their value per day and, without a product, a summary per product
+    with the stock at the start and end of the time frame and the lowest, highest and average stock. The stock per product and day is calculated
+    with a single sweep over the buy, sell and expiry events, see get_stock_history().
+    Optionally the stock per product and day will be exported, leaving out the days a product wasn't in stock. By default as csv.
+    The file type can be set by using the file_type argument.
+    The summary per product can be sorted and split in pages with the limit, sort_by and page arguments, the totals are calculated over all products.
+    """
+    compare_dates(start_date, end_date)
+    clear_console()
+    logo()
+    product_id = get_product_id(product, create=False) if product else None
+    if product and product_id is None:
+        sys.exit(f'Error: Product {product} is not in the catalog.\n')
+    items, value = get_stock_history(start_date, end_date, product_id)
+
+    if export:
+        export_df = pd.DataFrame({'items': items.stack(), 'value': value.stack()})
+        export_df = export_df[export_df['items'] != 0].rename_axis(['product_id', 'date']).reset_index()
+        export_df['date'] = export_df['date'].dt.date
+        export_df = to_decimals(add_product_names(export_df[['date', 'product_id', 'items', 'value']]), ['value'])
+        date_string = date_to_string(start_date) + '-' + date_to_string(end_date)
+        filename = set_export_data(name='stock-history', date=date_string, format=file_type)
+        if file_type == 'xlsx':
+            export_df.to_excel(filename, index=False)
+        else:
+            export_df.to_csv(filename, index=False)
+
+    daily = pd.DataFrame({
+        'Date': items.columns.date,
+        'Items in stock': items.sum().to_numpy(dtype=int),
+        'Stock value': value.sum().to_numpy() / 100
+        })
+
+    ui_sounds('success')
+    if not product:
+        summary = pd.DataFrame({
+            'Start': items.iloc[:, 0],
+            'End': items.iloc[:, -1],
+            'Lowest': items.min(axis=1),
+            'Highest': items.max(axis=1),
+            'Average': items.mean(axis=1),
+            'End value': value.iloc[:, -1] / 100
+            })
+        summary.index = summary.index.map(get_product_names())
+        summary = summary.sort_index()
+        total = daily['Items in stock']
+        summary.loc['TOTAL'] = [total.iloc[0], total.iloc[-1], total.min(), total.max(), total.mean(), daily['Stock value'].iloc[-1]]
+        summary = summary.rename_axis('Product name')
+        print(f'Stock per product from {start_date} to {end_date}:')
+        print_table(summary, total='TOTAL', limit=limit, sort_by=sort_by, page=page, floatfmt=['', '.0f', '.0f', '.0f', '.0f', '.1f', '.2f'])
+        print()
+    print(f'Stock per day from {start_date} to {end_date}{f" for product {product}" if product else ""}:')
+    print(tabulate(daily, headers='keys', tablefmt='psql', floatfmt='.2f', showindex=False), '\n')
+    if export:
+        statement_printer(f'===> Generated report at: {filename}', sleep=0.01)
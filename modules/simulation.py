@@ -0,0 +1,139 @@
+# module for simulating multiple days of buying and selling in memory
+import json
+import random
+import time
+from datetime import timedelta
+from tabulate import tabulate
+from .functions import read_bought_rows, read_sold_rows, read_system_date, find_available_lots, generate_id, date_to_string, ordinal_to_string, BoughtRow
+from .catalog import load_catalog, get_product_id
+from .config import statement_printer, write_config
+from .const import BOUGHT_CSV, SOLD_CSV, TODAY_TXT, BOUGHT_HEADER, SOLD_HEADER, to_cents, format_cents, write_rows, write_date, ledger_lock, logo, clear_console
+from .feed import emit, rows_to_events
+from .csv_creator import random_price, random_exp_date, set_sell_price
+
+
+def random_scenario(days:int, buys:int, sells:int, items:int, amount:int)-> list:
+    """Generates a rate based scenario: every day the given amount of buy and sell operations for a random selection of products.
+    The operations have the same format as a scenario script
+    """
+    products = random.sample(list(load_catalog()), min(items, len(load_catalog())))
+    prices = {product: random_price() for product in products}
+    operations = []
+    for day in range(days):
+        for x in range(buys):
+            product = random.choice(products)
+            operations.append({'day': day, 'action': 'buy', 'product': product, 'price': prices[product], 'amount': random.randint(1, amount)})
+        for x in range(sells):
+            product = random.choice(products)
+            operations.append({'day': day, 'action': 'sell', 'product': product, 'price': set_sell_price(prices[product]), 'amount': random.randint(1, amount)})
+    return operations
+
+
+def read_scenario(script)-> list:
+    """Reads a scenario script: a json file with a list of operations, for example:
+    [{"day": 0, "action": "buy", "product": "banana", "price": 0.5, "amount": 20, "shelf_life": 10},
+     {"day": 1, "action": "sell", "product": "banana", "price": 1.2, "amount": 3}]
+    The day is counted from the current system date. Without shelf_life a random expiration date is used
+    """
+    with open(script, 'r') as file:
+        return sorted(json.load(file), key=lambda operation: operation['day'])
+
+
+def run_simulation(operations:list, days:int, dry_run:bool=False):
+    """Runs the operations against an in-memory copy of the ledgers, day by day, starting at the current system date.
+    Sell operations use the same allocation rules as the sell command. Sales that can't be fully delivered are counted as short
+    and not registered, like the sell command does.
+
+    The new rows are written with one group commit per ledger at the end and the system date is moved to the last simulated day.
+    With dry_run nothing is written. Returns a dictionary with the statistics of the run
+    """
+    start_date = read_system_date()
+    bought = read_bought_rows()
+    sold_ids = {row.bought_id for row in read_sold_rows()}
+    buy_id, sell_id = generate_id(BOUGHT_CSV), generate_id(SOLD_CSV)
+    new_bought, new_sold = [], []
+    unknown = {} # products that are not in the catalog during a dry run get a temporary id
+
+    # lots per product in file order, so each sale only scans the lots of its own product
+    lots = {}
+    first_day = start_date.toordinal()
+    for row in bought:
+        if row.id not in sold_ids and row.expiration_date >= first_day:
+            lots.setdefault(row.product_id, []).append(row)
+
+    stats = {'Buy operations': 0, 'Sell operations': 0, 'Items bought': 0, 'Items sold': 0, 'Short sales': 0}
+    day_operations = {}
+    for operation in operations:
+        day_operations.setdefault(operation['day'], []).append(operation)
+
+    start = time.perf_counter()
+    for day in range(days):
+        date = start_date + timedelta(day)
+        for operation in day_operations.get(day, []):
+            # only buys add new products to the catalog, selling an unknown product is a short sale
+            create = operation['action'] == 'buy' and not dry_run
+            product_id = get_product_id(operation['product'], create=create) or unknown.setdefault(operation['product'], -len(unknown) - 1)
+            price = to_cents(operation['price'])
+            if operation['action'] == 'buy':
+                if 'shelf_life' in operation:
+                    expiration_date = date + timedelta(operation['shelf_life'])
+                else:
+                    expiration_date = random_exp_date(date)
+                for x in range(operation['amount']):
+                    row = BoughtRow(buy_id, product_id, date.toordinal(), price, expiration_date.toordinal())
+                    lots.setdefault(product_id, []).append(row)
+                    new_bought.append(row.to_csv())
+                    buy_id += 1
+                stats['Buy operations'] += 1
+                stats['Items bought'] += operation['amount']
+            else:
+                available = find_available_lots(lots.get(product_id, []), product_id, sold_ids, date, operation['amount'])
+                stats['Sell operations'] += 1
+                if len(available) < operation['amount']:
+                    stats['Short sales'] += 1
+                    continue
+                for row in available:
+                    sold_ids.add(row.id)
+                    new_sold.append([sell_id, row.id, product_id, date_to_string(date), format_cents(price), ordinal_to_string(row.buy_date), format_cents(row.price)])
+                    sell_id += 1
+                stats['Items sold'] += operation['amount']
+        # drop sold and expired lots at the end of the day
+        ordinal = date.toordinal()
+        for product_id, product_lots in lots.items():
+            lots[product_id] = [row for row in product_lots if row.id not in sold_ids and row.expiration_date > ordinal]
+    elapsed = time.perf_counter() - start
+
+    if not dry_run:
+        write_rows(BOUGHT_CSV, new_bought, rows_to_events('buy', BOUGHT_HEADER, new_bought))
+        write_rows(SOLD_CSV, new_sold, rows_to_events('sell', SOLD_HEADER, new_sold))
+        end_date = date_to_string(start_date + timedelta(days - 1))
+        write_date(TODAY_TXT, end_date)
+        emit('date', {'from': str(start_date), 'to': end_date})
+        write_config(adv_time=True)
+
+    operations_count = stats['Buy operations'] + stats['Sell operations']
+    stats['Seconds'] = round(elapsed, 3)
+    stats['Operations per second'] = round(operations_count / elapsed) if elapsed else operations_count
+    stats['Items per second'] = round((stats['Items bought'] + stats['Items sold']) / elapsed) if elapsed else 0
+    return stats
+
+
+def simulate(days:int, buys:int=20, sells:int=100, items:int=50, amount:int=5, script=None, dry_run:bool=False, seed:int=None):
+    """Simulates the given amount of days of trading, either from a scenario script or from a random scenario with the given amount
+    of buy and sell operations per day, and prints the statistics of the run
+    """
+    random.seed(seed)
+    start_date = read_system_date()
+    operations = read_scenario(script) if script else random_scenario(days, buys, sells, items, amount)
+    if dry_run:
+        stats = run_simulation(operations, days, dry_run)
+    else:
+        with ledger_lock(): # other processes can't change the ledgers between reading and writing them
+            stats = run_simulation(operations, days, dry_run)
+    clear_console()
+    logo()
+    mode = 'Dry run' if dry_run else 'Simulation'
+    print(f'{mode} from {start_date} to {start_date + timedelta(days - 1)}:')
+    print(tabulate([stats.values()], headers=list(stats.keys()), tablefmt='psql'), '\n')
+    if not dry_run:
+        statement_printer(f'===> The ledgers have been updated and the date is now set to {read_system_date()}.', sound='success')
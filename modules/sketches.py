@@ -0,0 +1,407 @@
+# module for the daily sketches of the ledgers: small, mergeable summaries per day that answer the approximate reports over any date range
+import json
+import math
+import os
+import time
+import numpy as np
+import pandas as pd
+from datetime import date
+from tabulate import tabulate
+from .const import BOUGHT_CSV, SOLD_CSV, SKETCH_DIR, SKETCH_DAYS, SKETCH_PRICES, SKETCH_STATE, atomic_write, ledger_lock, logo, clear_console
+from .config import ui_sounds
+from .indexes import ledger_size, ledger_tail, appended_since
+from .binary import BOUGHT_DTYPE, SOLD_DTYPE, EPOCH_ORDINAL, appended_records, frame_to_records
+from .archive import ledger_files
+from .loader import stream_csv
+from .catalog import get_product_names
+from .reporting import compare_dates, print_table, print_unknown_costs, to_decimals
+
+
+SKETCH_VERSION = 2 # sketches of another version are rebuilt
+HLL_PRECISION = 12 # the distinct product sketch has 2 ** 12 registers, a standard error of 1.04 / sqrt(4096) = 1.6%
+HLL_REGISTERS = 2 ** HLL_PRECISION
+CMS_DEPTH = 4 # rows of the count-min sketches: an estimate is within the error bound with a probability of 1 - e ** -4 = 98.2%
+CMS_WIDTH = 256 # counters per row: an estimate is at most e / 256 = 1.1% of the total too high
+# the count-min sketches per day: items sold and sell price of all sales per product, and items, sell price, buy price and margin of the sales
+# with a known buy price (see unknown_costs())
+CMS_VALUES = ('items', 'revenue', 'costed_items', 'costed_revenue', 'costs', 'margins')
+MARGIN_SCALE = 1000000 # the margin of every sale is summed as integer in millionths, so it merges like the amounts
+PRICE_ACCURACY = 0.01 # the price buckets are 2% wide, so a price quantile is within 1% of the true price
+GAMMA = (1 + PRICE_ACCURACY) / (1 - PRICE_ACCURACY)
+QUANTILES = (0.5, 0.9) # the price quantiles that are shown per product
+
+# one record per day with a day ordinal (date.toordinal()): the exact totals in cents, the registers of the distinct product sketch
+# (HyperLogLog) and the count-min sketches of CMS_VALUES. Every part is merged over days by adding, or taking the maximum of the registers
+DAY_DTYPE = np.dtype([
+    ('day', '<i4'),
+    ('items_bought', '<i8'),
+    ('costs', '<i8'),
+    ('items_sold', '<i8'),
+    ('revenue', '<i8'),
+    ('costed_items', '<i8'),
+    ('costed_revenue', '<i8'),
+    ('sold_costs', '<i8'),
+    ('margins', '<i8'),
+    ('products', 'u1', (HLL_REGISTERS,)),
+    ('cms', '<i8', (len(CMS_VALUES), CMS_DEPTH, CMS_WIDTH))
+    ])
+SUM_FIELDS = ('items_bought', 'costs', 'items_sold', 'revenue', 'costed_items', 'costed_revenue', 'sold_costs', 'margins', 'cms')
+
+# the amount of sales per day, product and price bucket. Rows with the same key are added up when the sketches are merged
+PRICE_DTYPE = np.dtype([
+    ('day', '<i4'),
+    ('product_id', '<i4'),
+    ('bucket', '<i2'),
+    ('count', '<i8')
+    ])
+
+
+def mix(values:np.ndarray, seed:int)-> np.ndarray:
+    """Returns a 64 bit hash per value (splitmix64), a different hash function for every seed
+    """
+    with np.errstate(over='ignore'):
+        x = values.astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def bit_length(values:np.ndarray)-> np.ndarray:
+    """Returns the amount of bits needed for every 64 bit value, like int.bit_length(). Both halves are converted to float exactly
+    """
+    high, low = (values >> np.uint64(32)).astype(np.float64), (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+def hll_positions(product_ids:np.ndarray)-> tuple:
+    """Returns the register and the rank of every product id in the distinct product sketch: the first HLL_PRECISION bits of the hash
+    choose the register, the position of the first 1 bit after them is the rank
+    """
+    hashes = mix(product_ids, 0)
+    registers = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    rest = hashes << np.uint64(HLL_PRECISION)
+    ranks = np.where(rest > 0, 65 - bit_length(rest), 65 - HLL_PRECISION)
+    return registers, ranks.astype(np.uint8)
+
+
+def estimate_distinct(registers:np.ndarray)-> float:
+    """Returns the estimated amount of distinct products of the merged registers, with linear counting for small amounts
+    """
+    alpha = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+    estimate = alpha * HLL_REGISTERS ** 2 / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * HLL_REGISTERS and zeros:
+        return HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+    return float(estimate)
+
+
+def cms_columns(product_ids:np.ndarray)-> np.ndarray:
+    """Returns the counter of every product id in each row of the count-min sketches, as array of CMS_DEPTH rows
+    """
+    return np.stack([(mix(product_ids, row + 1) % np.uint64(CMS_WIDTH)).astype(np.int64) for row in range(CMS_DEPTH)])
+
+
+def estimate_values(cms:np.ndarray, product_ids:np.ndarray)-> np.ndarray:
+    """Returns the estimates of CMS_VALUES per product id from the merged count-min sketches: the lowest counter of the product over
+    the rows, since other products can only add to a counter
+    """
+    columns = cms_columns(product_ids)
+    return np.stack([cms[:, row, columns[row]] for row in range(CMS_DEPTH)]).min(axis=0)
+
+
+def price_buckets(prices:np.ndarray)-> np.ndarray:
+    """Returns the price bucket of every price in cents. Bucket i (from 1) holds the prices from GAMMA ** (i - 2) up to GAMMA ** (i - 1),
+    bucket 0 the prices of 0 cents
+    """
+    buckets = np.zeros(len(prices), dtype=np.int16)
+    positive = prices > 0
+    buckets[positive] = np.ceil(np.log(prices[positive]) / math.log(GAMMA)).astype(np.int16) + 1
+    return buckets
+
+
+def bucket_prices(buckets:np.ndarray)-> np.ndarray:
+    """Returns the price in cents that represents each bucket, the value with the same relative distance to both bounds
+    """
+    return np.where(buckets > 0, 2 * GAMMA ** (buckets - 1.0) / (GAMMA + 1), 0.0)
+
+
+def add_days(target:np.ndarray, positions:np.ndarray, records:np.ndarray):
+    """Merges the day records into the records of target at the given positions, also when target is mapped from the file
+    """
+    for field in SUM_FIELDS:
+        np.add.at(target[field], positions, records[field])
+    np.maximum.at(target['products'], positions, records['products'])
+
+
+def merge_days(records:np.ndarray)-> np.ndarray:
+    """Returns the day records with one record per day, sorted on day
+    """
+    days, positions = np.unique(records['day'], return_inverse=True)
+    merged = np.zeros(len(days), dtype=DAY_DTYPE)
+    merged['day'] = days
+    add_days(merged, positions, records)
+    return merged
+
+
+def merge_prices(prices:np.ndarray)-> np.ndarray:
+    """Returns the price records with the counts of the same day, product and bucket added up
+    """
+    df = pd.DataFrame(prices).groupby(['day', 'product_id', 'bucket'], as_index=False)['count'].sum()
+    merged = np.zeros(len(df), dtype=PRICE_DTYPE)
+    for name in PRICE_DTYPE.names:
+        merged[name] = df[name].to_numpy()
+    return merged
+
+
+def build_sketches(sold:np.ndarray, bought:np.ndarray)-> tuple:
+    """Returns the day records and the price records of the given rows of sold.csv and bought.csv, as records of their binary dtype.
+    The sales are first summed per day and product, so the sketches are updated once per product instead of once per sale.
+    Sales with an unknown buy price only count in the items and revenue of all sales
+    """
+    known = sold['buy_date'] != EPOCH_ORDINAL # the binary ledgers store an empty buy date as EPOCH_ORDINAL
+    sales = pd.DataFrame({'day': sold['sell_date'], 'product_id': sold['product_id'], 'revenue': sold['sell_price'], 'costed_items': known.astype('int64')})
+    sales['costed_revenue'] = sales['revenue'].where(known, 0)
+    sales['costs'] = pd.Series(sold['buy_price'], index=sales.index).where(known, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margins = (sales['revenue'] - sales['costs']) / sales['revenue'] * MARGIN_SCALE
+    sales['margins'] = margins.where(known & (sales['revenue'] > 0), 0).round().astype('int64')
+    per_product = sales.groupby(['day', 'product_id'], as_index=False).agg(
+        items=('revenue', 'size'), revenue=('revenue', 'sum'), costed_items=('costed_items', 'sum'), costed_revenue=('costed_revenue', 'sum'),
+        costs=('costs', 'sum'), margins=('margins', 'sum'))
+    per_day = per_product.groupby('day')[list(CMS_VALUES)].sum()
+    purchases = pd.DataFrame({'day': bought['buy_date'], 'price': bought['price']}).groupby('day')['price'].agg(['size', 'sum'])
+
+    records = np.zeros(len(per_day.index.union(purchases.index)), dtype=DAY_DTYPE)
+    records['day'] = per_day.index.union(purchases.index).to_numpy()
+    bought_positions = np.searchsorted(records['day'], purchases.index.to_numpy())
+    records['items_bought'][bought_positions], records['costs'][bought_positions] = purchases['size'], purchases['sum']
+    sold_positions = np.searchsorted(records['day'], per_day.index.to_numpy())
+    records['items_sold'][sold_positions] = per_day['items']
+    records['revenue'][sold_positions], records['sold_costs'][sold_positions] = per_day['revenue'], per_day['costs']
+    records['costed_items'][sold_positions], records['costed_revenue'][sold_positions] = per_day['costed_items'], per_day['costed_revenue']
+    records['margins'][sold_positions] = per_day['margins']
+
+    positions = np.searchsorted(records['day'], per_product['day'].to_numpy())
+    product_ids = per_product['product_id'].to_numpy()
+    registers, ranks = hll_positions(product_ids)
+    np.maximum.at(records['products'], (positions, registers), ranks)
+    columns = cms_columns(product_ids)
+    for value, name in enumerate(CMS_VALUES):
+        for row in range(CMS_DEPTH):
+            np.add.at(records['cms'], (positions, value, row, columns[row]), per_product[name].to_numpy())
+
+    prices = np.zeros(len(sold), dtype=PRICE_DTYPE)
+    prices['day'], prices['product_id'] = sold['sell_date'], sold['product_id']
+    prices['bucket'], prices['count'] = price_buckets(sold['sell_price']), 1
+    return records, merge_prices(prices)
+
+
+def read_sketch_state():
+    """Returns the saved state of the sketches, or None when there are no sketches of the current version or an update was interrupted
+    """
+    if not os.path.exists(SKETCH_STATE):
+        return None
+    with open(SKETCH_STATE, 'r') as file:
+        state = json.load(file)
+    if state.get('version') != SKETCH_VERSION or state.get('dirty'):
+        return None
+    for path, dtype, key in ((SKETCH_DAYS, DAY_DTYPE, 'days'), (SKETCH_PRICES, PRICE_DTYPE, 'prices')):
+        if ledger_size(path) != state[key] * dtype.itemsize:
+            return None
+    return state
+
+
+def write_sketch_state(days:int, prices:int, dirty:bool=False):
+    """Saves the amount of records of both sketch files and the size and tail of both ledgers they cover. An update that changes
+    records in place is marked as dirty first, so the sketches are rebuilt when it was interrupted
+    """
+    state = {'version': SKETCH_VERSION, 'days': days, 'prices': prices, 'dirty': dirty}
+    for name, csv_file in (('sold', SOLD_CSV), ('bought', BOUGHT_CSV)):
+        size = ledger_size(csv_file)
+        state[name] = [size, ledger_tail(csv_file, size)]
+    atomic_write(SKETCH_STATE, json.dumps(state))
+
+
+def rebuild_sketches():
+    """Writes the sketches from scratch, reading both ledgers and their archive in chunks. Used the first time and when a ledger
+    was rewritten, for example by compact or backfill
+    """
+    days, prices = np.zeros(0, dtype=DAY_DTYPE), [np.zeros(0, dtype=PRICE_DTYPE)]
+    empty = {SOLD_CSV: np.zeros(0, dtype=SOLD_DTYPE), BOUGHT_CSV: np.zeros(0, dtype=BOUGHT_DTYPE)}
+    for csv_file, dtype in ((SOLD_CSV, SOLD_DTYPE), (BOUGHT_CSV, BOUGHT_DTYPE)):
+        for path in ledger_files(csv_file):
+            for chunk in stream_csv(path):
+                rows = {**empty, csv_file: frame_to_records(chunk, dtype)}
+                chunk_days, chunk_prices = build_sketches(rows[SOLD_CSV], rows[BOUGHT_CSV])
+                days = merge_days(np.concatenate([days, chunk_days]))
+                prices.append(chunk_prices)
+    prices = merge_prices(np.concatenate(prices))
+    os.makedirs(SKETCH_DIR, exist_ok=True)
+    write_sketch_state(0, 0, dirty=True)
+    atomic_write(SKETCH_DAYS, days.tobytes())
+    atomic_write(SKETCH_PRICES, prices.tobytes())
+    write_sketch_state(len(days), len(prices))
+
+
+def update_sketches(state:dict):
+    """Adds the rows that were appended to both ledgers since the state was saved. Days that already have a record are updated
+    in place, new days and the price records are appended
+    """
+    sold, bought = appended_records(SOLD_CSV, state['sold'][0]), appended_records(BOUGHT_CSV, state['bought'][0])
+    if not len(sold) and not len(bought):
+        return
+    records, prices = build_sketches(sold, bought)
+    write_sketch_state(state['days'], state['prices'], dirty=True)
+    existing = np.memmap(SKETCH_DAYS, dtype=DAY_DTYPE, mode='r+') if state['days'] else np.zeros(0, dtype=DAY_DTYPE)
+    positions = pd.Index(existing['day']).get_indexer(records['day'])
+    found = positions >= 0
+    if found.any():
+        add_days(existing, positions[found], records[found])
+        existing.flush()
+    del existing
+    for path, new in ((SKETCH_DAYS, records[~found]), (SKETCH_PRICES, prices)):
+        with open(path, 'ab') as file:
+            file.write(new.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+    write_sketch_state(state['days'] + int((~found).sum()), state['prices'] + len(prices))
+
+
+def sync_sketches():
+    """Brings the sketches up to date with the ledgers: rows appended since the last sync are added, a rewritten ledger, an interrupted
+    update or missing sketches cause a rebuild
+    """
+    with ledger_lock(): # no process can append to the ledgers meanwhile
+        state = read_sketch_state()
+        if state and all(appended_since(csv_file, *state[name]) for name, csv_file in (('sold', SOLD_CSV), ('bought', BOUGHT_CSV))):
+            update_sketches(state)
+        else:
+            rebuild_sketches()
+
+
+def merge_sketches(start_date, end_date)-> dict:
+    """Returns the sketches of the days from start_date up to and including end_date merged into one: the exact totals, the revenue per day,
+    the registers of the distinct product sketch, the count-min sketches and the sales per product and price bucket. Only the records of
+    the range are read from the mapped files. The time of the merge in seconds is included
+    """
+    sync_sketches()
+    start = time.perf_counter()
+    first, last = start_date.toordinal(), end_date.toordinal()
+    days = np.memmap(SKETCH_DAYS, dtype=DAY_DTYPE, mode='r') if ledger_size(SKETCH_DAYS) else np.zeros(0, dtype=DAY_DTYPE)
+    days = days[(days['day'] >= first) & (days['day'] <= last)]
+    prices = np.memmap(SKETCH_PRICES, dtype=PRICE_DTYPE, mode='r') if ledger_size(SKETCH_PRICES) else np.zeros(0, dtype=PRICE_DTYPE)
+    prices = pd.DataFrame(prices[(prices['day'] >= first) & (prices['day'] <= last)])
+    merged = {field: int(days[field].sum()) for field in SUM_FIELDS if field != 'cms'}
+    sold_days = np.sort(days[days['items_sold'] > 0][['day', 'revenue']], order='day')
+    merged['per_day'] = {date.fromordinal(int(day)): int(revenue) for day, revenue in zip(sold_days['day'], sold_days['revenue'])}
+    merged['days'] = len(days)
+    merged['products'] = days['products'].max(axis=0) if len(days) else np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    merged['cms'] = days['cms'].sum(axis=0)
+    merged['prices'] = prices.groupby(['product_id', 'bucket'], as_index=False)['count'].sum()
+    merged['seconds'] = time.perf_counter() - start
+    return merged
+
+
+def price_quantiles(prices)-> pd.DataFrame:
+    """Returns the QUANTILES of the sell price in cents per product id, from the sales per product and price bucket
+    """
+    prices = prices.sort_values(['product_id', 'bucket'])
+    cumulative = prices.groupby('product_id')['count'].cumsum()
+    totals = prices.groupby('product_id')['count'].transform('sum')
+    quantiles = pd.DataFrame(index=pd.Index(prices['product_id'].unique(), name='product_id'))
+    for quantile in QUANTILES:
+        rank = np.floor(quantile * (totals - 1)) # the rank of the quantile within the sales of the product, counted from 0
+        holds = (cumulative > rank) & (cumulative - prices['count'] <= rank) # the one bucket per product that holds the rank
+        quantiles[f'p{quantile * 100:g}'] = pd.Series(bucket_prices(prices['bucket'][holds].to_numpy()).round(), index=prices['product_id'][holds].to_numpy())
+    return quantiles
+
+
+def product_estimates(merged:dict)-> pd.DataFrame:
+    """Returns the estimates of CMS_VALUES, with the amounts in cents, and the price quantiles per product sold in the merged range,
+    with the product names as index. The products sold are known from the price buckets, so products without sales don't show up
+    """
+    product_ids = merged['prices']['product_id'].unique()
+    estimates = pd.DataFrame(estimate_values(merged['cms'], product_ids).T, columns=CMS_VALUES, index=pd.Index(product_ids, name='product_id'))
+    estimates = estimates.join(price_quantiles(merged['prices']))
+    estimates.index = estimates.index.map(get_product_names()).rename('Product name')
+    return estimates
+
+
+def print_bounds(merged:dict, amount:str):
+    """Prints the distinct product estimate and the error bounds of the estimates per product. The amount is the name of the estimated
+    money column
+    """
+    distinct = estimate_distinct(merged['products'])
+    error = 1.04 / math.sqrt(HLL_REGISTERS)
+    epsilon = math.e / CMS_WIDTH
+    probability = 1 - math.exp(-CMS_DEPTH)
+    money = epsilon * (merged['costed_revenue'] + merged['sold_costs'] if amount == 'profit' else merged['revenue']) / 100
+    print(f'Distinct products sold: about {distinct:.0f} (within {2 * error:.1%}, 95% confidence).')
+    print(f'Per product the items are at most {epsilon * merged["items_sold"]:.0f} and the {amount} at most {money:.2f} off, with {probability:.1%} probability. '
+          f'The price quantiles are within {PRICE_ACCURACY:.0%} of the true price.')
+    print(f'Estimated from {merged["days"]} daily sketch(es), merged in {merged["seconds"] * 1000:.1f} ms. The totals are exact.\n')
+
+
+def get_approx_revenue_report(start_date, end_date, limit:int=None, sort_by:str=None, page:int=1):
+    """Prints an estimate of the revenue report over the given time frame from the daily sketches, without reading the ledgers. The table
+    per product shows the estimated items and revenue and the median and 90th percentile sell price, sorted on revenue so the best sellers
+    come first. The revenue per day and the totals are exact. The error bounds are printed below the tables
+    """
+    compare_dates(start_date, end_date)
+    clear_console()
+    logo()
+    merged = merge_sketches(start_date, end_date)
+
+    estimates = product_estimates(merged).sort_values('revenue', ascending=False, kind='stable')
+    overview = estimates.rename(columns={'items': 'Total items', 'revenue': 'Revenue', 'p50': 'Median price', 'p90': 'P90 price'})
+    overview = to_decimals(overview[['Total items', 'Revenue', 'Median price', 'P90 price']], ['Revenue', 'Median price', 'P90 price'])
+    print(f'Approximate revenue overview from {start_date} to {end_date}:')
+    print_table(overview, limit=limit, sort_by=sort_by, page=page, floatfmt='.2f')
+
+    summary = pd.DataFrame({'Revenue': list(merged['per_day'].values()) + [merged['revenue']]}, index=pd.Index(list(merged['per_day']) + ['TOTAL REVENUE'], name='Date'))
+    summary = to_decimals(summary, ['Revenue'])
+    ui_sounds('success')
+    print(f'\n\nRevenue summary from {start_date} to {end_date}:')
+    print(tabulate(summary, headers='keys', tablefmt='psql', floatfmt='.2f'), '\n')
+    print_bounds(merged, 'revenue')
+
+
+def get_approx_profit_report(start_date, end_date, limit:int=None, sort_by:str=None, page:int=1):
+    """Prints an estimate of the profit report over the given time frame from the daily sketches, without reading the ledgers. The totals
+    of bought versus sold items are exact. The table per product shows the estimated items, buy and sell price and profit, sorted on profit.
+    The margin is the average margin per sold item, like in the exact report. Sales with an unknown buy price are left out of the table per
+    product, their amount is printed below it. The error bounds are printed below the tables
+    """
+    compare_dates(start_date, end_date)
+    clear_console()
+    logo()
+    merged = merge_sketches(start_date, end_date)
+
+    revenue, costs = merged['revenue'], merged['costs']
+    fl_format = ['.0f', '.0f', '.2f', '.2f', '.2f', '.2%']
+    totals = pd.DataFrame({
+        'Items bought': [merged['items_bought']],
+        'Items sold': [merged['items_sold']],
+        'Costs': [costs / 100],
+        'Revenue': [revenue / 100],
+        'Profit': [(revenue - costs) / 100],
+        'Margin': [(revenue - costs) / revenue if revenue else 0]
+        })
+    ui_sounds('success')
+    print(f'\nProfit report based on sold items vs bought items, from {start_date} to {end_date}')
+    print(tabulate(totals, headers='keys', tablefmt='psql', floatfmt=fl_format, showindex=False), '\n')
+
+    estimates = product_estimates(merged)
+    estimates = estimates[estimates['costed_items'] > 0]
+    estimates['profit'] = estimates['costed_revenue'] - estimates['costs']
+    estimates.loc['TOTAL'] = {'costed_items': merged['costed_items'], 'costed_revenue': merged['costed_revenue'], 'costs': merged['sold_costs'],
+                              'profit': merged['costed_revenue'] - merged['sold_costs'], 'margins': merged['margins']}
+    estimates['margin'] = (estimates['margins'] / MARGIN_SCALE / estimates['costed_items']).fillna(0)
+    overview = estimates.sort_values('profit', ascending=False, kind='stable').rename(columns={
+        'costed_items': 'Items', 'costs': 'Buy price', 'costed_revenue': 'Sell price', 'profit': 'Profit', 'margin': 'Margin'})
+    overview = to_decimals(overview[['Items', 'Buy price', 'Sell price', 'Profit', 'Margin']], ['Buy price', 'Sell price', 'Profit'])
+    print(f'\nApproximate profit report based on sold items only, from {start_date} to {end_date}')
+    print_table(overview, total='TOTAL', limit=limit, sort_by=sort_by, page=page, floatfmt=fl_format, showindex=True)
+    print()
+    print_unknown_costs(merged['items_sold'] - merged['costed_items'], 'left out of the profit per product')
+    print_bounds(merged, 'profit')
@@ -2,4 +2,5 @@ from modules.main import main
 
 #import main function
 
-main()
\ No newline at end of file
+if __name__ == '__main__': # required for the worker processes that load large ledgers
+    main()
\ No newline at end of file